@@ -115,7 +115,9 @@ class StoragePool(Resource):
                'nr_volumes': self.info['nr_volumes'],
                'autostart': self.info['autostart'],
                'persistent': self.info['persistent'],
-               'in_use': self.info['in_use']}
+               'in_use': self.info['in_use'],
+               'last_refresh': self.info['last_refresh'],
+               'refresh_duration': self.info['refresh_duration']}
 
         val = self.info.get('task_id')
         if val:
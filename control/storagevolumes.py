@@ -17,6 +17,8 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
+import cherrypy
+
 from wok import template
 from wok.control.base import AsyncCollection, Collection, Resource
 from wok.control.utils import get_class_name, model_fn
@@ -50,6 +52,19 @@ class StorageVolumes(AsyncCollection):
             'pool': self.pool.encode('utf-8') if self.pool else '',
         })
 
+    def _get_resources(self, flag_filter):
+        # Build all the volumes information in a single pass instead of
+        # looking up each volume separately
+        if flag_filter.pop('_detailed', None) != 'true':
+            return super(StorageVolumes, self)._get_resources(flag_filter)
+
+        res_list = []
+        for info in self.model.storagevolume_lookup_all(self.pool):
+            res = self.resource(self.model, self.pool, info['name'])
+            res.info = info
+            res_list.append(res)
+        return res_list
+
     def filter_data(self, resources, fields_filter):
         # filter directory from storage volumes
         fields_filter.update({'type': ['file', 'block', 'network']})
@@ -67,7 +82,9 @@ class StorageVolume(Resource):
         self.uri_fmt = '/storagepools/%s/storagevolumes/%s'
         self.resize = self.generate_action_handler('resize', ['size'])
         self.wipe = self.generate_action_handler('wipe')
-        self.clone = self.generate_action_handler_task('clone')
+        self.clone = self.generate_action_handler_task(
+            'clone', ['pool', 'name', 'mode'])
+        self.download = StorageVolumeDownload(model, pool, ident)
 
         # set user log messages and make sure all parameters are present
         self.log_map = STORAGEVOLUME_REQUESTS
@@ -88,7 +105,7 @@ class StorageVolume(Resource):
                'isvalid': self.info['isvalid'],
                'has_permission': self.info['has_permission']}
 
-        for key in ('os_version', 'os_distro', 'bootable', 'base'):
+        for key in ('os_version', 'os_distro', 'bootable', 'base', 'upload'):
             val = self.info.get(key)
             if val:
                 res[key] = val
@@ -96,6 +113,25 @@ class StorageVolume(Resource):
         return res
 
 
+class StorageVolumeDownload(Resource):
+    def __init__(self, model, pool, ident):
+        super(StorageVolumeDownload, self).__init__(model, ident)
+        self.pool = pool
+        self.model_args = [self.pool, self.ident]
+        self.admin_methods = ['GET']
+
+    def get(self):
+        self.lookup()
+        headers = cherrypy.response.headers
+        headers['Content-Type'] = 'application/octet-stream'
+        headers['Content-Length'] = str(self.info['size'])
+        headers['Content-Disposition'] = 'attachment; filename="%s"' % \
+            self.ident.encode('utf-8')
+        # Do not hold the volume content in memory
+        cherrypy.response.stream = True
+        return self.info['content']
+
+
 class IsoVolumes(Collection):
     def __init__(self, model, pool):
         super(IsoVolumes, self).__init__(model)
@@ -17,6 +17,8 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
+import cherrypy
+
 from wok.control.base import AsyncCollection, Resource
 from wok.control.utils import internal_redirect, UrlSubNode
 
@@ -58,12 +60,26 @@ class VMs(AsyncCollection):
         self.log_map = VMS_REQUESTS
         self.log_args.update({'name': '', 'template': ''})
 
+    def _get_resources(self, flag_filter):
+        # Build all the VMs information in a single pass instead of looking
+        # up each VM separately
+        if flag_filter.pop('_detailed', None) != 'true':
+            return super(VMs, self)._get_resources(flag_filter)
+
+        res_list = []
+        for info in self.model.vm_lookup_all():
+            res = self.resource(self.model, info['name'])
+            res.info = info
+            res_list.append(res)
+        return res_list
+
 
 class VM(Resource):
     def __init__(self, model, ident):
         super(VM, self).__init__(model, ident)
         self.screenshot = VMScreenShot(model, ident)
         self.virtviewerfile = VMVirtViewerFile(model, ident)
+        self.statshistory = VMStatsHistory(model, ident)
         self.uri_fmt = '/vms/%s'
         for ident, node in sub_nodes.items():
             setattr(self, ident, node(model, self.ident))
@@ -75,7 +91,7 @@ class VM(Resource):
         self.reset = self.generate_action_handler('reset',
                                                   destructive=True)
         self.connect = self.generate_action_handler('connect')
-        self.clone = self.generate_action_handler_task('clone')
+        self.clone = self.generate_action_handler_task('clone', ['mode'])
         self.migrate = self.generate_action_handler_task('migrate',
                                                          ['remote_host',
                                                           'user',
@@ -104,6 +120,20 @@ class VMScreenShot(Resource):
         raise internal_redirect(internal_uri)
 
 
+class VMStatsHistory(Resource):
+    def __init__(self, model, ident):
+        super(VMStatsHistory, self).__init__(model, ident)
+
+    def get(self):
+        window = cherrypy.request.params.get('window')
+        self.model_args = [self.ident, window]
+        return super(VMStatsHistory, self).get()
+
+    @property
+    def data(self):
+        return self.info
+
+
 class VMVirtViewerFile(Resource):
     def __init__(self, model, ident):
         super(VMVirtViewerFile, self).__init__(model, ident)
@@ -147,6 +147,10 @@ messages = {
     "KCHVM0089E": _("Unable to setup password-less login at remote host %(host)s using user %(user)s: remote directory %(sshdir)s does not exist."),
     "KCHVM0090E": _("Unable to create a password-less libvirt connection to the remote libvirt daemon at host %(host)s with the user %(user)s. Please verify the remote server libvirt configuration. More information: http://libvirt.org/auth.html ."),
     "KCHVM0091E": _("'enable_rdma' must be of type boolean (true or false)."),
+    "KCHVM0092E": _("Invalid statistics history window %(window)s. It must be a positive number of seconds."),
+    "KCHVM0093E": _("Virtual machine clone mode must be 'full', 'linked' or 'reflink'."),
+    "KCHVM0094E": _("Unable to delete virtual machine %(name)s. Its disks are the backing stores of the linked clones %(clones)s. Delete them first."),
+    "KCHVM0095E": _("Unable to start virtual machine %(name)s. Its disks are the backing stores of the linked clones %(clones)s and must not be changed."),
 
     "KCHVMHDEV0001E": _("VM %(vmid)s does not contain directly assigned host device %(dev_name)s."),
     "KCHVMHDEV0002E": _("The host device %(dev_name)s is not allowed to directly assign to VM."),
@@ -285,6 +289,12 @@ messages = {
     "KCHVOL0027E": _("The storage volume %(vol)s is not under an upload process."),
     "KCHVOL0028E": _("The upload chunk data will exceed the storage volume size."),
     "KCHVOL0029E": _("Unable to upload chunk data to storage volume. Details: %(err)s."),
+    "KCHVOL0030E": _("Unable to upload chunk data at offset %(offset)s while too many previous chunks are missing. Send it again later."),
+    "KCHVOL0031E": _("The upload chunk offset must be a non-negative integer number."),
+    "KCHVOL0032E": _("Unable to download storage volume '%(name)s' from pool '%(pool)s'. Details: %(err)s"),
+    "KCHVOL0033E": _("Storage volume clone mode must be 'full', 'linked' or 'reflink'."),
+    "KCHVOL0034E": _("Linked clones can only be created in storage pools of type 'dir' or 'netfs'. Unable to create one in pool '%(pool)s'."),
+    "KCHVOL0035E": _("Storage volume %(name)s is the backing store of the linked clones %(clones)s. It can not be changed nor deleted while they exist."),
 
     "KCHIFACE0001E": _("Interface %(name)s does not exist"),
     "KCHIFACE0002E": _("Failed to list interfaces. Invalid _inuse parameter. Supported options for _inuse are: %(supported_inuse)s"),
@@ -376,9 +386,9 @@ messages = {
     "KCHCONN0002E": _("Libvirt service is not active. Please start the libvirt service in your host system."),
 
     "KCHEVENT0001E": _("Failed to register the default event implementation."),
-    "KCHEVENT0002E": _("Failed to register timeout event."),
     "KCHEVENT0003E": _("Failed to Run the default event implementation."),
     "KCHEVENT0004W": _("I/O error on guest '%(vm)s': storage pool out of space for %(devAlias)s (%(srcPath)s)."),
+    "KCHEVENT0005W": _("Unreachable NFS servers: %(server)s. Storage pools %(pools)s are inaccessible."),
 
     # These messages (ending with L) are for user log purposes
     "KCHNET0001L": _("Create virtual network '%(name)s' type '%(connection)s'"),
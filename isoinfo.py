@@ -19,17 +19,20 @@
 
 import contextlib
 import glob
+import httplib
 import os
 import platform
 import re
+import socket
 import stat
 import struct
 import sys
 import urllib2
+from urlparse import urljoin, urlparse
 
 
 from wok.exception import IsoFormatError, OperationFailed
-from wok.plugins.kimchi.utils import check_url_path
+from wok.plugins.kimchi.utils import check_url_path, MAX_REDIRECTION_ALLOWED
 from wok.utils import wok_log
 
 
@@ -126,6 +129,237 @@ iso_dir = [
 ]
 
 
+# Sectors fetched after the ones read from a remote ISO image, as the next
+# reads of a scan are usually close to the previous ones
+REMOTE_READAHEAD = 16
+# Sectors missing between two reads fetched by a single request
+REMOTE_COALESCE_GAP = 16
+# Most sectors kept in the cache of a remote ISO image
+REMOTE_CACHE_SECTORS = 1024
+REMOTE_TIMEOUT = 15
+
+
+class RemoteIsoReader(object):
+    """
+    Read an ISO image over HTTP(S) through a single keep-alive connection.
+
+    open() follows the redirections once and gets the size of the image.
+    The data is then fetched by whole sectors, which are cached: the
+    sectors missing for a read, along with REMOTE_READAHEAD sectors after
+    them, are fetched by a single ranged request, several ranges being
+    asked at once (multipart/byteranges) when the read spans cached
+    sectors.
+    """
+    SECTOR_SIZE = 2048
+    REDIRECTIONS = (301, 302, 303, 307, 308)
+
+    def __init__(self, url):
+        self.url = url
+        self.size = None
+        self._conn = None
+        self._netloc = None
+        self._sectors = {}
+
+    def _connect(self, url):
+        result = urlparse(url)
+        netloc = (result.scheme, result.netloc)
+        if self._conn is not None and self._netloc == netloc:
+            return
+
+        self.close()
+        if result.scheme == 'https':
+            self._conn = httplib.HTTPSConnection(result.netloc,
+                                                 timeout=REMOTE_TIMEOUT)
+        else:
+            self._conn = httplib.HTTPConnection(result.netloc,
+                                                timeout=REMOTE_TIMEOUT)
+        self._netloc = netloc
+
+    def _request(self, method, headers=None):
+        """
+        Send a request for the image, and return the response. The request
+        is sent again on a new connection when the server closed the
+        previous one in the meanwhile.
+        """
+        result = urlparse(self.url)
+        path = result.path or '/'
+        if result.query:
+            path += '?' + result.query
+
+        for retry in (True, False):
+            self._connect(self.url)
+            try:
+                self._conn.request(method, path, headers=headers or {})
+                return self._conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                self.close()
+                if not retry:
+                    raise
+
+    def open(self):
+        """
+        Resolve the redirections of the URL and get the size of the image.
+        Return False when the image can not be reached.
+        """
+        try:
+            for i in range(MAX_REDIRECTION_ALLOWED + 1):
+                response = self._request('HEAD')
+                response.read()
+                if response.status == 200:
+                    length = response.getheader('content-length')
+                    if length is not None:
+                        self.size = int(length)
+                    return True
+
+                location = response.getheader('location')
+                if response.status not in self.REDIRECTIONS or \
+                        location is None:
+                    break
+                self.url = urljoin(self.url, location)
+        except (httplib.HTTPException, socket.error, ValueError), e:
+            wok_log.debug('Unable to reach ISO %s: %s', self.url, str(e))
+
+        self.close()
+        return False
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _get_runs(self, first, last):
+        """
+        Return the (first, last) sectors of the runs to fetch for a read of
+        the sectors 'first' to 'last'
+        """
+        runs = []
+        for sector in xrange(first, last + 1):
+            if sector in self._sectors:
+                continue
+            if runs and sector - runs[-1][1] <= REMOTE_COALESCE_GAP + 1:
+                runs[-1][1] = sector
+            else:
+                runs.append([sector, sector])
+
+        if runs:
+            runs[-1][1] += REMOTE_READAHEAD
+            if self.size is not None:
+                runs[-1][1] = min(runs[-1][1],
+                                  (self.size - 1) / self.SECTOR_SIZE)
+        return [run for run in runs if run[0] <= run[1]]
+
+    def _parse_multipart(self, response, boundary):
+        body = response.read()
+        delimiter = '--' + boundary
+        parts = []
+        pos = body.find(delimiter)
+        while pos != -1 and not body.startswith(delimiter + '--', pos):
+            headers_end = body.find('\r\n\r\n', pos)
+            if headers_end == -1:
+                break
+            match = re.search(r'content-range:\s*bytes (\d+)-(\d+)',
+                              body[pos:headers_end], re.IGNORECASE)
+            if match is None:
+                raise httplib.HTTPException('Missing Content-Range')
+
+            start, end = int(match.group(1)), int(match.group(2))
+            data_start = headers_end + 4
+            data_end = data_start + end - start + 1
+            parts.append((start, body[data_start:data_end]))
+            pos = body.find(delimiter, data_end)
+        return parts
+
+    def _fetch(self, runs):
+        """
+        Fetch the sectors of the runs by a single request, and return the
+        list of the (offset, data) parts received
+        """
+        ranges = ','.join('%d-%d' % (first * self.SECTOR_SIZE,
+                                     (last + 1) * self.SECTOR_SIZE - 1)
+                          for first, last in runs)
+        response = self._request('GET', {'Range': 'bytes=' + ranges})
+
+        if response.status == 416:
+            # All the ranges are after the end of the image
+            response.read()
+            return []
+
+        if response.status == 200:
+            # The server does not support ranges: only read the beginning
+            # of the image, and drop the connection with the rest of it
+            data = response.read((runs[-1][1] + 1) * self.SECTOR_SIZE)
+            self.close()
+            return [(0, data)]
+
+        if response.status != 206:
+            response.read()
+            raise httplib.HTTPException('HTTP error %d' % response.status)
+
+        content_type = response.getheader('content-type', '')
+        match = re.search(r'multipart/byteranges;\s*boundary="?([^";]+)"?',
+                          content_type, re.IGNORECASE)
+        if match is not None:
+            return self._parse_multipart(response, match.group(1))
+
+        match = re.match(r'bytes (\d+)-',
+                         response.getheader('content-range', ''))
+        if match is None:
+            response.read()
+            raise httplib.HTTPException('Missing Content-Range')
+        return [(int(match.group(1)), response.read())]
+
+    def _store(self, parts, first, last):
+        """
+        Cache the sectors of the parts received for a read of the sectors
+        'first' to 'last'
+        """
+        for offset, data in parts:
+            # Skip the head of a part not starting on a sector
+            pos = -offset % self.SECTOR_SIZE
+            while pos < len(data):
+                sector = (offset + pos) / self.SECTOR_SIZE
+                # A partial sector is the last one of the image
+                self._sectors[sector] = data[pos:pos + self.SECTOR_SIZE]
+                pos += self.SECTOR_SIZE
+
+        if len(self._sectors) > REMOTE_CACHE_SECTORS:
+            # Keep the sectors of the current read, some of them may have
+            # been cached before
+            self._sectors = dict((sector, data) for sector, data in
+                                 self._sectors.iteritems()
+                                 if first <= sector <= last)
+
+    def read(self, offset, size):
+        """
+        Return 'size' bytes of the image from 'offset', less at the end of
+        the image. Raise IOError when the data can not be fetched.
+        """
+        if size <= 0:
+            return ''
+
+        first = offset / self.SECTOR_SIZE
+        last = (offset + size - 1) / self.SECTOR_SIZE
+        runs = self._get_runs(first, last)
+        if runs:
+            try:
+                self._store(self._fetch(runs), first, last)
+            except (httplib.HTTPException, socket.error), e:
+                self.close()
+                raise IOError(str(e))
+
+        chunks = []
+        for sector in xrange(first, last + 1):
+            chunk = self._sectors.get(sector)
+            if chunk is None:
+                break
+            chunks.append(chunk)
+            if len(chunk) < self.SECTOR_SIZE:
+                break
+
+        start = offset - first * self.SECTOR_SIZE
+        return ''.join(chunks)[start:start + size]
+
+
 class IsoImage(object):
     """
     Scan an iso9660 image to extract the Volume ID and check for boot-ability
@@ -150,10 +384,15 @@ class IsoImage(object):
 
     def __init__(self, path):
         self.path = path
+        self._reader = None
         self.remote = self._is_iso_remote()
         self.volume_id = None
         self.bootable = False
-        self._scan()
+        try:
+            self._scan()
+        finally:
+            if self._reader is not None:
+                self._reader.close()
 
     def _is_iso_remote(self):
         if os.path.exists(self.path):
@@ -161,7 +400,12 @@ class IsoImage(object):
             if stat.S_ISREG(st_mode) or stat.S_ISBLK(st_mode):
                 return False
 
-        if check_url_path(self.path):
+        if urlparse(self.path).scheme in ('http', 'https'):
+            reader = RemoteIsoReader(self.path)
+            if reader.open():
+                self._reader = reader
+                return True
+        elif check_url_path(self.path):
             return True
 
         raise IsoFormatError("KCHISO0001E", {'filename': self.path})
@@ -170,16 +414,9 @@ class IsoImage(object):
         if not self.bootable:
             raise IsoFormatError("KCHISO0002E", {'filename': self.path})
 
-        matcher = Matcher(self.volume_id)
-
-        for d, v, regex in iso_dir:
-            if matcher.search(regex):
-                distro = d
-                if hasattr(v, '__call__'):
-                    version = v(matcher)
-                else:
-                    version = v
-                return (distro, version)
+        result = distro_matcher.match(self.volume_id)
+        if result is not None:
+            return result
 
         msg = "probe_iso: Unable to identify ISO %s with Volume ID: %s"
         wok_log.debug(msg, self.path, self.volume_id)
@@ -427,7 +664,12 @@ lang=en#!/wiki/W51a7ffcf4dfd_4b40_9d82_446ebc23c550/page/PowerLinux\
         return data[190: 318]
 
     def _get_iso_data(self, offset, size):
-        if self.remote:
+        if self._reader is not None:
+            try:
+                data = self._reader.read(offset, size)
+            except IOError as e:
+                raise OperationFailed("KCHISO0009E", {'err': e})
+        elif self.remote:
             try:
                 request = urllib2.Request(self.path)
                 range_header = "bytes=%d-%d" % (offset, offset + size - 1)
@@ -459,20 +701,108 @@ lang=en#!/wiki/W51a7ffcf4dfd_4b40_9d82_446ebc23c550/page/PowerLinux\
             self._scan_el_torito(data)
 
 
-class Matcher(object):
+class LiteralMatcher(object):
     """
-    Simple utility class to assist with matching a given string against a
-    series of regular expressions.
+    Aho-Corasick automaton finding which of a set of literal strings occur
+    in a string, in a single pass over it whatever the number of literals.
     """
-    def __init__(self, matchstring):
-        self.matchstring = matchstring
+    def __init__(self, literals):
+        # state: {char: next state}, failure state and values of the
+        # literals ending at the state
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [set()]
+
+        for literal, value in literals:
+            state = 0
+            for char in literal:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(set())
+                    self._goto[state][char] = next_state
+                state = next_state
+            self._out[state].add(value)
+
+        # Breadth first, so the failure state of a state is computed first
+        queue = list(self._goto[0].values())
+        while queue:
+            state = queue.pop(0)
+            for char, next_state in self._goto[state].iteritems():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._out[next_state] |= self._out[self._fail[next_state]]
+
+    def search(self, string):
+        """
+        Return the values of the literals found in 'string'
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for char in string:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+# Characters making a pattern more than an alternation of literals
+_REGEX_META = re.compile(r'[.^$*+?{}\[\]\\()]')
+
+
+class DistroMatcher(object):
+    """
+    Match a Volume ID against a table like iso_dir, returning the distro and
+    version of the first matching entry.
+
+    The table is compiled once: the entries which are alternations of
+    literals with a fixed version (e.g. the Windows ones) are looked up
+    together by a LiteralMatcher, and the other ones are precompiled
+    regular expressions. The entries are still tried in the table order.
+    """
+    def __init__(self, table):
+        # (distro, version, compiled regex or None for literal entries)
+        self._entries = []
+        literals = []
+        for index, (distro, version, regex) in enumerate(table):
+            alternatives = regex.split('|')
+            if not callable(version) and all(alternatives) and \
+                    not any(_REGEX_META.search(a) for a in alternatives):
+                literals.extend((a, index) for a in alternatives)
+                self._entries.append((distro, version, None))
+            else:
+                self._entries.append((distro, version, re.compile(regex)))
+        self._literals = LiteralMatcher(literals)
+
+    def match(self, string):
+        """
+        Return the (distro, version) of the first entry matching 'string',
+        or None
+        """
+        found = self._literals.search(string)
+        for index, (distro, version, regex) in enumerate(self._entries):
+            if regex is None:
+                if index in found:
+                    return (distro, version)
+                continue
+
+            match = regex.search(string)
+            if match is not None:
+                if callable(version):
+                    version = version(match)
+                return (distro, version)
+        return None
 
-    def search(self, regex):
-        self.lastmatch = re.search(regex, self.matchstring)
-        return bool(self.lastmatch)
 
-    def group(self, num):
-        return self.lastmatch.group(num)
+distro_matcher = DistroMatcher(iso_dir)
 
 
 def probe_iso(status_helper, params):
@@ -45,6 +45,7 @@ from wok.plugins.kimchi.model.libvirtstoragepool import IscsiPoolDef
 from wok.plugins.kimchi.model.libvirtstoragepool import NetfsPoolDef
 from wok.plugins.kimchi.model.libvirtstoragepool import StoragePoolDef
 from wok.plugins.kimchi.model.model import Model
+from wok.plugins.kimchi.model.nfsmonitor import NfsMonitor
 from wok.plugins.kimchi.model.storagepools import StoragePoolModel
 from wok.plugins.kimchi.model.storagepools import StoragePoolsModel
 from wok.plugins.kimchi.model.storagevolumes import StorageVolumeModel
@@ -97,6 +98,7 @@ class MockModel(Model):
         libvirt.virStorageVol.wipePattern = MockModel.volWipePattern
 
         IscsiPoolDef.prepare = NetfsPoolDef.prepare = StoragePoolDef.prepare
+        NfsMonitor._probe = staticmethod(MockModel.probeNfsServer)
 
         PAMUsersModel.auth_type = 'fake'
         PAMGroupsModel.auth_type = 'fake'
@@ -184,6 +186,11 @@ class MockModel(Model):
         for v in volumes:
             self.storagevolume_delete('default-pool', v)
 
+    @staticmethod
+    def probeNfsServer(server):
+        # The NFS servers of the test pools do not exist
+        return True
+
     @staticmethod
     def get_topo_capabilities(conn):
         # The libvirt test driver doesn't return topology.
@@ -346,24 +353,32 @@ class MockModel(Model):
 
         return self._model_storagevolume_lookup(pool, vol)
 
-    def _mock_storagevolume_doUpload(self, cb, vol, offset, data, data_size):
+    def _mock_storagevolume_lookup_all(self, pool):
+        pool_info = self.storagepool_lookup(pool)
+        if pool_info['type'] == 'scsi':
+            volumes = self._mock_storagevolumes.scsi_volumes
+            return [dict(volumes[vol], name=vol) for vol in sorted(volumes)]
+
+        return self._model_storagevolume_lookup_all(pool)
+
+    def _mock_storagevolume_doUpload(self, session, vol, offset, data,
+                                     data_size):
         vol_path = vol.path()
 
         # MockModel does not create the storage volume as a file
         # So create it to do the file upload
-        if offset == 0:
+        if session.received == 0:
             dirname = os.path.dirname(vol_path)
             if not os.path.exists(dirname):
                 os.makedirs(dirname)
-            open(vol_path, 'w').close()
+            with open(vol_path, 'w') as fd:
+                fd.truncate(session.size)
 
         try:
-            with open(vol_path, 'a') as fd:
-                fd.seek(offset)
-                fd.write(data)
+            return session.write(offset, data)
         except Exception, e:
             os.remove(vol_path)
-            cb('', False)
+            session.cb('', False)
             raise OperationFailed("KCHVOL0029E", {"err": e.message})
 
     def _mock_devices_get_list(self, _cap=None, _passthrough=None,
@@ -403,11 +418,11 @@ class MockModel(Model):
     def _mock_volumegroup_lookup(self, name):
         return self._mock_vgs.data[name]
 
-    def _mock_vm_clone(self, name):
+    def _mock_vm_clone(self, name, mode=None):
         new_name = get_next_clone_name(self.vms_get_list(), name)
         snapshots = MockModel._mock_snapshots.get(name, [])
         MockModel._mock_snapshots[new_name] = snapshots
-        return self._model_vm_clone(name)
+        return self._model_vm_clone(name, mode)
 
     def _mock_vm_migrate(self, name, remote_host, user=None, password=None,
                          enable_rdma=None):
@@ -24,7 +24,7 @@ from wok.basemodel import Singleton
 from wok.exception import NotFoundError
 from wok.utils import run_command, wok_log
 
-from wok.plugins.kimchi.config import find_qemu_binary
+from wok.plugins.kimchi.config import config, find_qemu_binary
 from wok.plugins.kimchi.config import get_kimchi_version
 from wok.plugins.kimchi.distroloader import DistroLoader
 from wok.plugins.kimchi.model.featuretests import FeatureTests
@@ -39,7 +39,10 @@ class ConfigModel(object):
         pass
 
     def lookup(self, name):
-        return {'version': get_kimchi_version()}
+        kimchi_config = config.get('kimchi', {})
+        return {'version': get_kimchi_version(),
+                'upload_concurrency': kimchi_config.get('upload_concurrency',
+                                                        4)}
 
 
 class CapabilitiesModel(object):
@@ -17,6 +17,7 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
+from wok.plugins.kimchi.model.domainindex import DomainIndex
 from wok.plugins.kimchi.model.vms import VMModel, VMsModel
 from wok.plugins.kimchi.xmlutils.disk import get_vm_disk_info, get_vm_disks
 
@@ -28,6 +29,10 @@ from wok.plugins.kimchi.xmlutils.disk import get_vm_disk_info, get_vm_disks
 
 
 def get_disk_used_by(conn, path):
+    index = DomainIndex.get_index(conn)
+    if index is not None and index.disks_ready:
+        return index.used_by(path)
+
     used_by = []
     # try to find this volume in existing vm
     vms_list = VMsModel.get_vms(conn)
@@ -0,0 +1,248 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import libvirt
+import lxml.etree as ET
+import threading
+
+from wok.utils import wok_log
+
+from wok.plugins.kimchi.xmlutils.disk import get_vm_disk_paths
+from wok.plugins.kimchi.xmlutils.domain import DomainXML
+
+
+# virDomain methods which may change the name of a domain, its disks or
+# remove it
+DOMAIN_INDEX_MODIFIERS = ['attachDevice', 'attachDeviceFlags', 'destroy',
+                          'destroyFlags', 'detachDevice', 'detachDeviceFlags',
+                          'rename', 'setMetadata', 'undefine', 'undefineFlags',
+                          'updateDeviceFlags']
+
+# Lifecycle events which may add, rename or remove a domain. A transient
+# domain only shows up when it is started.
+DOMAIN_INDEX_EVENTS = ['VIR_DOMAIN_EVENT_DEFINED',
+                       'VIR_DOMAIN_EVENT_STARTED',
+                       'VIR_DOMAIN_EVENT_UNDEFINED',
+                       'VIR_DOMAIN_EVENT_STOPPED']
+
+# Events which may change the disks of a domain
+DOMAIN_DISK_EVENTS = ['VIR_DOMAIN_EVENT_ID_DEVICE_ADDED',
+                      'VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED',
+                      'VIR_DOMAIN_EVENT_ID_DISK_CHANGE']
+
+
+class DomainIndex(object):
+    """
+    In-memory index of the domains of a libvirt connection.
+
+    Kimchi stores non-ASCII VM names base64 encoded in libvirt and keeps the
+    original name in the domain metadata. The index maps both names and the
+    domain UUID to the virDomain object, so listing and resolving VM names
+    does not need any libvirt call. It also maps the disks paths to the VMs
+    using them, when the device events can be registered.
+
+    There is one index per URI, built on the shared connection, which also
+    receives the domain events, and then kept up to date by those events and
+    by the changes done by Kimchi itself (see LibvirtConnection) on any
+    pooled connection to the same URI. The indexed virDomain objects thus
+    belong to the shared connection. When the events can not be registered,
+    the index is not used at all.
+    """
+    _indexes = {}
+    _indexesLock = threading.Lock()
+
+    def __init__(self, conn, uri=None):
+        self.conn = conn
+        self.uri = uri
+        self.ready = False
+        self.disks_ready = False
+        # uuid: (name, ascii name, virDomain, disks paths)
+        self._domains = {}
+        self._names = {}
+        self._ascii_names = {}
+        # disk path: set of uuids
+        self._paths = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def get_index(conn):
+        """
+        Return the index of the URI of a LibvirtConnection, or None when it
+        can not be kept up to date
+        """
+        with DomainIndex._indexesLock:
+            index = DomainIndex._indexes.get(conn.uri)
+            if index is None:
+                # The shared connection, whichever connection the current
+                # thread has checked out
+                conn_ = conn.get(0)
+                if conn_ is None:
+                    return None
+                index = DomainIndex(conn_, conn.uri)
+                index.build()
+                DomainIndex._indexes[conn.uri] = index
+
+        return index if index.ready else None
+
+    @staticmethod
+    def discard(uri):
+        """
+        Drop the index of a URI whose shared connection is not used anymore
+        """
+        with DomainIndex._indexesLock:
+            DomainIndex._indexes.pop(uri, None)
+
+    @staticmethod
+    def domain_changed(uri, dom):
+        """
+        Refresh the index entry of a domain changed by Kimchi, on any
+        connection to the URI, so the index does not depend on the events to
+        see the change
+        """
+        with DomainIndex._indexesLock:
+            index = DomainIndex._indexes.get(uri)
+
+        if index is None or not index.ready:
+            return
+
+        if dom.connect() is index.conn:
+            index.refresh(dom)
+        else:
+            # Keep only virDomain objects of the shared connection
+            index.refresh_uuid(dom.UUIDString())
+
+    def build(self):
+        try:
+            self.conn.domainEventRegisterAny(
+                None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                self._event_cb, None)
+        except libvirt.libvirtError as e:
+            wok_log.warning('Unable to register domain events. VM names '
+                            'will not be indexed: %s' % e.message)
+            return
+
+        try:
+            for ev in DOMAIN_DISK_EVENTS:
+                self.conn.domainEventRegisterAny(
+                    None, getattr(libvirt, ev), self._disk_event_cb, None)
+            self.disks_ready = True
+        except (AttributeError, libvirt.libvirtError) as e:
+            wok_log.warning('Unable to register device events. Disks paths '
+                            'will not be indexed: %s' % e)
+
+        for dom in self.conn.listAllDomains(0):
+            self.refresh(dom)
+        self.ready = True
+
+    def _event_cb(self, conn, dom, event, detail, opaque):
+        events = [getattr(libvirt, ev) for ev in DOMAIN_INDEX_EVENTS]
+        if event in events:
+            self.refresh(dom)
+
+    def _disk_event_cb(self, conn, dom, *args):
+        self.refresh(dom)
+
+    def _remove(self, vm_uuid):
+        entry = self._domains.pop(vm_uuid, None)
+        if entry is None:
+            return
+
+        name, ascii_name, _, paths = entry
+        if self._names.get(name) == vm_uuid:
+            del self._names[name]
+        if self._ascii_names.get(ascii_name) == vm_uuid:
+            del self._ascii_names[ascii_name]
+        for path in paths:
+            uuids = self._paths.get(path)
+            if uuids is not None:
+                uuids.discard(vm_uuid)
+                if not uuids:
+                    del self._paths[path]
+
+    def refresh(self, dom):
+        """
+        Add or update the index entry of a domain, or remove it when the
+        domain does not exist anymore
+        """
+        vm_uuid = dom.UUIDString()
+        try:
+            # Do not use the domain XML cache: its entry may not be
+            # invalidated yet when handling an event
+            domxml = DomainXML(dom.XMLDesc(0))
+        except libvirt.libvirtError as e:
+            if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+                with self._lock:
+                    self._remove(vm_uuid)
+                return
+            raise
+
+        ascii_name = dom.name().decode('utf-8')
+        nonascii_xml = domxml.metadata_node('name')
+
+        name = ascii_name
+        if nonascii_xml:
+            name = ET.fromstring(nonascii_xml).text
+
+        paths = set(p for p in get_vm_disk_paths(domxml) if p)
+
+        with self._lock:
+            self._remove(vm_uuid)
+            self._domains[vm_uuid] = (name, ascii_name, dom, paths)
+            self._names[name] = vm_uuid
+            self._ascii_names[ascii_name] = vm_uuid
+            for path in paths:
+                self._paths.setdefault(path, set()).add(vm_uuid)
+
+    def refresh_uuid(self, vm_uuid):
+        """
+        Refresh the index entry of a domain changed on a pooled connection
+        """
+        try:
+            dom = self.conn.lookupByUUIDString(vm_uuid)
+        except libvirt.libvirtError as e:
+            if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+                with self._lock:
+                    self._remove(vm_uuid)
+                return
+            raise
+        self.refresh(dom)
+
+    def names(self):
+        with self._lock:
+            return sorted(self._names.keys(), key=unicode.lower)
+
+    def lookup(self, name):
+        """
+        Return the virDomain of a VM by its name (as shown by Kimchi) or by
+        its libvirt name, or None when it is not indexed
+        """
+        with self._lock:
+            vm_uuid = self._names.get(name) or self._ascii_names.get(name)
+            if vm_uuid is None:
+                return None
+            return self._domains[vm_uuid][2]
+
+    def used_by(self, path):
+        """
+        Return the names of the VMs using a disk path
+        """
+        with self._lock:
+            names = [self._domains[vm_uuid][0]
+                     for vm_uuid in self._paths.get(path, [])]
+        return sorted(names, key=unicode.lower)
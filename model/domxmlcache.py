@@ -0,0 +1,116 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import threading
+
+
+# virDomain methods which change the domain XML. The cached XML of the domain
+# is dropped every time one of them succeeds.
+DOMAIN_XML_MODIFIERS = ['attachDevice', 'attachDeviceFlags', 'blockResize',
+                        'create', 'createWithFlags', 'destroy',
+                        'destroyFlags', 'detachDevice', 'detachDeviceFlags',
+                        'managedSave', 'migrate', 'migrate2', 'migrate3',
+                        'migrateToURI', 'migrateToURI2', 'migrateToURI3',
+                        'pinVcpu', 'pinVcpuFlags', 'reboot', 'rename',
+                        'reset', 'resume', 'revertToSnapshot',
+                        'setBlkioParameters', 'setBlockIoTune',
+                        'setInterfaceParameters', 'setMaxMemory',
+                        'setMemory', 'setMemoryFlags', 'setMemoryParameters',
+                        'setMetadata', 'setNumaParameters',
+                        'setSchedulerParameters',
+                        'setSchedulerParametersFlags', 'setVcpus',
+                        'setVcpusFlags', 'shutdown', 'shutdownFlags',
+                        'snapshotCreateXML', 'suspend', 'undefine',
+                        'undefineFlags', 'updateDeviceFlags']
+
+# virConnect methods which define a domain and return it
+DOMAIN_DEFINE_METHODS = ['createXML', 'createXMLWithFiles', 'defineXML',
+                         'defineXMLFlags']
+
+
+class DomainXMLCache(object):
+    """
+    Process-wide cache of the domain XML descriptors, keyed by the domain UUID
+    and the XMLDesc() flags.
+
+    The entries are dropped when libvirt notifies a change in the domain (see
+    LibvirtEvents.registerDomainXMLEvents()) and when Kimchi itself changes
+    the domain through a wrapped libvirt connection (see LibvirtConnection).
+    """
+    def __init__(self):
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._cache = {}
+        # Incremented on every invalidation, so an XML fetched while the
+        # domain was being changed is not stored
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, dom, flags=0):
+        if not self.enabled:
+            return dom.XMLDesc(flags)
+
+        vm_uuid = dom.UUIDString()
+        with self._lock:
+            xml = self._cache.get(vm_uuid, {}).get(flags)
+            if xml is not None:
+                self.hits += 1
+                return xml
+            self.misses += 1
+            generation = self._generation
+
+        xml = dom.XMLDesc(flags)
+
+        with self._lock:
+            if generation == self._generation:
+                self._cache.setdefault(vm_uuid, {})[flags] = xml
+        return xml
+
+    def invalidate(self, vm_uuid):
+        with self._lock:
+            self._generation += 1
+            self._cache.pop(vm_uuid, None)
+
+    def invalidate_dom(self, dom):
+        try:
+            self.invalidate(dom.UUIDString())
+        except Exception:
+            # The UUID is always known by the domain object, so this should
+            # not happen. Anyway, never return outdated information.
+            self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cache.clear()
+
+    def event_cb(self, conn, dom, *args):
+        """
+        Callback for any domain event which may change the domain XML
+        """
+        self.invalidate_dom(dom)
+
+    def get_stats(self):
+        with self._lock:
+            return {'enabled': self.enabled, 'hits': self.hits,
+                    'misses': self.misses, 'domains': len(self._cache)}
+
+
+domain_xml_cache = DomainXMLCache()
@@ -0,0 +1,82 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import threading
+
+from wok.utils import wok_log
+
+
+class EventBus(object):
+    """
+    Coalesce the changes of the resources of a collection (e.g. 'vms').
+
+    The first change published for a collection opens a window of 'window'
+    seconds. The resources changed until it closes are delivered to the
+    subscribers in a single call, as cb(collection, idents) where idents is
+    the sorted list of the changed resources identifiers. With a window of 0
+    each change is delivered right away.
+    """
+    def __init__(self, window):
+        self.window = window
+        self._pending = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, cb):
+        with self._lock:
+            self._subscribers.append(cb)
+
+    def unsubscribe(self, cb):
+        with self._lock:
+            if cb in self._subscribers:
+                self._subscribers.remove(cb)
+
+    def publish(self, collection, ident):
+        if self.window <= 0:
+            self._deliver(collection, [ident])
+            return
+
+        with self._lock:
+            idents = self._pending.get(collection)
+            if idents is not None:
+                idents.add(ident)
+                return
+            self._pending[collection] = set([ident])
+
+        timer = threading.Timer(self.window, self.flush, [collection])
+        timer.setName('KimchiEventBus')
+        timer.setDaemon(True)
+        timer.start()
+
+    def flush(self, collection):
+        with self._lock:
+            idents = self._pending.pop(collection, None)
+        if idents:
+            self._deliver(collection, sorted(idents))
+
+    def _deliver(self, collection, idents):
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for cb in subscribers:
+            try:
+                cb(collection, idents)
+            except Exception as e:
+                wok_log.error('Error handling %s events: %s' %
+                              (collection, e.message))
@@ -0,0 +1,274 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import contextlib
+import httplib
+import re
+import threading
+import time
+import urllib2
+
+from wok.utils import wok_log
+
+from wok.plugins.kimchi.model.sparse import write_sparse
+
+
+READ_CHUNK_SIZE = 1048576  # 1 MiB
+SEGMENT_SIZE = 67108864  # 64 MiB
+DOWNLOAD_CONNECTIONS = 4
+DOWNLOAD_TIMEOUT = 60
+DOWNLOAD_RETRIES = 5
+RETRY_DELAY = 1
+PROGRESS_INTERVAL = 1
+
+
+class _SparseFileWriter(object):
+    """
+    Write consecutive pieces of content to a new file from 'offset', leaving
+    holes for the zero blocks
+    """
+    def __init__(self, fd, offset):
+        self.fd = fd
+        self.offset = offset
+
+    def write(self, data):
+        write_sparse(self.fd, self.offset, data)
+        self.offset += len(data)
+
+
+class HttpDownload(object):
+    """
+    Download a URL to a file, or stream it to a callback.
+
+    When the server supports ranges, the content is split in segments which
+    are fetched over 'connections' parallel connections and written at their
+    offsets in the file. The zero blocks are not written to the file, which
+    is left sparse. A segment interrupted by a network error is resumed
+    from the last byte received, up to DOWNLOAD_RETRIES consecutive times,
+    unless the server answered with a permanent HTTP error. Otherwise the
+    content is fetched over a single connection, which can not be resumed.
+    A failed download is not resumed by the next one: it starts again from
+    the first byte.
+
+    progress_cb(downloaded, size) is called at most once every
+    PROGRESS_INTERVAL seconds, and when the download completes. size is None
+    when the server does not report it.
+    """
+    def __init__(self, url, path, connections=DOWNLOAD_CONNECTIONS,
+                 progress_cb=None):
+        self.url = url
+        self.path = path
+        self.connections = connections
+        self.progress_cb = progress_cb
+        self.size = None
+        self.downloaded = 0
+        self._last_progress = 0
+        self._segments = []
+        self._errors = []
+        self._abort = threading.Event()
+        self._lock = threading.Lock()
+
+    def _open(self, start=None, end=None):
+        request = urllib2.Request(self.url)
+        if start is not None:
+            request.add_header('Range', 'bytes=%d-%d' % (start, end))
+        return urllib2.urlopen(request, timeout=DOWNLOAD_TIMEOUT)
+
+    def _progress(self, nbytes, force=False):
+        with self._lock:
+            self.downloaded += nbytes
+            now = time.time()
+            if not force and now - self._last_progress < PROGRESS_INTERVAL:
+                return
+            self._last_progress = now
+            downloaded = self.downloaded
+
+        if self.progress_cb is not None:
+            self.progress_cb(downloaded, self.size)
+
+    def probe(self):
+        """
+        Return the response to a request of the first byte, and whether the
+        server supports ranges. self.size is set when the server reports it.
+        """
+        try:
+            response = self._open(0, 0)
+        except urllib2.HTTPError, e:
+            if e.code != 416:
+                raise
+            # An empty content has no first byte: request all the content
+            e.close()
+            response = self._open()
+
+        if response.getcode() == 206:
+            content_range = response.info().getheader('Content-Range', '')
+            match = re.match(r'bytes 0-0/(\d+)$', content_range.strip())
+            if match is not None:
+                self.size = int(match.group(1))
+                return response, True
+
+            # The server does not know the size: request all the content
+            response.close()
+            response = self._open()
+
+        length = response.info().getheader('Content-Length')
+        if length is not None and length.isdigit():
+            self.size = int(length)
+        return response, False
+
+    def fetch(self, start, end, write):
+        """
+        Fetch the bytes start to end (inclusive) calling write(data) with
+        the consecutive pieces of content. The range is resumed from the
+        last byte received when the connection fails.
+        """
+        offset = start
+        failures = 0
+        while offset <= end and not self._abort.is_set():
+            try:
+                with contextlib.closing(self._open(offset, end)) as response:
+                    if response.getcode() != 206:
+                        raise IOError('Range %d-%d not honored by %s' %
+                                      (offset, end, self.url))
+
+                    while offset <= end and not self._abort.is_set():
+                        data = response.read(min(READ_CHUNK_SIZE,
+                                                 end - offset + 1))
+                        if not data:
+                            raise IOError('Connection to %s closed at byte '
+                                          '%d' % (self.url, offset))
+                        write(data)
+                        offset += len(data)
+                        failures = 0
+                        self._progress(len(data))
+            except urllib2.HTTPError, e:
+                # An HTTPError is an IOError, but only the server errors and
+                # the throttled requests may succeed when retried
+                if e.code < 500 and e.code != 429:
+                    raise
+                error = e
+            except (IOError, httplib.HTTPException), e:
+                error = e
+            else:
+                continue
+
+            failures += 1
+            if failures > DOWNLOAD_RETRIES:
+                raise IOError(str(error))
+
+            wok_log.debug('Resuming download of %s at byte %d: %s',
+                          self.url, offset, str(error))
+            time.sleep(RETRY_DELAY * failures)
+
+    def _next_segment(self):
+        with self._lock:
+            if not self._segments or self._abort.is_set():
+                return None
+            return self._segments.pop(0)
+
+    def _download_segments(self):
+        try:
+            with open(self.path, 'r+b') as fd:
+                while True:
+                    segment = self._next_segment()
+                    if segment is None:
+                        break
+
+                    self.fetch(segment[0], segment[1],
+                               _SparseFileWriter(fd, segment[0]).write)
+        except Exception, e:
+            with self._lock:
+                self._errors.append(e)
+            self._abort.set()
+
+    def _download_ranges(self):
+        with open(self.path, 'wb') as fd:
+            fd.truncate(self.size)
+
+        self._segments = [(start, min(start + SEGMENT_SIZE, self.size) - 1)
+                          for start in xrange(0, self.size, SEGMENT_SIZE)]
+        workers = []
+        for i in range(min(self.connections, len(self._segments))):
+            worker = threading.Thread(target=self._download_segments)
+            worker.setName('KimchiHttpDownload')
+            worker.setDaemon(True)
+            worker.start()
+            workers.append(worker)
+
+        for worker in workers:
+            worker.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+    def _copy(self, response, write):
+        with contextlib.closing(response):
+            while True:
+                try:
+                    data = response.read(READ_CHUNK_SIZE)
+                except httplib.HTTPException, e:
+                    raise IOError(str(e))
+                if not data:
+                    break
+                write(data)
+                self._progress(len(data))
+
+        if self.size is not None and self.downloaded != self.size:
+            raise IOError('Incomplete download of %s: %d of %d bytes' %
+                          (self.url, self.downloaded, self.size))
+
+    def save(self, response, ranges):
+        """
+        Download the URL to self.path, given the result of probe(), and
+        return the number of bytes downloaded
+        """
+        if ranges:
+            response.close()
+            self._download_ranges()
+        else:
+            with open(self.path, 'wb') as fd:
+                self._copy(response, _SparseFileWriter(fd, 0).write)
+                # Keep the trailing zeros
+                fd.truncate(self.downloaded)
+
+        self._progress(0, force=True)
+        return self.downloaded
+
+    def stream(self, response, ranges, write):
+        """
+        Download the URL given the result of probe(), calling write(data)
+        with the consecutive pieces of content. Only READ_CHUNK_SIZE bytes
+        are held in memory at a time. Return the number of bytes downloaded.
+        """
+        if ranges:
+            response.close()
+            self.fetch(0, self.size - 1, write)
+        else:
+            self._copy(response, write)
+
+        self._progress(0, force=True)
+        return self.downloaded
+
+    def run(self):
+        """
+        Download the URL to self.path and return the number of bytes
+        downloaded
+        """
+        response, ranges = self.probe()
+        return self.save(response, ranges)
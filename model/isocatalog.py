@@ -0,0 +1,296 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import libvirt
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from wok.exception import NotFoundError
+from wok.utils import wok_log
+
+from wok.plugins.kimchi.config import get_kimchi_version
+from wok.plugins.kimchi.model.diskutils import get_disk_used_by
+from wok.plugins.kimchi.model.poolrefresh import pool_refresher
+from wok.plugins.kimchi.model.storagepools import StoragePoolModel
+from wok.plugins.kimchi.model.storagevolumes import StorageVolumeModel
+
+
+ISO_PROBE_WORKERS = 4
+
+# The volume could not be probed: try again on the next scan
+_PROBE_FAILED = object()
+
+
+class IsoCatalog(object):
+    """
+    Catalog of the bootable ISO images of the active storage pools.
+
+    The catalog is kept in memory and in the object store, so the ISO list
+    is answered without reading the volumes. All the active pools are
+    scanned in background at startup (see scan_all()). A pool is scanned again
+    in background when libvirt reports a change on it, when its catalog is
+    older than the pool refresh TTL, and on the next request when Kimchi
+    changed its volumes (see invalidate()): the requests are always answered
+    from the current catalog. A scan only probes the volumes which are new or
+    changed since the previous one, using a pool of worker threads. A volume
+    is changed when its size, allocation, inode, mtime, mode or owner
+    changed.
+    """
+    def __init__(self, conn, objstore, workers=ISO_PROBE_WORKERS):
+        self.conn = conn
+        self.objstore = objstore
+        self.storagevolume = StorageVolumeModel(conn=conn, objstore=objstore)
+        self._workers = ThreadPool(workers)
+        # pool name: {'timestamp': last scan, 'active': pool is active,
+        #             'volumes': {volume name: {'key': [path, capacity,
+        #                                               allocation, inode,
+        #                                               mtime, mode, uid,
+        #                                               gid],
+        #                                       'iso': volume info or None}}}
+        self._pools = self._load()
+        self._dirty = set()
+        self._scanning = set()
+        self._scan_locks = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        pools = {}
+        try:
+            with self.objstore as session:
+                for name in session.get_list('isocatalog'):
+                    pools[name] = session.get('isocatalog', name)
+        except Exception as e:
+            wok_log.debug('Unable to load the ISO catalog: %s', e.message)
+        return pools
+
+    def _update(self, pool_name, entry):
+        with self._lock:
+            if entry is None:
+                self._pools.pop(pool_name, None)
+            else:
+                self._pools[pool_name] = entry
+
+        try:
+            with self.objstore as session:
+                if entry is None:
+                    session.delete('isocatalog', pool_name)
+                else:
+                    session.store('isocatalog', pool_name, entry,
+                                  get_kimchi_version())
+        except NotFoundError:
+            pass
+        except Exception as e:
+            # The catalog is rebuilt on the next start
+            wok_log.debug('Unable to store the ISO catalog of pool %s: %s',
+                          pool_name, e.message)
+
+    def _probe(self, vol, pool_type):
+        try:
+            res = self.storagevolume._get_volume_info(vol, pool_type)
+        except Exception as e:
+            wok_log.debug('Unable to probe volume %s: %s', vol.path(),
+                          e.message)
+            return _PROBE_FAILED
+
+        if res['format'] != 'iso' or not res['bootable']:
+            return None
+
+        # used_by changes with the guests, it is computed on each request.
+        # has_permission is kept: the volume is probed again when the mode
+        # or the owner of the file change.
+        del res['used_by']
+        res['name'] = vol.name().decode('utf-8')
+        return res
+
+    @staticmethod
+    def _volume_key(vol):
+        path = vol.path().decode('utf-8')
+        info = vol.info()
+        key = [path, info[1], info[2]]
+        try:
+            st = os.stat(path)
+        except OSError:
+            # Not a local file
+            return key + [None] * 5
+        # An image replaced by another one of the same size, or whose
+        # permissions changed
+        return key + [st.st_ino, st.st_mtime, st.st_mode, st.st_uid,
+                      st.st_gid]
+
+    def _scan_volumes(self, pool, pool_name):
+        pool_type = StorageVolumeModel._get_pool_type(pool)
+        with self._lock:
+            old = self._pools.get(pool_name, {}).get('volumes', {})
+
+        volumes = {}
+        probes = []
+        for vol in pool.listAllVolumes(0):
+            try:
+                name = vol.name().decode('utf-8')
+                key = self._volume_key(vol)
+            except libvirt.libvirtError:
+                # Volume might be deleted just after we get the list.
+                # This is OK, just skip.
+                continue
+
+            entry = old.get(name)
+            if entry is not None and entry['key'] == key:
+                volumes[name] = entry
+            else:
+                probes.append((name, key, vol))
+
+        results = self._workers.map(lambda p: self._probe(p[2], pool_type),
+                                    probes)
+        for (name, key, vol), iso in zip(probes, results):
+            if iso is not _PROBE_FAILED:
+                volumes[name] = {'key': key, 'iso': iso}
+        return volumes
+
+    def scan(self, pool_name):
+        """
+        Bring the catalog of a pool up to date
+        """
+        with self._lock:
+            scan_lock = self._scan_locks.setdefault(pool_name,
+                                                    threading.Lock())
+
+        with scan_lock:
+            # Changes done from now on are seen by the next scan
+            with self._lock:
+                self._dirty.discard(pool_name)
+
+            try:
+                pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
+            except NotFoundError:
+                self._update(pool_name, None)
+                return
+
+            entry = {'timestamp': time.time(), 'active': bool(pool.isActive()),
+                     'volumes': {}}
+            if entry['active']:
+                try:
+                    pool_refresher.refresh(pool)
+                except Exception, e:
+                    wok_log.error("Pool refresh failed: %s" % str(e))
+                entry['volumes'] = self._scan_volumes(pool, pool_name)
+            self._update(pool_name, entry)
+
+    def _background_scan(self, pool_name):
+        try:
+            self.scan(pool_name)
+        except Exception as e:
+            wok_log.error('Unable to update the ISO catalog of pool %s: %s',
+                          pool_name, e.message)
+        finally:
+            with self._lock:
+                self._scanning.discard(pool_name)
+
+    def schedule(self, pool_name):
+        """
+        Scan a pool in background, unless a scan is already scheduled
+        """
+        with self._lock:
+            if pool_name in self._scanning:
+                return
+            self._scanning.add(pool_name)
+
+        scanner = threading.Thread(target=self._background_scan,
+                                   args=(pool_name,))
+        scanner.setName('KimchiIsoCatalog')
+        scanner.setDaemon(True)
+        scanner.start()
+
+    def _scan_all(self):
+        try:
+            pool_names = self.conn.get().listStoragePools()
+        except Exception as e:
+            wok_log.error('Unable to list the storage pools to build the ISO '
+                          'catalog: %s', str(e))
+            return
+
+        for pool_name in pool_names:
+            self.schedule(pool_name.decode('utf-8'))
+
+    def scan_all(self):
+        """
+        Scan all the active pools in background, so the catalog is built
+        before the first request on a fresh install, and is brought up to
+        date with the changes done while Kimchi was stopped
+        """
+        scanner = threading.Thread(target=self._scan_all)
+        scanner.setName('KimchiIsoCatalog')
+        scanner.setDaemon(True)
+        scanner.start()
+
+    def invalidate(self, pool_name, name=None):
+        """
+        Scan the pool on the next request, after Kimchi changed its volumes.
+        A volume whose content changed without changing its size is given
+        by name to be probed again.
+        """
+        with self._lock:
+            self._dirty.add(pool_name)
+            entry = self._pools.get(pool_name)
+            if name is not None and entry is not None and \
+                    name in entry['volumes']:
+                volumes = dict(entry['volumes'])
+                del volumes[name]
+                self._pools[pool_name] = dict(entry, volumes=volumes)
+
+    def events_cb(self, collection, idents):
+        if collection != 'storages':
+            return
+
+        for pool_name in idents:
+            self.schedule(pool_name)
+
+    def get_list(self):
+        with self.conn.checkout(readonly=True):
+            return self._get_list()
+
+    def _get_list(self):
+        iso_volumes = []
+        ttl = pool_refresher.ttl
+        # Only active pools have volumes
+        for pool_name in self.conn.get().listStoragePools():
+            pool_name = pool_name.decode('utf-8')
+            with self._lock:
+                entry = self._pools.get(pool_name)
+                dirty = pool_name in self._dirty
+
+            # The pool is scanned in background: its ISO images are listed
+            # once the scan is done
+            if entry is None or dirty or not entry['active'] or \
+                    time.time() - entry['timestamp'] >= ttl:
+                self.schedule(pool_name)
+            if entry is None:
+                continue
+
+            volumes = entry['volumes']
+            for name in sorted(volumes):
+                if volumes[name]['iso'] is None:
+                    continue
+
+                res = dict(volumes[name]['iso'])
+                res['used_by'] = get_disk_used_by(self.conn,
+                                                  volumes[name]['key'][0])
+                iso_volumes.append(res)
+        return iso_volumes
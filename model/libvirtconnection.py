@@ -17,6 +17,7 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
+import contextlib
 import libvirt
 import threading
 import time
@@ -25,18 +26,110 @@ from wok.model.notifications import add_notification, del_notification
 from wok.model.notifications import notificationsStore
 from wok.utils import wok_log
 
+from wok.plugins.kimchi.model.domainindex import DOMAIN_INDEX_MODIFIERS
+from wok.plugins.kimchi.model.domainindex import DomainIndex
+from wok.plugins.kimchi.model.domxmlcache import DOMAIN_DEFINE_METHODS
+from wok.plugins.kimchi.model.domxmlcache import DOMAIN_XML_MODIFIERS
+from wok.plugins.kimchi.model.domxmlcache import domain_xml_cache
 from wok.plugins.kimchi.utils import is_libvirtd_up
 
 
+# Keepalive messages sent to detect a broken connection to libvirt
+KEEPALIVE_INTERVAL = 5
+KEEPALIVE_COUNT = 3
+
+# Delay in seconds between two attempts to restore a broken connection
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+# Seconds to wait for a free pooled connection before falling back to the
+# shared connection
+CHECKOUT_TIMEOUT = 30
+
+
+class ConnectionPool(object):
+    """
+    Bounded set of connection ids which are checked out by a single thread
+    at a time
+    """
+    def __init__(self, conn_ids):
+        self.size = len(conn_ids)
+        self._free = list(conn_ids)
+        self._cond = threading.Condition()
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def acquire(self, timeout):
+        start = time.time()
+        with self._cond:
+            if not self._free:
+                self.waits += 1
+            while not self._free:
+                remaining = start + timeout - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            waited = time.time() - start
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+            if not self._free:
+                self.timeouts += 1
+                return None
+
+            self.checkouts += 1
+            return self._free.pop()
+
+    def release(self, conn_id):
+        with self._cond:
+            self._free.append(conn_id)
+            self._cond.notify()
+
+    def get_stats(self):
+        with self._cond:
+            return {'size': self.size,
+                    'in_use': self.size - len(self._free),
+                    'checkouts': self.checkouts,
+                    'waits': self.waits,
+                    'timeouts': self.timeouts,
+                    'wait_time': self.wait_time,
+                    'max_wait_time': self.max_wait_time}
+
+
 class LibvirtConnection(object):
+    """
+    Connections to a libvirt URI.
+
+    The connection id 0 is shared by all the threads. Positive ids belong to
+    the read-write pool and negative ids to the read-only pool (opened with
+    libvirt.openReadOnly), whose connections are checked out by a request or
+    a task with checkout(), so slow libvirt calls do not hold up the other
+    ones.
+    """
     _connections = {}
+    _reconnectings = {}
+    _reconnect_callbacks = {}
+    _pools = {}
+    _locals = {}
     _connectionLock = threading.Lock()
+    _wrappedClasses = False
 
     def __init__(self, uri):
         self.uri = uri
         if self.uri not in LibvirtConnection._connections:
             LibvirtConnection._connections[self.uri] = {}
         self._connections = LibvirtConnection._connections[self.uri]
+        self._reconnecting = LibvirtConnection._reconnectings.setdefault(
+            self.uri, {})
+        self._reconnect_cbs = \
+            LibvirtConnection._reconnect_callbacks.setdefault(self.uri, [])
+        self._pool = LibvirtConnection._pools.setdefault(
+            self.uri, {'rw': ConnectionPool([]), 'ro': ConnectionPool([])})
+        self._local = LibvirtConnection._locals.setdefault(
+            self.uri, threading.local())
         self.wrappables = self.get_wrappable_objects()
 
     def get_wrappable_objects(self):
@@ -56,88 +149,301 @@ class LibvirtConnection(object):
             objs.append(attr)
         return tuple(objs)
 
-    def get(self, conn_id=0):
+    def configure_pool(self, size, readonly_size=0):
+        """
+        Set the number of read-write and read-only pooled connections. With
+        no pooled connections, checkout() returns the shared connection.
+        """
+        with LibvirtConnection._connectionLock:
+            self._pool['rw'] = ConnectionPool(range(1, size + 1))
+            self._pool['ro'] = ConnectionPool(range(-1, -readonly_size - 1,
+                                                    -1))
+
+    def get_pool_stats(self):
+        return {'readwrite': self._pool['rw'].get_stats(),
+                'readonly': self._pool['ro'].get_stats()}
+
+    @contextlib.contextmanager
+    def checkout(self, readonly=False):
+        """
+        Bind a pooled connection to the current thread: get() returns it
+        until the end of the block. A read-only checkout uses the read-write
+        pool when there is no read-only pool, and nested checkouts reuse the
+        bound connection when it allows the requested access.
+        """
+        bound = getattr(self._local, 'conn_id', None)
+        if bound is not None and (readonly or bound >= 0):
+            yield self.get(bound)
+            return
+
+        pool = self._pool['rw']
+        if readonly and self._pool['ro'].size > 0:
+            pool = self._pool['ro']
+
+        conn_id = None
+        if pool.size > 0:
+            conn_id = pool.acquire(CHECKOUT_TIMEOUT)
+            if conn_id is None:
+                wok_log.warning('No libvirt connection available in the '
+                                'pool. Using the shared connection.')
+
+        self._local.conn_id = 0 if conn_id is None else conn_id
+        try:
+            yield self.get(self._local.conn_id)
+        finally:
+            self._local.conn_id = bound
+            if conn_id is not None:
+                pool.release(conn_id)
+
+    def get(self, conn_id=None):
         """
         Return current connection to libvirt or open a new one.  Wrap all
         callable libvirt methods so we can catch connection errors and handle
         them by restarting the server.
+
+        Without conn_id, return the connection checked out by the current
+        thread, or the shared connection.
+
+        The health of an open connection is tracked by libvirt itself
+        (keepalive messages and close callback), so the libvirt service
+        state is only checked when there is no usable connection.
         """
-        def wrapMethod(f):
-            def wrapper(*args, **kwargs):
-                try:
-                    ret = f(*args, **kwargs)
-                    return ret
-                except libvirt.libvirtError as e:
-                    edom = e.get_error_domain()
-                    ecode = e.get_error_code()
-                    EDOMAINS = (libvirt.VIR_FROM_REMOTE,
-                                libvirt.VIR_FROM_RPC)
-                    ECODES = (libvirt.VIR_ERR_SYSTEM_ERROR,
-                              libvirt.VIR_ERR_INTERNAL_ERROR,
-                              libvirt.VIR_ERR_NO_CONNECT,
-                              libvirt.VIR_ERR_INVALID_CONN)
-                    if edom in EDOMAINS and ecode in ECODES:
-                        wok_log.error('Connection to libvirt broken. '
-                                      'Recycling. ecode: %d edom: %d' %
-                                      (ecode, edom))
-                        with LibvirtConnection._connectionLock:
-                            self._connections[conn_id] = None
-                    raise
-            wrapper.__name__ = f.__name__
-            wrapper.__doc__ = f.__doc__
-            return wrapper
+        if conn_id is None:
+            conn_id = getattr(self._local, 'conn_id', None)
+            if conn_id is None:
+                conn_id = 0
+
+        conn = self._connections.get(conn_id)
+        if conn is not None:
+            try:
+                if conn.isAlive():
+                    return conn
+            except libvirt.libvirtError:
+                pass
+            self._connection_lost(conn_id, conn)
+
+        # The shared connection is restored in background. The pooled ones
+        # are opened again on demand.
+        if self._reconnecting.get(0):
+            # libvirt is down: do not wait for it, the connection will be
+            # restored in background
+            return None
 
         if not is_libvirtd_up():
             wok_log.error('Libvirt service is not active.')
             add_notification('KCHCONN0002E', plugin_name='/plugins/kimchi')
+            self._start_reconnect(0)
             return None
-        elif (notificationsStore.get('KCHCONN0002E') is not None):
+
+        self._del_notification('KCHCONN0002E')
+        return self._open(conn_id)
+
+    def _wrap_method(self, f, name, conn_id):
+        def wrapper(*args, **kwargs):
             try:
-                del_notification('KCHCONN0002E')
-            except:
-                # If notification was not found, just ignore
-                pass
+                ret = f(*args, **kwargs)
+            except libvirt.libvirtError as e:
+                edom = e.get_error_domain()
+                ecode = e.get_error_code()
+                EDOMAINS = (libvirt.VIR_FROM_REMOTE,
+                            libvirt.VIR_FROM_RPC)
+                ECODES = (libvirt.VIR_ERR_SYSTEM_ERROR,
+                          libvirt.VIR_ERR_INTERNAL_ERROR,
+                          libvirt.VIR_ERR_NO_CONNECT,
+                          libvirt.VIR_ERR_INVALID_CONN)
+                if edom in EDOMAINS and ecode in ECODES:
+                    wok_log.error('Connection to libvirt broken. '
+                                  'Recycling. ecode: %d edom: %d' %
+                                  (ecode, edom))
+                    if conn_id is not None:
+                        self._connection_lost(conn_id)
+                    elif args:
+                        # Method of a libvirt object: recycle the connection
+                        # which owns it
+                        LibvirtConnection._owner_lost(
+                            getattr(args[0], '_conn', None))
+                raise
 
+            # Drop the cached XML of domains changed by Kimchi. The change is
+            # done at this point, so a failure to refresh the domain index
+            # must not be reported as a failure of the call.
+            try:
+                if name in DOMAIN_XML_MODIFIERS and args and \
+                        isinstance(args[0], libvirt.virDomain):
+                    domain_xml_cache.invalidate_dom(args[0])
+                    if name in DOMAIN_INDEX_MODIFIERS:
+                        uri = LibvirtConnection._owner_uri(
+                            getattr(args[0], '_conn', None))
+                        DomainIndex.domain_changed(uri, args[0])
+                elif name in DOMAIN_DEFINE_METHODS and \
+                        isinstance(ret, libvirt.virDomain):
+                    domain_xml_cache.invalidate_dom(ret)
+                    DomainIndex.domain_changed(self.uri, ret)
+            except Exception as e:
+                wok_log.error('Unable to refresh the domain index after '
+                              '%s: %s' % (name, str(e)))
+            return ret
+        wrapper.__name__ = name
+        wrapper.__doc__ = f.__doc__
+        return wrapper
+
+    def _open(self, conn_id, retries=5):
         with LibvirtConnection._connectionLock:
             conn = self._connections.get(conn_id)
-            if not conn:
-                retries = 5
-                while True:
-                    retries = retries - 1
-                    try:
-                        conn = libvirt.open(self.uri)
-                        break
-                    except libvirt.libvirtError:
-                        wok_log.error('Unable to connect to libvirt.')
-                        if not retries:
-                            wok_log.error("Unable to establish connection "
-                                          "with libvirt. Please check "
-                                          "your libvirt URI which is often "
-                                          "defined in "
-                                          "/etc/libvirt/libvirt.conf")
-                            add_notification("KCHCONN0001E",
-                                             plugin_name="/plugins/kimchi")
-                            return None
-                    time.sleep(2)
-
-                for name in dir(libvirt.virConnect):
-                    method = getattr(conn, name)
-                    if callable(method) and not name.startswith('_'):
-                        setattr(conn, name, wrapMethod(method))
+            if conn:
+                return conn
+
+            opener = libvirt.open
+            if conn_id < 0:
+                opener = libvirt.openReadOnly
+
+            while True:
+                retries = retries - 1
+                try:
+                    conn = opener(self.uri)
+                    break
+                except libvirt.libvirtError:
+                    wok_log.error('Unable to connect to libvirt.')
+                    if not retries:
+                        wok_log.error("Unable to establish connection "
+                                      "with libvirt. Please check "
+                                      "your libvirt URI which is often "
+                                      "defined in "
+                                      "/etc/libvirt/libvirt.conf")
+                        add_notification("KCHCONN0001E",
+                                         plugin_name="/plugins/kimchi")
+                        return None
+                time.sleep(2)
 
+            for name in dir(libvirt.virConnect):
+                method = getattr(conn, name)
+                if callable(method) and not name.startswith('_'):
+                    setattr(conn, name,
+                            self._wrap_method(method, name, conn_id))
+
+            # The libvirt objects are shared by all the connections, so
+            # wrap their classes only once
+            if not LibvirtConnection._wrappedClasses:
                 for cls in self.wrappables:
                     for name in dir(cls):
                         method = getattr(cls, name)
                         if callable(method) and not name.startswith('_'):
-                            setattr(cls, name, wrapMethod(method))
-
-                self._connections[conn_id] = conn
-                # In case we're running into troubles with keeping the
-                # connections alive we should place here:
-                # conn.setKeepAlive(interval=5, count=3)
-                # However the values need to be considered wisely to not affect
-                # hosts which are hosting a lot of virtual machines
-            return conn
+                            setattr(cls, name,
+                                    self._wrap_method(method, name, None))
+                LibvirtConnection._wrappedClasses = True
+
+            # Let libvirt detect a dead connection: it is closed when the
+            # server does not answer KEEPALIVE_COUNT keepalive messages sent
+            # every KEEPALIVE_INTERVAL seconds. Both require the libvirt
+            # event loop (see LibvirtEvents).
+            try:
+                conn.setKeepAlive(KEEPALIVE_INTERVAL, KEEPALIVE_COUNT)
+                conn.registerCloseCallback(self._close_cb, conn_id)
+            except libvirt.libvirtError as e:
+                wok_log.warning('Unable to monitor libvirt connection '
+                                'health: %s' % e.message)
+
+            self._connections[conn_id] = conn
+
+        self._del_notification('KCHCONN0001E')
+        return conn
+
+    def _close_cb(self, conn, reason, conn_id):
+        wok_log.error('Connection to libvirt closed. Reason: %d' % reason)
+        self._connection_lost(conn_id)
+        if conn_id == 0:
+            self._start_reconnect(conn_id)
+
+    @staticmethod
+    def _owner_lost(conn):
+        if conn is None:
+            return
+
+        for uri, connections in LibvirtConnection._connections.items():
+            for conn_id, current in connections.items():
+                if current is conn:
+                    LibvirtConnection(uri)._connection_lost(conn_id, conn)
+                    return
+
+    @staticmethod
+    def _owner_uri(conn):
+        if conn is None:
+            return None
+
+        for uri, connections in LibvirtConnection._connections.items():
+            for current in connections.values():
+                if current is conn:
+                    return uri
+        return None
+
+    def _connection_lost(self, conn_id, conn=None):
+        with LibvirtConnection._connectionLock:
+            current = self._connections.get(conn_id)
+            if current is None or (conn is not None and current is not conn):
+                return
+            self._connections[conn_id] = None
+
+        # Domain events may be lost until reconnection. They are only received
+        # by the shared connection, which also holds the domain index.
+        if conn_id == 0:
+            DomainIndex.discard(self.uri)
+        domain_xml_cache.clear()
+
+    def _start_reconnect(self, conn_id):
+        with LibvirtConnection._connectionLock:
+            if self._reconnecting.get(conn_id):
+                return
+            self._reconnecting[conn_id] = True
+
+        thread = threading.Thread(target=self._reconnect, args=(conn_id,))
+        thread.setName('KimchiLibvirtReconnect')
+        thread.setDaemon(True)
+        thread.start()
+
+    def _reconnect(self, conn_id):
+        """
+        Restore the connection to libvirt, waiting exponentially longer
+        between the attempts
+        """
+        delay = RECONNECT_MIN_DELAY
+        try:
+            while True:
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+                if not is_libvirtd_up():
+                    continue
+
+                if self._open(conn_id, retries=1) is not None:
+                    break
+        finally:
+            with LibvirtConnection._connectionLock:
+                self._reconnecting[conn_id] = False
+
+        wok_log.info('Connection to libvirt restored.')
+        self._del_notification('KCHCONN0002E')
+        for cb in list(self._reconnect_cbs):
+            try:
+                cb()
+            except Exception as e:
+                wok_log.error('Error restoring libvirt connection state: %s'
+                              % e.message)
+
+    def add_reconnect_callback(self, cb):
+        """
+        Register a function to be called when the connection to libvirt is
+        restored, for example to register again the libvirt events
+        """
+        self._reconnect_cbs.append(cb)
+
+    def _del_notification(self, code):
+        if notificationsStore.get(code) is None:
+            return
+        try:
+            del_notification(code)
+        except:
+            # If notification was not found, just ignore
+            pass
 
     def isQemuURI(self):
         """
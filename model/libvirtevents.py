@@ -19,7 +19,7 @@
 
 import cherrypy
 import libvirt
-import time
+import threading
 
 from wok.exception import OperationFailed
 from wok.message import WokMessage
@@ -28,25 +28,34 @@ from wok.utils import wok_log
 
 
 class LibvirtEvents(object):
+    _event_loop_thread = None
+    _event_loop_lock = threading.Lock()
+
     def __init__(self):
-        # Register default implementation of event handlers
-        if libvirt.virEventRegisterDefaultImpl() < 0:
-            raise OperationFailed('KCHEVENT0001E')
-
-        # Run a background thread with the event loop. Using cherrypy
-        # BackgroundTask class due to issues when using threading module with
-        # cherrypy.
-        self.event_loop_thread = cherrypy.process.plugins.BackgroundTask(
-            2,
-            self._event_loop_run
-        )
-        self.event_loop_thread.setName('KimchiLibvirtEventLoop')
-        self.event_loop_thread.setDaemon(True)
-        self.event_loop_thread.start()
-
-        # Set an event timeout to control the self._event_loop_run
-        if libvirt.virEventAddTimeout(0, self._kimchi_EventTimeout, None) < 0:
-            raise OperationFailed('KCHEVENT0002E')
+        # The default event loop implementation blocks in poll() on the file
+        # descriptors and timers registered by libvirt. Registering or
+        # removing them from another thread interrupts the poll, so the loop
+        # needs no periodic timeout and does not wake up while idle.
+        # Only one loop thread must run it in the process.
+        with LibvirtEvents._event_loop_lock:
+            if LibvirtEvents._event_loop_thread is None:
+                # Register default implementation of event handlers
+                if libvirt.virEventRegisterDefaultImpl() < 0:
+                    raise OperationFailed('KCHEVENT0001E')
+
+                # Run a background thread with the event loop. Using
+                # cherrypy BackgroundTask class due to issues when using
+                # threading module with cherrypy.
+                thread = cherrypy.process.plugins.BackgroundTask(
+                    2,
+                    self._event_loop_run
+                )
+                thread.setName('KimchiLibvirtEventLoop')
+                thread.setDaemon(True)
+                thread.start()
+                LibvirtEvents._event_loop_thread = thread
+
+        self.event_loop_thread = LibvirtEvents._event_loop_thread
 
     # Event loop method to be executed in background as thread
     def _event_loop_run(self):
@@ -57,10 +66,6 @@ class LibvirtEvents(object):
     def is_event_loop_alive(self):
         return self.event_loop_thread.isAlive()
 
-    # Event loop handler used to limit length of waiting for any other event.
-    def _kimchi_EventTimeout(self, timer, opaque):
-        time.sleep(0.01)
-
     def event_enospc_cb(self, conn, dom, path, dev, action, reason, args):
         if reason == "enospc":
             info = {
@@ -118,6 +123,35 @@ class LibvirtEvents(object):
         except libvirt.libvirtError as e:
             wok_log.error("register detach event failed: %s" % e.message)
 
+    def registerDomainXMLEvents(self, conn, cb, arg=None):
+        """
+        Register libvirt events to listen to any change in the domain XML:
+        lifecycle changes, devices attachment and detachment, and the
+        changes in memory, tunables, metadata, media and block jobs.
+        """
+        self.registerAttachDevicesEvent(conn, cb, arg)
+        self.registerDetachDevicesEvent(conn, cb, arg)
+
+        events = ['VIR_DOMAIN_EVENT_ID_LIFECYCLE',
+                  'VIR_DOMAIN_EVENT_ID_BALLOON_CHANGE',
+                  'VIR_DOMAIN_EVENT_ID_BLOCK_JOB',
+                  'VIR_DOMAIN_EVENT_ID_DISK_CHANGE',
+                  'VIR_DOMAIN_EVENT_ID_METADATA_CHANGE',
+                  'VIR_DOMAIN_EVENT_ID_TRAY_CHANGE',
+                  'VIR_DOMAIN_EVENT_ID_TUNABLE']
+
+        for ev in events:
+            # Older libvirt versions do not support all of them
+            if not hasattr(libvirt, ev):
+                continue
+
+            try:
+                conn.get().domainEventRegisterAny(None, getattr(libvirt, ev),
+                                                  cb, arg)
+            except (AttributeError, libvirt.libvirtError) as e:
+                wok_log.error("Unable to register domain event handler: %s" %
+                              e.message)
+
     def registerPoolEvents(self, conn, cb, arg):
         """
         Register libvirt events to listen to any pool change
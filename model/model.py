@@ -23,28 +23,70 @@ from wok.plugins.kimchi import config
 from wok.pushserver import send_wok_notification
 from wok.utils import get_all_model_instances, get_model_instances
 
+from wok.plugins.kimchi.model.domxmlcache import domain_xml_cache
+from wok.plugins.kimchi.model.eventbus import EventBus
+from wok.plugins.kimchi.model.isocatalog import IsoCatalog
 from wok.plugins.kimchi.model.libvirtconnection import LibvirtConnection
 from wok.plugins.kimchi.model.libvirtevents import LibvirtEvents
+from wok.plugins.kimchi.model.nfsmonitor import NfsMonitor
+from wok.plugins.kimchi.model.poolrefresh import pool_refresher
+from wok.plugins.kimchi.model.templateindex import template_index
+from wok.plugins.kimchi.model.volumecontent import volume_content_cache
+from wok.plugins.kimchi.model.vmstats import GuestStatsSampler
 
 
 class Model(BaseModel):
     def __init__(self, libvirt_uri=None, objstore_loc=None):
 
         self.objstore = ObjectStore(objstore_loc or config.get_object_store())
+        volume_content_cache.objstore = self.objstore
+        volume_content_cache.purge()
+        template_index.objstore = self.objstore
+        template_index.invalidate()
         self.conn = LibvirtConnection(libvirt_uri)
 
-        # Register for libvirt events
+        kimchi_config = config.config.get('kimchi', {})
+        domain_xml_cache.enabled = kimchi_config.get('domain_xml_cache', True)
+        pool_refresher.ttl = kimchi_config.get('storage_pool_refresh_ttl', 10)
+        self.conn.configure_pool(
+            kimchi_config.get('connection_pool_size', 4),
+            kimchi_config.get('readonly_connection_pool_size', 2))
+
+        # Coalesce the libvirt events before notifying the UI
+        self.eventbus = EventBus(
+            kimchi_config.get('event_coalescing_window', 1))
+        self.eventbus.subscribe(self._send_notification)
+
+        # Register for libvirt events, and register them again when the
+        # connection to libvirt is restored
         self.events = LibvirtEvents()
-        self.events.handleEnospc(self.conn)
-        self.events.registerPoolEvents(self.conn, self._events_handler,
-                                       'storages')
-        self.events.registerNetworkEvents(self.conn, self._events_handler,
-                                          'networks')
-        self.events.registerDomainEvents(self.conn, self._events_handler,
-                                         'vms')
+        self._register_events()
+        self.conn.add_reconnect_callback(self._register_events)
+
+        # Sample the guests statistics in background
+        self.statssampler = None
+        interval = kimchi_config.get('stats_sampling_interval', 5)
+        if interval > 0:
+            self.statssampler = GuestStatsSampler(
+                self.conn, interval,
+                kimchi_config.get('stats_history_size', 720))
+            self.statssampler.start()
+
+        # Keep the catalog of the ISO images up to date with the pools
+        self.isocatalog = IsoCatalog(self.conn, self.objstore)
+        self.eventbus.subscribe(self.isocatalog.events_cb)
+        self.isocatalog.scan_all()
+
+        # Check the NFS servers of the netfs pools in background
+        self.nfsmonitor = None
+        nfs_interval = kimchi_config.get('nfs_check_interval', 30)
+        if nfs_interval > 0:
+            self.nfsmonitor = NfsMonitor(self.eventbus, nfs_interval)
 
         kargs = {'objstore': self.objstore, 'conn': self.conn,
-                 'eventsloop': self.events}
+                 'eventsloop': self.events, 'statssampler': self.statssampler,
+                 'eventbus': self.eventbus, 'isocatalog': self.isocatalog,
+                 'nfsmonitor': self.nfsmonitor}
 
         models = get_all_model_instances(__name__, __file__, kargs)
 
@@ -55,7 +97,26 @@ class Model(BaseModel):
 
         super(Model, self).__init__(models)
 
-    def _events_handler(self, conn, pool, ev, details, opaque):
+    def _register_events(self):
+        self.events.handleEnospc(self.conn)
+        self.events.registerPoolEvents(self.conn, self._events_handler,
+                                       'storages')
+        self.events.registerNetworkEvents(self.conn, self._events_handler,
+                                          'networks')
+        self.events.registerDomainEvents(self.conn, self._events_handler,
+                                         'vms')
+
+        # Keep the domain XML cache in sync with the libvirt domains
+        if domain_xml_cache.enabled:
+            self.events.registerDomainXMLEvents(self.conn,
+                                                domain_xml_cache.event_cb)
+
+    def _events_handler(self, conn, obj, ev, details, opaque):
+        self.eventbus.publish(opaque, obj.name().decode('utf-8'))
+
+    def _send_notification(self, collection, idents):
+        # A single notification for all the changed resources: the UI
+        # refreshes the whole collection anyway.
         # Do not use any known method (POST, PUT, DELETE) as it is used by Wok
         # engine and may lead in having 2 notifications for the same action
-        send_wok_notification('/plugins/kimchi', opaque, 'METHOD')
+        send_wok_notification('/plugins/kimchi', collection, 'METHOD')
@@ -31,6 +31,7 @@ from wok.xmlutils.utils import xpath_get_text
 from wok.plugins.kimchi import network as netinfo
 from wok.plugins.kimchi.config import kimchiPaths
 from wok.plugins.kimchi.model.featuretests import FeatureTests
+from wok.plugins.kimchi.model.templateindex import template_index
 from wok.plugins.kimchi.osinfo import defaults as tmpl_defaults
 from wok.plugins.kimchi.xmlutils.interface import get_iface_xml
 from wok.plugins.kimchi.xmlutils.network import create_linux_bridge_xml
@@ -403,15 +404,7 @@ class NetworkModel(object):
         return (bool(vms) or bool(tmpls), vms, tmpls)
 
     def _is_network_used_by_template(self, network):
-        tmpl_list = []
-
-        with self.objstore as session:
-            templates = session.get_list('template')
-            for tmpl in templates:
-                tmpl_net = session.get('template', tmpl)['networks']
-                if network in tmpl_net:
-                    tmpl_list.append(tmpl)
-            return tmpl_list
+        return template_index.get_templates('networks', network)
 
     def _get_vms_attach_to_a_network(self, network, filter="all"):
         DOM_STATE_MAP = {'nostate': 0, 'running': 1, 'blocked': 2,
@@ -0,0 +1,235 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import cherrypy
+import socket
+import threading
+import time
+
+from wok.model.notifications import add_notification, del_notification
+from wok.model.notifications import notificationsStore
+from wok.utils import wok_log
+
+
+NFS_PORT = 2049
+NFS_CHECK_TIMEOUT = 5
+# Longest delay between two checks of an unreachable server
+NFS_MAX_BACKOFF = 300
+# Interval at which the servers due for a check are looked for
+MONITOR_TICK = 1
+
+
+class NfsMonitor(object):
+    """
+    Track the reachability of the NFS servers of the netfs pools in
+    background, so looking up a pool never waits for a dead server.
+
+    A server is monitored from the first time is_online() is asked about it.
+    It is checked by connecting to its NFS port, with a timeout of
+    NFS_CHECK_TIMEOUT seconds, every 'interval' seconds while it is online.
+    Once unreachable, the delay between the checks doubles after each
+    failure, up to NFS_MAX_BACKOFF seconds. When a server goes offline or
+    comes back online, its pools are published to the event bus, so the UI
+    is notified, and the KCHEVENT0005W notification is updated to list the
+    servers still offline.
+    """
+    def __init__(self, eventbus, interval):
+        self.eventbus = eventbus
+        self.interval = interval
+        # server: check state
+        self._servers = {}
+        self._lock = threading.Lock()
+        self._started = False
+
+        # Using cherrypy BackgroundTask class due to issues when using
+        # threading module with cherrypy.
+        self.monitor_thread = cherrypy.process.plugins.BackgroundTask(
+            MONITOR_TICK,
+            self._schedule
+        )
+        self.monitor_thread.setName('KimchiNfsMonitor')
+        self.monitor_thread.setDaemon(True)
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.monitor_thread.start()
+
+    def stop(self):
+        self.monitor_thread.cancel()
+
+    def _get_state(self, server):
+        return self._servers.setdefault(server, {'online': None,
+                                                 'pools': set(),
+                                                 'failures': 0,
+                                                 'last_check': None,
+                                                 'next_check': 0,
+                                                 'checking': None})
+
+    def is_online(self, server, pool=None, recheck=False):
+        """
+        Return the cached state of an NFS server, 'pool' being one of its
+        pools. The server is checked right away when it was never checked,
+        or with recheck (before a user action on a pool), which takes at most
+        NFS_CHECK_TIMEOUT seconds.
+        """
+        self.start()
+        with self._lock:
+            state = self._get_state(server)
+            if pool is not None:
+                state['pools'].add(pool)
+            checking = None
+            if state['online'] is None or recheck:
+                checking = self._start_check(server, state)
+
+        if checking is not None:
+            checking.wait(NFS_CHECK_TIMEOUT + 1)
+
+        with self._lock:
+            return state['online'] is True
+
+    def remove_pool(self, pool):
+        """
+        Stop monitoring the server of a deleted pool, when it has no other
+        pool
+        """
+        with self._lock:
+            changed = False
+            for server, state in self._servers.items():
+                if pool not in state['pools']:
+                    continue
+
+                state['pools'].discard(pool)
+                changed = changed or state['online'] is False
+                if not state['pools']:
+                    del self._servers[server]
+                    if state['checking'] is not None:
+                        state['checking'].set()
+            offline = self._get_offline()
+
+        # The pool is no longer inaccessible
+        if changed:
+            self._notify(offline)
+
+    def get_stats(self, server):
+        with self._lock:
+            state = self._servers.get(server)
+            if state is None:
+                return {}
+            return {'online': state['online'],
+                    'failures': state['failures'],
+                    'last_check': state['last_check'],
+                    'next_check': state['next_check']}
+
+    def _start_check(self, server, state):
+        # A check in progress is shared
+        if state['checking'] is None:
+            state['checking'] = threading.Event()
+            checker = threading.Thread(target=self._check, args=(server,))
+            checker.setName('KimchiNfsCheck')
+            checker.setDaemon(True)
+            checker.start()
+        return state['checking']
+
+    def _schedule(self):
+        now = time.time()
+        with self._lock:
+            for server, state in self._servers.iteritems():
+                if state['next_check'] <= now:
+                    self._start_check(server, state)
+
+    @staticmethod
+    def _probe(server):
+        try:
+            sock = socket.create_connection((server, NFS_PORT),
+                                            NFS_CHECK_TIMEOUT)
+            sock.close()
+            return True
+        except (socket.error, socket.timeout), e:
+            wok_log.debug('NFS server %s is unreachable: %s', server, str(e))
+            return False
+
+    def _check(self, server):
+        online = self._probe(server)
+
+        with self._lock:
+            state = self._servers.get(server)
+            if state is None:
+                # The server is not monitored anymore
+                return
+
+            changed = state['online'] is not None and \
+                state['online'] != online
+            state['online'] = online
+            state['last_check'] = time.time()
+            if online:
+                state['failures'] = 0
+                delay = self.interval
+            else:
+                state['failures'] += 1
+                delay = min(self.interval * 2 ** (state['failures'] - 1),
+                            NFS_MAX_BACKOFF)
+            state['next_check'] = state['last_check'] + delay
+            pools = sorted(state['pools'])
+            checking = state['checking']
+            state['checking'] = None
+            offline = self._get_offline()
+        if checking is not None:
+            checking.set()
+
+        if not changed:
+            return
+
+        if online:
+            wok_log.info('NFS server %s is reachable again', server)
+        else:
+            wok_log.warning('NFS server %s is unreachable', server)
+        self._notify(offline)
+        for pool in pools:
+            self.eventbus.publish('storages', pool)
+
+    def _get_offline(self):
+        """
+        Return the sorted offline servers and the sorted pools of all of them
+        """
+        servers = []
+        pools = set()
+        for server, state in self._servers.iteritems():
+            if state['online'] is False:
+                servers.append(server)
+                pools.update(state['pools'])
+        return sorted(servers), sorted(pools)
+
+    @staticmethod
+    def _notify(offline):
+        # A single notification is kept for all the offline servers
+        servers, pools = offline
+        if servers:
+            add_notification('KCHEVENT0005W',
+                             {'server': ', '.join(servers),
+                              'pools': ', '.join(pools)},
+                             '/plugins/kimchi')
+        elif notificationsStore.get('KCHEVENT0005W') is not None:
+            try:
+                del_notification('KCHEVENT0005W')
+            except:
+                # If notification was not found, just ignore
+                pass
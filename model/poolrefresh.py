@@ -0,0 +1,120 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import threading
+import time
+
+
+class PoolRefreshScheduler(object):
+    """
+    Limit the storage pool refreshes, which may take seconds on big NFS or
+    logical pools.
+
+    A pool refreshed less than 'ttl' seconds ago is not refreshed again,
+    unless Kimchi changed it in the meantime (see invalidate()). Concurrent
+    requests to refresh a pool wait for the refresh in progress instead of
+    starting another one.
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        # pool uuid: refresh state
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _get_state(self, pool_uuid):
+        return self._pools.setdefault(pool_uuid, {'last_refresh': None,
+                                                  'duration': None,
+                                                  'started': None,
+                                                  'in_progress': None,
+                                                  'stale': False,
+                                                  'refreshes': 0,
+                                                  'merged': 0,
+                                                  'skipped': 0})
+
+    def refresh(self, pool, force=False):
+        """
+        Refresh a libvirt storage pool when needed. With force, the pool is
+        refreshed regardless of the last refresh, but a refresh which started
+        after this call is still shared.
+        """
+        pool_uuid = pool.UUIDString()
+        requested = time.time()
+
+        while True:
+            with self._lock:
+                state = self._get_state(pool_uuid)
+                in_progress = state['in_progress']
+                if in_progress is None:
+                    last = state['last_refresh']
+                    if not force and not state['stale'] and \
+                            last is not None and requested - last < self.ttl:
+                        state['skipped'] += 1
+                        return
+
+                    in_progress = threading.Event()
+                    state['in_progress'] = in_progress
+                    state['started'] = time.time()
+                    state['stale'] = False
+                    break
+
+                # Only a refresh started after the request sees all the
+                # changes done before it
+                shared = not force or state['started'] >= requested
+                if shared:
+                    state['merged'] += 1
+
+            in_progress.wait()
+            if shared:
+                return
+
+        start = time.time()
+        try:
+            pool.refresh(0)
+        except:
+            with self._lock:
+                state['stale'] = True
+            raise
+        else:
+            with self._lock:
+                state['last_refresh'] = time.time()
+                state['duration'] = state['last_refresh'] - start
+                state['refreshes'] += 1
+        finally:
+            with self._lock:
+                state['in_progress'] = None
+            in_progress.set()
+
+    def invalidate(self, pool):
+        """
+        Refresh the pool on the next request, after Kimchi changed it
+        """
+        with self._lock:
+            self._get_state(pool.UUIDString())['stale'] = True
+
+    def get_stats(self, pool):
+        with self._lock:
+            state = self._get_state(pool.UUIDString())
+            return {'last_refresh': state['last_refresh'],
+                    'duration': state['duration'],
+                    'refreshes': state['refreshes'],
+                    'merged': state['merged'],
+                    'skipped': state['skipped']}
+
+
+pool_refresher = PoolRefreshScheduler(10)
@@ -0,0 +1,233 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import errno
+import libvirt
+import os
+
+
+# Smallest run of zeros which is not written
+ZERO_BLOCK_SIZE = 65536  # 64 KiB
+READ_CHUNK_SIZE = 1048576  # 1 MiB
+
+# lseek() whences, not exported by the os module on Python 2
+SEEK_DATA = getattr(os, 'SEEK_DATA', 3)
+SEEK_HOLE = getattr(os, 'SEEK_HOLE', 4)
+
+_zeros = '\0' * READ_CHUNK_SIZE
+
+
+def data_runs(data, block_size=ZERO_BLOCK_SIZE):
+    """
+    Split data in runs of blocks holding data and runs of blocks holding
+    only zeros. Return a list of (start, end, zero) tuples.
+    """
+    runs = []
+    for start in xrange(0, len(data), block_size):
+        end = min(start + block_size, len(data))
+        zero = data.count('\0', start, end) == end - start
+        if runs and runs[-1][2] == zero:
+            runs[-1] = (runs[-1][0], end, zero)
+        else:
+            runs.append((start, end, zero))
+    return runs
+
+
+def write_sparse(fd, offset, data):
+    """
+    Write data at 'offset' of the file object 'fd' skipping the zero blocks,
+    which are left as holes. The file must not hold data in the range.
+    """
+    for start, end, zero in data_runs(data):
+        if not zero:
+            fd.seek(offset + start)
+            fd.write(buffer(data, start, end - start))
+
+
+def get_upload_flags():
+    """
+    Flags to upload a volume through a sparse libvirt stream, 0 when libvirt
+    does not support it
+    """
+    return getattr(libvirt, 'VIR_STORAGE_VOL_UPLOAD_SPARSE_STREAM', 0)
+
+
+def send_sparse(stream, data):
+    """
+    Send data to a sparse libvirt stream, the zero blocks as holes
+    """
+    for start, end, zero in data_runs(data):
+        if zero:
+            stream.sendHole(end - start, 0)
+            continue
+
+        piece = data[start:end]
+        while piece:
+            piece = piece[stream.send(piece):]
+
+
+def _iter_zeros(length, chunk_size):
+    while length > 0:
+        size = min(chunk_size, length)
+        yield _zeros[:size] if size <= len(_zeros) else '\0' * size
+        length -= size
+
+
+class _Content(object):
+    """
+    Iterator over the chunks read from an opened file or stream.
+    release(done) is called once, when the iteration ends, fails or is
+    closed, even if it never started. 'done' is True when all the content
+    was read.
+    """
+    def __init__(self, chunks, release):
+        self._chunks = chunks
+        self._release = release
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            self._end(True)
+            raise
+        except Exception:
+            self._end(False)
+            raise
+
+    def close(self):
+        self._chunks.close()
+        self._end(False)
+
+    def _end(self, done):
+        if self._release is None:
+            return
+        release, self._release = self._release, None
+        release(done)
+
+
+def _read_file(fd, size, chunk_size):
+    offset = 0
+    sparse = True
+    while offset < size:
+        data_start = hole_start = size
+        if sparse:
+            try:
+                data_start = os.lseek(fd, offset, SEEK_DATA)
+                hole_start = os.lseek(fd, data_start, SEEK_HOLE)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    # No data after offset
+                    data_start = size
+                elif e.errno == errno.EINVAL:
+                    # The file system does not report holes
+                    sparse = False
+                    data_start = offset
+                else:
+                    raise
+        else:
+            data_start = offset
+
+        for zeros in _iter_zeros(data_start - offset, chunk_size):
+            yield zeros
+        offset = data_start
+
+        os.lseek(fd, offset, os.SEEK_SET)
+        while offset < hole_start:
+            data = os.read(fd, min(chunk_size, hole_start - offset))
+            if not data:
+                # The file was truncated
+                return
+            yield data
+            offset += len(data)
+
+
+def iter_file(path, chunk_size=READ_CHUNK_SIZE):
+    """
+    Iterate over the content of a file, in chunks of at most 'chunk_size'
+    bytes. The holes are located with SEEK_DATA and SEEK_HOLE, and returned
+    as zeros without reading the disk. The file is opened at once, so the
+    errors are raised by this call, and closed at the end or when the
+    iterator is closed.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+    except OSError:
+        os.close(fd)
+        raise
+    return _Content(_read_file(fd, size, chunk_size),
+                    lambda done: os.close(fd))
+
+
+def _open_download(conn, vol, size):
+    flags = getattr(libvirt, 'VIR_STORAGE_VOL_DOWNLOAD_SPARSE_STREAM', 0)
+    stream = conn.get().newStream(0)
+    try:
+        vol.download(stream, 0, size, flags)
+    except libvirt.libvirtError:
+        if not flags:
+            raise
+        # libvirtd does not support sparse streams
+        flags = 0
+        stream = conn.get().newStream(0)
+        vol.download(stream, 0, size, 0)
+    return stream, flags
+
+
+def _read_stream(stream, flags, chunk_size):
+    while True:
+        if flags:
+            data = stream.recvFlags(chunk_size,
+                                    libvirt.VIR_STREAM_RECV_STOP_AT_HOLE)
+            if data == -3:
+                for zeros in _iter_zeros(stream.recvHole(0), chunk_size):
+                    yield zeros
+                continue
+        else:
+            data = stream.recv(chunk_size)
+
+        if not data:
+            break
+        yield data
+
+
+def _end_download(stream, done):
+    if done:
+        stream.finish()
+        return
+
+    try:
+        stream.abort()
+    except libvirt.libvirtError:
+        pass
+
+
+def iter_volume(conn, vol, size, chunk_size=READ_CHUNK_SIZE):
+    """
+    Iterate over the content of a volume, in chunks of at most 'chunk_size'
+    bytes, read through a libvirt download stream. The stream is sparse when
+    libvirt supports it. It is opened at once, so the errors are raised by
+    this call, and aborted when the iterator is closed before the end.
+    """
+    stream, flags = _open_download(conn, vol, size)
+    return _Content(_read_stream(stream, flags, chunk_size),
+                    lambda done: _end_download(stream, done))
@@ -31,9 +31,11 @@ from wok.plugins.kimchi.config import config, get_kimchi_version, kimchiPaths
 from wok.plugins.kimchi.model.config import CapabilitiesModel
 from wok.plugins.kimchi.model.host import DeviceModel
 from wok.plugins.kimchi.model.libvirtstoragepool import StoragePoolDef
+from wok.plugins.kimchi.model.poolrefresh import pool_refresher
+from wok.plugins.kimchi.model.templateindex import template_index
 from wok.plugins.kimchi.osinfo import defaults as tmpl_defaults
 from wok.plugins.kimchi.scan import Scanner
-from wok.plugins.kimchi.utils import pool_name_from_uri, is_s390x
+from wok.plugins.kimchi.utils import is_s390x
 
 
 ISO_POOL_NAME = u'kimchi_isos'
@@ -138,9 +140,9 @@ class StoragePoolsModel(object):
 
     def get_list(self):
         try:
-            conn = self.conn.get()
-            names = conn.listStoragePools()
-            names += conn.listDefinedStoragePools()
+            with self.conn.checkout(readonly=True) as conn:
+                names = conn.listStoragePools()
+                names += conn.listDefinedStoragePools()
             return sorted(map(lambda x: x.decode('utf-8'), names))
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHPOOL0006E",
@@ -275,6 +277,7 @@ class StoragePoolModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
         self.objstore = kargs['objstore']
+        self.nfsmonitor = kargs.get('nfsmonitor')
 
     @staticmethod
     def get_storagepool(name, conn):
@@ -292,7 +295,7 @@ class StoragePoolModel(object):
             return 0
 
         try:
-            pool.refresh(0)
+            pool_refresher.refresh(pool)
 
         except Exception, e:
             wok_log.error("Pool refresh failed: %s" % str(e))
@@ -314,16 +317,22 @@ class StoragePoolModel(object):
                 source[key] = res
         return source
 
-    def _nfs_status_online(self, pool, poolArgs=None):
+    def _nfs_status_online(self, pool, poolArgs=None, recheck=False):
         if not poolArgs:
             xml = pool.XMLDesc(0)
             pool_type = xpath_get_text(xml, "/pool/@type")[0]
             source = self._get_storage_source(pool_type, xml)
             poolArgs = {}
-            poolArgs['name'] = pool.name()
+            poolArgs['name'] = pool.name().decode('utf-8')
             poolArgs['type'] = pool_type
             poolArgs['source'] = {'path': source['path'],
                                   'host': source['addr']}
+
+        # The state of the server is checked in background
+        if self.nfsmonitor is not None:
+            return self.nfsmonitor.is_online(poolArgs['source']['host'],
+                                             poolArgs['name'], recheck)
+
         conn = self.conn.get()
         poolDef = StoragePoolDef.create(poolArgs)
         try:
@@ -333,6 +342,11 @@ class StoragePoolModel(object):
             return False
 
     def lookup(self, name):
+        # Refreshing the pool may take long: use a connection of the pool
+        with self.conn.checkout():
+            return self._lookup(name)
+
+    def _lookup(self, name):
         pool = self.get_storagepool(name, self.conn)
         info = pool.info()
         autostart = True if pool.autostart() else False
@@ -353,6 +367,7 @@ class StoragePoolModel(object):
         else:
             nr_volumes = self._get_storagepool_vols_num(pool)
 
+        refresh_stats = pool_refresher.get_stats(pool)
         res = {'state': POOL_STATE_MAP[info[0]],
                'path': path,
                'source': source,
@@ -363,7 +378,9 @@ class StoragePoolModel(object):
                'available': info[3],
                'nr_volumes': nr_volumes,
                'persistent': persistent,
-               'in_use': self._pool_used_by_template(name)}
+               'in_use': self._pool_used_by_template(name),
+               'last_refresh': refresh_stats['last_refresh'],
+               'refresh_duration': refresh_stats['duration']}
 
         if not pool.isPersistent():
             # Deal with deep scan generated pool
@@ -399,7 +416,7 @@ class StoragePoolModel(object):
         # refreshing pool state
         pool = self.get_storagepool(pool_name, self.conn)
         if pool.isActive():
-            pool.refresh(0)
+            pool_refresher.refresh(pool, force=True)
 
     def update(self, name, params):
         pool = self.get_storagepool(name, self.conn)
@@ -425,7 +442,8 @@ class StoragePoolModel(object):
         # if the NFS server is not reachable.
         xml = pool.XMLDesc(0)
         pool_type = xpath_get_text(xml, "/pool/@type")[0]
-        if pool_type == 'netfs' and not self._nfs_status_online(pool):
+        if pool_type == 'netfs' and \
+                not self._nfs_status_online(pool, recheck=True):
             # block the user from activating the pool.
             source = self._get_storage_source(pool_type, xml)
             raise OperationFailed("KCHPOOL0032E",
@@ -438,16 +456,7 @@ class StoragePoolModel(object):
                                   {'name': name, 'err': e.get_error_message()})
 
     def _pool_used_by_template(self, pool_name):
-        with self.objstore as session:
-            templates = session.get_list('template')
-            for tmpl in templates:
-                t_info = session.get('template', tmpl)
-                for disk in t_info['disks']:
-                    if 'pool' in disk:
-                        t_pool = disk['pool']['name']
-                        if pool_name_from_uri(t_pool) == pool_name:
-                            return True
-            return False
+        return len(template_index.get_templates('pools', pool_name)) > 0
 
     def deactivate(self, name):
         if self._pool_used_by_template(name):
@@ -458,7 +467,8 @@ class StoragePoolModel(object):
         # if the NFS server is not reachable.
         xml = pool.XMLDesc(0)
         pool_type = xpath_get_text(xml, "/pool/@type")[0]
-        if pool_type == 'netfs' and not self._nfs_status_online(pool):
+        if pool_type == 'netfs' and \
+                not self._nfs_status_online(pool, recheck=True):
             # block the user from dactivating the pool.
             source = self._get_storage_source(pool_type, xml)
             raise OperationFailed("KCHPOOL0033E",
@@ -493,6 +503,9 @@ class StoragePoolModel(object):
             raise OperationFailed("KCHPOOL0011E",
                                   {'name': name, 'err': e.get_error_message()})
 
+        if self.nfsmonitor is not None:
+            self.nfsmonitor.remove_pool(name)
+
     def _get_vms_attach_to_storagepool(self, storagepool):
         conn = self.conn.get()
 
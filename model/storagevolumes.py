@@ -20,16 +20,14 @@
 import contextlib
 import libvirt
 import lxml.etree as ET
-import magic
 import os
 import tempfile
-import threading
 import time
 import urllib2
 from lxml.builder import E
 
 from wok.asynctask import AsyncTask
-from wok.exception import InvalidOperation, InvalidParameter, IsoFormatError
+from wok.exception import InvalidOperation, InvalidParameter
 from wok.exception import MissingParameter, NotFoundError, OperationFailed
 from wok.utils import get_unique_file_name
 from wok.utils import probe_file_permission_as_user, wok_log
@@ -37,10 +35,18 @@ from wok.xmlutils.utils import xpath_get_text
 from wok.model.tasks import TaskModel
 
 from wok.plugins.kimchi.config import READONLY_POOL_TYPE
-from wok.plugins.kimchi.isoinfo import IsoImage
 from wok.plugins.kimchi.kvmusertests import UserTests
 from wok.plugins.kimchi.model.diskutils import get_disk_used_by
+from wok.plugins.kimchi.model.httpdownload import HttpDownload
+from wok.plugins.kimchi.model.poolrefresh import pool_refresher
+from wok.plugins.kimchi.model.sparse import iter_file, iter_volume
 from wok.plugins.kimchi.model.storagepools import StoragePoolModel
+from wok.plugins.kimchi.model.volumeclone import add_linked_clone
+from wok.plugins.kimchi.model.volumeclone import CLONE_MODES
+from wok.plugins.kimchi.model.volumeclone import get_linked_clones, reflink
+from wok.plugins.kimchi.model.volumeclone import remove_linked_clone
+from wok.plugins.kimchi.model.volumecontent import volume_content_cache
+from wok.plugins.kimchi.model.volumeupload import StreamWriter, UploadSession
 from wok.plugins.kimchi.utils import get_next_clone_name
 
 VOLUME_TYPE_MAP = {0: 'file',
@@ -63,6 +69,7 @@ class StorageVolumesModel(object):
         self.conn = kargs['conn']
         self.objstore = kargs['objstore']
         self.task = TaskModel(**kargs)
+        self.isocatalog = kargs.get('isocatalog')
 
     def create(self, pool_name, params):
         vol_source = ['url', 'capacity']
@@ -157,6 +164,9 @@ class StorageVolumesModel(object):
 
         try:
             pool.createXML(xml, 0)
+            pool_refresher.invalidate(pool)
+            if self.isocatalog is not None:
+                self.isocatalog.invalidate(pool_name)
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHVOL0007E",
                                   {'name': name, 'pool': pool_name,
@@ -168,10 +178,10 @@ class StorageVolumesModel(object):
         vol_path = vol_info['path']
 
         if params.get('upload', False):
-            upload_volumes[vol_path] = {'lock': threading.Lock(),
-                                        'offset': 0, 'cb': cb,
-                                        'expected_vol_size': params['capacity']
-                                        }
+            vol = StorageVolumeModel.get_storagevolume(pool_name, name,
+                                                       self.conn)
+            upload_volumes[vol_path] = UploadSession(self.conn, vol,
+                                                     params['capacity'], cb)
             cb('ready for upload')
         else:
             cb('OK', True)
@@ -185,82 +195,106 @@ class StorageVolumesModel(object):
                                       objstore=self.objstore)
         pool = pool_model.lookup(pool_name)
 
+        def _progress(downloaded, size):
+            cb('%s/%s' % (downloaded, size if size is not None else '-'))
+
+        download = HttpDownload(url, None, progress_cb=_progress)
+        try:
+            response, ranges = download.probe()
+        except IOError as e:
+            raise OperationFailed('KCHVOL0007E', {'name': name,
+                                                  'pool': pool_name,
+                                                  'err': str(e)})
+
         if pool['type'] in ['dir', 'netfs']:
-            file_path = os.path.join(pool['path'], name)
+            download.path = os.path.join(pool['path'], name)
+            self._save_download(download, response, ranges, pool_name, name)
+            virt_pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
+            pool_refresher.refresh(virt_pool, force=True)
+        elif download.size is not None:
+            # Pipe the content straight into the new volume
+            with contextlib.closing(response):
+                self._upload_volume(
+                    pool_name, name, download.size,
+                    lambda write: download.stream(response, ranges, write))
         else:
-            file_path = tempfile.mkstemp(prefix=name)[1]
-
-        with contextlib.closing(urllib2.urlopen(url)) as response:
-            with open(file_path, 'w') as volume_file:
-                remote_size = response.info().getheader('Content-Length', '-')
-                downloaded_size = 0
+            # The volume size is only known once the content is downloaded
+            download.path = tempfile.mkstemp(prefix=name)[1]
 
-                try:
+            def _feed(write):
+                with open(download.path) as fd:
                     while True:
-                        chunk_data = response.read(READ_CHUNK_SIZE)
-                        if not chunk_data:
+                        data = fd.read(READ_CHUNK_SIZE)
+                        if not data:
                             break
+                        write(data)
 
-                        volume_file.write(chunk_data)
-                        downloaded_size += len(chunk_data)
-                        cb('%s/%s' % (downloaded_size, remote_size))
-                except (IOError, libvirt.libvirtError) as e:
-                    if os.path.isfile(file_path):
-                        os.remove(file_path)
+            try:
+                size = self._save_download(download, response, ranges,
+                                           pool_name, name)
+                self._upload_volume(pool_name, name, size, _feed)
+            finally:
+                if os.path.isfile(download.path):
+                    os.remove(download.path)
 
-                    raise OperationFailed('KCHVOL0007E', {'name': name,
-                                                          'pool': pool_name,
-                                                          'err': e.message})
+        if self.isocatalog is not None:
+            self.isocatalog.invalidate(pool_name, name)
+        cb('OK', True)
 
-        if pool['type'] in ['dir', 'netfs']:
-            virt_pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
-            virt_pool.refresh(0)
-        else:
-            def _stream_handler(stream, nbytes, fd):
-                return fd.read(nbytes)
+    def _save_download(self, download, response, ranges, pool_name, name):
+        try:
+            return download.save(response, ranges)
+        except IOError as e:
+            if os.path.isfile(download.path):
+                os.remove(download.path)
 
-            virt_stream = virt_vol = None
+            raise OperationFailed('KCHVOL0007E', {'name': name,
+                                                  'pool': pool_name,
+                                                  'err': str(e)})
 
-            try:
-                task = self.create(pool_name, {'name': name,
-                                               'format': 'raw',
-                                               'capacity': downloaded_size,
-                                               'allocation': downloaded_size})
-                self.task.wait(task['id'])
-                virt_vol = StorageVolumeModel.get_storagevolume(pool_name,
-                                                                name,
-                                                                self.conn)
+    def _upload_volume(self, pool_name, name, size, feed):
+        """
+        Create a raw volume of 'size' bytes and upload its content through a
+        libvirt stream. feed(write) must call write(data) with the
+        consecutive pieces of the content.
+        """
+        writer = virt_vol = None
 
-                virt_stream = self.conn.get().newStream(0)
-                virt_vol.upload(virt_stream, 0, downloaded_size, 0)
-
-                with open(file_path) as fd:
-                    virt_stream.sendAll(_stream_handler, fd)
-
-                virt_stream.finish()
-            except (IOError, libvirt.libvirtError) as e:
-                try:
-                    if virt_stream:
-                        virt_stream.abort()
-                    if virt_vol:
-                        virt_vol.delete(0)
-                except libvirt.libvirtError, virt_e:
-                    wok_log.error(virt_e.message)
-                finally:
-                    raise OperationFailed('KCHVOL0007E', {'name': name,
-                                                          'pool': pool_name,
-                                                          'err': e.message})
-            finally:
-                os.remove(file_path)
+        def _write(data):
+            writer.write(None, data)
 
-        cb('OK', True)
+        try:
+            # The volume is only allocated where data is written, when the
+            # pool and libvirt support sparse volumes
+            task = self.create(pool_name, {'name': name,
+                                           'format': 'raw',
+                                           'capacity': size})
+            self.task.wait(task['id'])
+            virt_vol = StorageVolumeModel.get_storagevolume(pool_name, name,
+                                                            self.conn)
+
+            writer = StreamWriter(self.conn, virt_vol, size)
+            feed(_write)
+            writer.finish()
+        except (IOError, libvirt.libvirtError) as e:
+            try:
+                if writer:
+                    writer.abort()
+                if virt_vol:
+                    virt_vol.delete(0)
+            except libvirt.libvirtError, virt_e:
+                wok_log.error(virt_e.message)
+            finally:
+                raise OperationFailed('KCHVOL0007E', {'name': name,
+                                                      'pool': pool_name,
+                                                      'err': str(e)})
 
     def get_list(self, pool_name):
         pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
         if not pool.isActive():
             raise InvalidOperation("KCHVOL0006E", {'pool': pool_name})
         try:
-            pool.refresh(0)
+            pool_refresher.refresh(pool)
         except Exception, e:
             wok_log.error("Pool refresh failed: %s" % str(e))
         return sorted(map(lambda x: x.decode('utf-8'), pool.listVolumes()))
@@ -273,6 +307,7 @@ class StorageVolumeModel(object):
         self.task = TaskModel(**kargs)
         self.storagevolumes = StorageVolumesModel(**kargs)
         self.storagepool = StoragePoolModel(**kargs)
+        self.isocatalog = kargs.get('isocatalog')
         if self.conn.get() is not None:
             self.libvirt_user = UserTests().probe_user()
         else:
@@ -292,8 +327,51 @@ class StorageVolumeModel(object):
             else:
                 raise
 
+    @staticmethod
+    def _get_pool_type(pool):
+        return xpath_get_text(pool.XMLDesc(0), "/pool/@type")[0]
+
     def lookup(self, pool, name):
         vol = StorageVolumeModel.get_storagevolume(pool, name, self.conn)
+        pool_type = self._get_pool_type(
+            StoragePoolModel.get_storagepool(pool, self.conn))
+        res = self._get_volume_info(vol, pool_type)
+        session = upload_volumes.get(vol.path())
+        if session is not None:
+            res['upload'] = session.get_stats()
+        return res
+
+    def lookup_all(self, pool_name):
+        """
+        Return the information of all the volumes of a pool, as returned by
+        lookup() plus their names. The pool is resolved and refreshed once,
+        and the volumes are listed with a single libvirt call.
+        """
+        pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
+        if not pool.isActive():
+            raise InvalidOperation("KCHVOL0006E", {'pool': pool_name})
+        try:
+            pool_refresher.refresh(pool)
+        except Exception, e:
+            wok_log.error("Pool refresh failed: %s" % str(e))
+
+        pool_type = self._get_pool_type(pool)
+        res_list = []
+        for vol in pool.listAllVolumes(0):
+            try:
+                res = self._get_volume_info(vol, pool_type)
+            except libvirt.libvirtError:
+                # Volume might be deleted just after we get the list.
+                # This is OK, just skip.
+                continue
+            res['name'] = vol.name().decode('utf-8')
+            session = upload_volumes.get(res['path'])
+            if session is not None:
+                res['upload'] = session.get_stats()
+            res_list.append(res)
+        return sorted(res_list, key=lambda res: res['name'])
+
+    def _get_volume_info(self, vol, pool_type):
         path = vol.path()
         info = vol.info()
         xml = vol.XMLDesc(0)
@@ -305,18 +383,13 @@ class StorageVolumeModel(object):
             # it's 'raw'.
             fmt = 'raw'
 
-        iso_img = None
+        iso_info = None
 
         # 'raw' volumes from 'logical' pools may actually be 'iso';
         # libvirt always reports them as 'raw'
-        pool_info = self.storagepool.lookup(pool)
-        if pool_info['type'] == 'logical' and fmt == 'raw':
-            try:
-                iso_img = IsoImage(path)
-            except IsoFormatError:
-                # not 'iso' afterall
-                pass
-            else:
+        if pool_type == 'logical' and fmt == 'raw':
+            iso_info = volume_content_cache.get_iso_info(path, info[1])
+            if iso_info['is_iso']:
                 fmt = 'iso'
 
         # 'raw' volumes can not be valid image disks (e.g. XML, PDF, TXT are
@@ -324,11 +397,9 @@ class StorageVolumeModel(object):
         isvalid = True
         if fmt == 'raw':
             try:
-                ms = magic.open(magic.NONE)
-                ms.load()
-                if ms.file(path).lower() not in VALID_RAW_CONTENT:
+                file_type = volume_content_cache.get_file_type(path, info[1])
+                if file_type.lower() not in VALID_RAW_CONTENT:
                     isvalid = False
-                ms.close()
             except UnicodeDecodeError:
                 isvalid = False
 
@@ -348,22 +419,29 @@ class StorageVolumeModel(object):
         if fmt == 'iso':
             if os.path.islink(path):
                 path = os.path.join(os.path.dirname(path), os.readlink(path))
-            os_distro = os_version = 'unknown'
-            try:
-                if iso_img is None:
-                    iso_img = IsoImage(path)
-                os_distro, os_version = iso_img.probe()
-                bootable = True
-            except IsoFormatError:
-                bootable = False
+            if iso_info is None:
+                iso_info = volume_content_cache.get_iso_info(path, info[1])
 
             res.update(
-                dict(os_distro=os_distro, os_version=os_version, path=path,
-                     bootable=bootable))
+                dict(os_distro=iso_info['os_distro'],
+                     os_version=iso_info['os_version'], path=path,
+                     bootable=iso_info['bootable']))
         return res
 
+    def _check_linked_clones(self, name, path):
+        # the linked clones read the blocks they have not written from the
+        # volume, so changing or removing it corrupts all of them
+        clones = get_linked_clones(self.objstore, path)
+        if clones:
+            raise InvalidOperation("KCHVOL0035E",
+                                   {'name': name, 'clones': ', '.join(clones)})
+
     def wipe(self, pool, name):
         volume = StorageVolumeModel.get_storagevolume(pool, name, self.conn)
+        self._check_linked_clones(name, volume.path())
+        volume_content_cache.invalidate(volume.path())
+        if self.isocatalog is not None:
+            self.isocatalog.invalidate(pool, name)
         try:
             volume.wipePattern(libvirt.VIR_STORAGE_VOL_WIPE_ALG_ZERO, 0)
         except libvirt.libvirtError as e:
@@ -378,12 +456,24 @@ class StorageVolumeModel(object):
 
         volume = StorageVolumeModel.get_storagevolume(pool, name, self.conn)
         vol_path = volume.path()
+        self._check_linked_clones(name, vol_path)
         try:
             volume.delete(0)
+            volume_content_cache.invalidate(vol_path)
+            pool_refresher.invalidate(
+                StoragePoolModel.get_storagepool(pool, self.conn))
+            if self.isocatalog is not None:
+                self.isocatalog.invalidate(pool)
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHVOL0010E",
                                   {'name': name, 'err': e.get_error_message()})
 
+        try:
+            remove_linked_clone(self.objstore, vol_path)
+        except Exception as e:
+            wok_log.error("Unable to remove linked clone %s from the object "
+                          "store. Details: %s", vol_path, e.message)
+
         try:
             os.remove(vol_path)
         except OSError, e:
@@ -392,6 +482,7 @@ class StorageVolumeModel(object):
 
     def resize(self, pool, name, size):
         volume = StorageVolumeModel.get_storagevolume(pool, name, self.conn)
+        self._check_linked_clones(name, volume.path())
 
         # When decreasing the storage volume capacity, the flag
         # VIR_STORAGE_VOL_RESIZE_SHRINK must be used
@@ -409,7 +500,7 @@ class StorageVolumeModel(object):
             raise OperationFailed("KCHVOL0011E",
                                   {'name': name, 'err': e.get_error_message()})
 
-    def clone(self, pool, name, new_pool=None, new_name=None):
+    def clone(self, pool, name, new_pool=None, new_name=None, mode=None):
         """Clone a storage volume.
 
         Arguments:
@@ -420,6 +511,11 @@ class StorageVolumeModel(object):
             original one.
         new_name -- The name of the new volume (optional). If omitted, a new
             value based on the original volume's name will be used.
+        mode -- How the volume is cloned (optional): 'full' (default) copies
+            all its data, 'linked' creates a qcow2 volume using the original
+            one as its backing store and 'reflink' shares the extents of the
+            original file, falling back to a full copy when the file system
+            does not support it.
 
         Return:
         A Task running the clone operation.
@@ -428,6 +524,17 @@ class StorageVolumeModel(object):
         if new_pool is None:
             new_pool = pool
 
+        if mode is None:
+            mode = u'full'
+        if mode not in CLONE_MODES:
+            raise InvalidParameter('KCHVOL0033E')
+
+        # the overlay of a linked clone is a qcow2 file
+        if mode == 'linked':
+            vir_pool = StoragePoolModel.get_storagepool(new_pool, self.conn)
+            if self._get_pool_type(vir_pool) not in ['dir', 'netfs']:
+                raise InvalidOperation('KCHVOL0034E', {'pool': new_pool})
+
         # a default name based on the original name will be used if no name
         # is specified
         if new_name is None:
@@ -438,7 +545,8 @@ class StorageVolumeModel(object):
         params = {'pool': pool,
                   'name': name,
                   'new_pool': new_pool,
-                  'new_name': new_name}
+                  'new_name': new_name,
+                  'mode': mode}
         target_uri = u'/plugins/kimchi/storagepools/%s/storagevolumes/%s/clone'
         taskid = AsyncTask(target_uri % (pool, new_name), self._clone_task,
                            params).id
@@ -448,7 +556,7 @@ class StorageVolumeModel(object):
         """Asynchronous function which performs the clone operation.
 
         This function copies all the data inside the original volume into the
-        new one.
+        new one, unless a linked or reflink clone was requested.
 
         Arguments:
         cb -- A callback function to signal the Task's progress.
@@ -457,11 +565,13 @@ class StorageVolumeModel(object):
             "name": The name of the original volume.
             "new_pool": The name of the destination pool.
             "new_name": The name of the new volume.
+            "mode": 'full', 'linked' or 'reflink'.
         """
         orig_pool_name = params['pool']
         orig_vol_name = params['name']
         new_pool_name = params['new_pool']
         new_vol_name = params['new_name']
+        mode = params.get('mode', 'full')
 
         try:
             cb('setting up volume cloning')
@@ -472,42 +582,108 @@ class StorageVolumeModel(object):
             new_vir_pool = StoragePoolModel.get_storagepool(new_pool_name,
                                                             self.conn)
 
-            cb('building volume XML')
-            root_elem = E.volume()
-            root_elem.append(E.name(new_vol_name))
-            root_elem.append(E.capacity(unicode(orig_vol['capacity']),
-                                        unit='bytes'))
-            target_elem = E.target()
-            target_elem.append(E.format(type=orig_vol['format']))
-            root_elem.append(target_elem)
-            new_vol_xml = ET.tostring(root_elem, encoding='utf-8',
-                                      pretty_print=True)
-
-            cb('cloning volume')
-            new_vir_pool.createXMLFrom(new_vol_xml, orig_vir_vol, 0)
+            if mode == 'reflink':
+                cb('sharing volume extents')
+                if self._clone_reflink(orig_vol['path'], new_vir_pool,
+                                       new_vol_name):
+                    mode = None
+                else:
+                    wok_log.info('Unable to reflink storage volume %s, '
+                                 'copying it', orig_vol['path'])
+                    mode = 'full'
+
+            if mode is not None:
+                cb('building volume XML')
+                root_elem = E.volume()
+                root_elem.append(E.name(new_vol_name))
+                root_elem.append(E.capacity(unicode(orig_vol['capacity']),
+                                            unit='bytes'))
+                target_elem = E.target()
+                root_elem.append(target_elem)
+
+                if mode == 'linked':
+                    # only the blocks written by the new volume are stored
+                    # in it, the original one must not be changed afterwards
+                    orig_format = orig_vol['format']
+                    if orig_format == 'iso':
+                        orig_format = 'raw'
+                    target_elem.append(E.format(type='qcow2'))
+                    root_elem.append(E.backingStore(
+                        E.path(orig_vol['path']), E.format(type=orig_format)))
+                else:
+                    target_elem.append(E.format(type=orig_vol['format']))
+                new_vol_xml = ET.tostring(root_elem, encoding='utf-8',
+                                          pretty_print=True)
+
+                if mode == 'linked':
+                    cb('creating linked volume')
+                    new_vir_vol = new_vir_pool.createXML(new_vol_xml, 0)
+                    # keep track of the clone to protect its backing volume,
+                    # an untracked clone would be silently corrupted later
+                    try:
+                        add_linked_clone(self.objstore, new_vir_vol.path(),
+                                         orig_vol['path'])
+                    except Exception:
+                        new_vir_vol.delete(0)
+                        raise
+                else:
+                    cb('cloning volume')
+                    new_vir_pool.createXMLFrom(new_vol_xml, orig_vir_vol, 0)
+                pool_refresher.invalidate(new_vir_pool)
+
+            if self.isocatalog is not None:
+                self.isocatalog.invalidate(new_pool_name)
         except (InvalidOperation, NotFoundError, libvirt.libvirtError), e:
             raise OperationFailed('KCHVOL0023E',
                                   {'name': orig_vol_name,
                                    'pool': orig_pool_name,
                                    'err': e.get_error_message()})
+        except OSError, e:
+            raise OperationFailed('KCHVOL0023E',
+                                  {'name': orig_vol_name,
+                                   'pool': orig_pool_name,
+                                   'err': str(e)})
 
         self.lookup(new_pool_name, new_vol_name)
 
         cb('OK', True)
 
-    def doUpload(self, cb, vol, offset, data, data_size):
+    def _clone_reflink(self, orig_path, vir_pool, name):
+        """Create the volume 'name' in the pool sharing the extents of the
+        file 'orig_path'. Return False when it is not possible.
+        """
+        if self._get_pool_type(vir_pool) not in ['dir', 'netfs']:
+            return False
+
+        pool_path = xpath_get_text(vir_pool.XMLDesc(0),
+                                   '/pool/target/path')[0]
+        if not os.path.isfile(orig_path) or not os.path.isdir(pool_path):
+            return False
+
+        if not reflink(orig_path, os.path.join(pool_path, name)):
+            return False
+
+        # The file was created behind libvirt
+        pool_refresher.refresh(vir_pool, force=True)
+        return True
+
+    def doUpload(self, session, vol, offset, data, data_size):
         try:
-            st = self.conn.get().newStream(0)
-            vol.upload(st, offset, data_size)
-            st.send(data)
-            st.finish()
+            return session.write(offset, data)
+        except OperationFailed:
+            # The chunk was received too early, it can be sent again
+            raise
         except Exception as e:
-            st and st.abort()
-            cb('', False)
+            upload_volumes.pop(session.path, None)
+            try:
+                session.abort()
+            except Exception:
+                pass
+            session.cb('', False)
 
             try:
                 vol.delete(0)
-            except Exception as e:
+            except Exception:
                 pass
 
             raise OperationFailed("KCHVOL0029E", {"err": e.message})
@@ -521,56 +697,67 @@ class StorageVolumeModel(object):
 
         vol = StorageVolumeModel.get_storagevolume(pool, name, self.conn)
         vol_path = vol.path()
-        vol_capacity = vol.info()[1]
 
-        vol_data = upload_volumes.get(vol_path)
-        if vol_data is None:
+        session = upload_volumes.get(vol_path)
+        if session is None:
             raise OperationFailed("KCHVOL0027E", {"vol": vol_path})
 
-        cb = vol_data['cb']
-        lock = vol_data['lock']
-        with lock:
-            offset = vol_data['offset']
-            if (offset + chunk_size) > vol_capacity:
-                raise OperationFailed("KCHVOL0028E")
+        # Without offset, the chunk follows the content received so far
+        offset = params.get('offset')
+        offset = session.next_offset() if offset is None else int(offset)
+        if (offset + chunk_size) > session.size:
+            raise OperationFailed("KCHVOL0028E")
 
-            cb('%s/%s' % (offset, vol_capacity))
-            self.doUpload(cb, vol, offset, chunk_data, chunk_size)
-            cb('%s/%s' % (offset + chunk_size, vol_capacity))
+        volume_content_cache.invalidate(vol_path)
+        complete = self.doUpload(session, vol, offset, chunk_data, chunk_size)
+        stats = session.get_stats()
+        session.cb('%s/%s' % (stats['received'], stats['size']))
 
-            vol_data['offset'] += chunk_size
-            if (vol_data['offset'] == vol_capacity) or \
-               (vol_data['offset'] == vol_data['expected_vol_size']):
-                del upload_volumes[vol_path]
-                cb('OK', True)
+        # Only the first request to complete the upload finishes it
+        if complete and upload_volumes.pop(vol_path, None) is not None:
+            try:
+                session.finish()
+            except (OSError, libvirt.libvirtError) as e:
+                session.cb('', False)
+                raise OperationFailed("KCHVOL0029E", {"err": e.message})
 
+            pool_refresher.invalidate(vol.storagePoolLookupByVolume())
+            if self.isocatalog is not None:
+                self.isocatalog.invalidate(pool, name)
+            session.cb('OK', True)
 
-class IsoVolumesModel(object):
+
+class StorageVolumeDownloadModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
-        self.storagevolume = StorageVolumeModel(**kargs)
 
-    def get_list(self):
-        iso_volumes = []
-        conn = self.conn.get()
-        pools = conn.listStoragePools()
-        pools += conn.listDefinedStoragePools()
+    def lookup(self, pool, name):
+        """
+        Return the size of a volume and an iterator over its content. The
+        holes of the sparse volumes are not read. The volume is opened here,
+        so the errors are reported before the response is sent, and closed
+        with the iterator, even when the response is not sent.
+        """
+        vol = StorageVolumeModel.get_storagevolume(pool, name, self.conn)
+        path = vol.path()
+        info = vol.info()
+        try:
+            if VOLUME_TYPE_MAP[info[0]] == 'file' and os.path.isfile(path):
+                size = os.path.getsize(path)
+                content = iter_file(path)
+            else:
+                size = info[1]
+                content = iter_volume(self.conn, vol, size)
+        except (OSError, libvirt.libvirtError) as e:
+            raise OperationFailed("KCHVOL0032E", {'name': name, 'pool': pool,
+                                                  'err': str(e)})
+
+        return {'name': name, 'size': size, 'content': content}
 
-        for pool_name in pools:
-            try:
-                pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
-                pool.refresh(0)
-                volumes = pool.listVolumes()
-            except Exception, e:
-                # Skip inactive pools
-                wok_log.debug("Shallow scan: skipping pool %s because of "
-                              "error: %s", (pool_name, e.message))
-                continue
 
-            for volume in volumes:
-                res = self.storagevolume.lookup(pool_name,
-                                                volume.decode("utf-8"))
-                if res['format'] == 'iso' and res['bootable']:
-                    res['name'] = '%s' % volume
-                    iso_volumes.append(res)
-        return iso_volumes
+class IsoVolumesModel(object):
+    def __init__(self, **kargs):
+        self.isocatalog = kargs['isocatalog']
+
+    def get_list(self):
+        return self.isocatalog.get_list()
@@ -0,0 +1,123 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import threading
+
+from wok.plugins.kimchi.utils import pool_name_from_uri
+
+
+# Kinds of resources used by the templates
+TEMPLATE_INDEX_KINDS = ['pools', 'networks']
+
+
+def _get_template_resources(info):
+    pools = set()
+    for disk in info.get('disks', []):
+        if 'pool' in disk:
+            pools.add(pool_name_from_uri(disk['pool']['name']))
+
+    return {'pools': pools,
+            'networks': set(info.get('networks', []))}
+
+
+class TemplateIndex(object):
+    """
+    Reverse index of the resources used by the templates: storage pool
+    names and network names, each mapped to the names of the templates using
+    them. Telling whether a pool or a network is in use then does not read
+    every template from the object store.
+
+    The index is built from the object store on its first query, and then
+    kept up to date by the templates model as the templates are created,
+    updated and deleted. invalidate() makes the next query build it again,
+    after the templates were changed by other means.
+    """
+    def __init__(self):
+        self.objstore = None
+        # template name: resources used by the template
+        self._templates = None
+        # kind: resource: set of template names
+        self._index = {}
+        self._lock = threading.RLock()
+
+    def invalidate(self):
+        with self._lock:
+            self._templates = None
+
+    def _build(self):
+        self._templates = {}
+        self._index = dict((kind, {}) for kind in TEMPLATE_INDEX_KINDS)
+        if self.objstore is None:
+            return
+
+        with self.objstore as session:
+            for name in session.get_list('template'):
+                info = session.get('template', name, ignore_missing=True)
+                if info is not None:
+                    self._add(name, info)
+
+    def _ensure_built(self):
+        if self._templates is None:
+            self._build()
+
+    def _add(self, name, info):
+        self._remove(name)
+        resources = _get_template_resources(info)
+        self._templates[name] = resources
+        for kind, keys in resources.iteritems():
+            for key in keys:
+                self._index[kind].setdefault(key, set()).add(name)
+
+    def _remove(self, name):
+        resources = self._templates.pop(name, None)
+        if resources is None:
+            return
+
+        for kind, keys in resources.iteritems():
+            for key in keys:
+                names = self._index[kind].get(key)
+                if names is not None:
+                    names.discard(name)
+                    if not names:
+                        del self._index[kind][key]
+
+    def add(self, name, info):
+        """
+        Index a template stored with the information 'info'
+        """
+        with self._lock:
+            if self._templates is not None:
+                self._add(name, info)
+
+    def remove(self, name):
+        with self._lock:
+            if self._templates is not None:
+                self._remove(name)
+
+    def get_templates(self, kind, key):
+        """
+        Return the sorted names of the templates using the resource 'key' of
+        the kind 'pools' or 'networks'
+        """
+        with self._lock:
+            self._ensure_built()
+            return sorted(self._index[kind].get(key, []))
+
+
+template_index = TemplateIndex()
@@ -19,7 +19,6 @@
 
 import copy
 import libvirt
-import magic
 import os
 import platform
 import psutil
@@ -35,6 +34,8 @@ from wok.xmlutils.utils import xpath_get_text
 from wok.plugins.kimchi.config import get_kimchi_version
 from wok.plugins.kimchi.kvmusertests import UserTests
 from wok.plugins.kimchi.model.cpuinfo import CPUInfoModel
+from wok.plugins.kimchi.model.templateindex import template_index
+from wok.plugins.kimchi.model.volumecontent import get_file_type
 from wok.plugins.kimchi.utils import is_libvirtd_up, pool_name_from_uri
 from wok.plugins.kimchi.utils import create_disk_image
 from wok.plugins.kimchi.vmtemplate import VMTemplate
@@ -93,10 +94,8 @@ class TemplatesModel(object):
         if not os.path.exists(path):
             raise InvalidParameter("KCHTMPL0002E", {'path': path})
 
-        # create magic object to discover file type
-        file_type = magic.open(magic.MAGIC_NONE)
-        file_type.load()
-        ftype = file_type.file(path)
+        # discover file type
+        ftype = get_file_type(path)
 
         # cdrom
         iscdrom = [t for t in ISO_TYPE if t in ftype]
@@ -150,6 +149,7 @@ class TemplatesModel(object):
             with self.objstore as session:
                 session.store('template', name, t.info,
                               get_kimchi_version())
+            template_index.add(name, t.info)
         except InvalidOperation:
             raise
         except Exception, e:
@@ -224,6 +224,7 @@ class TemplateModel(object):
         try:
             with self.objstore as session:
                 session.delete('template', name)
+            template_index.remove(name)
         except NotFoundError:
             raise
         except Exception as e:
@@ -35,6 +35,7 @@ from wok.rollbackcontext import RollbackContext
 from wok.utils import run_command, wok_log
 
 from wok.plugins.kimchi.model.config import CapabilitiesModel
+from wok.plugins.kimchi.model.domxmlcache import domain_xml_cache
 from wok.plugins.kimchi.model.host import DeviceModel, DevicesModel
 from wok.plugins.kimchi.model.utils import get_vm_config_flag
 from wok.plugins.kimchi.model.vms import DOM_STATE_MAP, VMModel
@@ -66,7 +67,7 @@ class VMHostDevsModel(object):
 
     def get_list(self, vmid):
         dom = VMModel.get_vm(vmid, self.conn)
-        xmlstr = dom.XMLDesc(0)
+        xmlstr = domain_xml_cache.get(dom)
         root = objectify.fromstring(xmlstr)
         try:
             hostdev = root.devices.hostdev
@@ -141,7 +142,7 @@ class VMHostDevsModel(object):
     def have_usb_controller(self, vmid):
         dom = VMModel.get_vm(vmid, self.conn)
 
-        root = objectify.fromstring(dom.XMLDesc(0))
+        root = objectify.fromstring(domain_xml_cache.get(dom))
 
         try:
             controllers = root.devices.controller
@@ -213,7 +214,7 @@ class VMHostDevsModel(object):
                 wok_log.warning("Unable to turn on sebool virt_use_sysfs")
 
     def _available_slot(self, dom):
-        xmlstr = dom.XMLDesc(0)
+        xmlstr = domain_xml_cache.get(dom)
         root = objectify.fromstring(xmlstr)
         slots = []
         try:
@@ -371,7 +372,7 @@ class VMHostDevsModel(object):
 
     def _count_3D_devices_attached(self, dom):
         counter = 0
-        root = objectify.fromstring(dom.XMLDesc(0))
+        root = objectify.fromstring(domain_xml_cache.get(dom))
 
         try:
             hostdev = root.devices.hostdev
@@ -420,7 +421,7 @@ class VMHostDevsModel(object):
             self.conn.get().defineXML(new_xml)
 
     def _update_win_memory_size(self, dom, counter, wnd_size):
-        root = objectify.fromstring(dom.XMLDesc(0))
+        root = objectify.fromstring(domain_xml_cache.get(dom))
 
         # look for the existing argument in <qemu:commandline> and try
         # to update the value (or remove if there is only one (or none)
@@ -444,7 +445,7 @@ class VMHostDevsModel(object):
         return None
 
     def _add_win_memory_size(self, dom, wnd_size):
-        root = objectify.fromstring(dom.XMLDesc(0))
+        root = objectify.fromstring(domain_xml_cache.get(dom))
         val = CMDLINE_FIELD_NAME + '=' + wnd_size
 
         cmdline = root.find('{%s}commandline' % QEMU_NAMESPACE)
@@ -583,7 +584,7 @@ class VMHostDevModel(object):
 
     def lookup(self, vmid, dev_name):
         dom = VMModel.get_vm(vmid, self.conn)
-        xmlstr = dom.XMLDesc(0)
+        xmlstr = domain_xml_cache.get(dom)
         root = objectify.fromstring(xmlstr)
         try:
             hostdev = root.devices.hostdev
@@ -607,7 +608,7 @@ class VMHostDevModel(object):
 
     def delete(self, vmid, dev_name):
         dom = VMModel.get_vm(vmid, self.conn)
-        xmlstr = dom.XMLDesc(0)
+        xmlstr = domain_xml_cache.get(dom)
         root = objectify.fromstring(xmlstr)
 
         try:
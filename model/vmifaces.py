@@ -20,13 +20,14 @@
 import libvirt
 import os
 import random
-from lxml import etree, objectify
+from lxml import etree
 
 from wok.exception import InvalidParameter, MissingParameter
 from wok.exception import NotFoundError, InvalidOperation
 
 from wok.plugins.kimchi.model.config import CapabilitiesModel
 from wok.plugins.kimchi.model.vms import DOM_STATE_MAP, VMModel
+from wok.plugins.kimchi.xmlutils.domain import DomainXML
 from wok.plugins.kimchi.xmlutils.interface import get_iface_xml
 
 
@@ -86,8 +87,9 @@ class VMIfacesModel(object):
                 params['type'] = 'bridge'
                 params['virtualport_type'] = 'openvswitch'
 
-        macs = (iface.mac.get('address')
-                for iface in self.get_vmifaces(vm, self.conn))
+        dom = VMModel.get_vm(vm, self.conn)
+        domxml = DomainXML.from_dom(dom, 0)
+        macs = [iface.mac.get('address') for iface in domxml.interfaces()]
 
         # user defined customized mac address
         if 'mac' in params and params['mac']:
@@ -103,10 +105,7 @@ class VMIfacesModel(object):
                 if params['mac'] not in macs:
                     break
 
-        dom = VMModel.get_vm(vm, self.conn)
-
-        os_data = VMModel.vm_get_os_metadata(dom)
-        os_version, os_distro = os_data
+        os_version, os_distro = domxml.os_metadata()
         xml = get_iface_xml(params, conn.getInfo()[0], os_distro, os_version)
 
         flags = 0
@@ -121,10 +120,7 @@ class VMIfacesModel(object):
     @staticmethod
     def get_vmifaces(vm, conn):
         dom = VMModel.get_vm(vm, conn)
-        xml = dom.XMLDesc(0)
-        root = objectify.fromstring(xml)
-
-        return root.devices.findall("interface")
+        return DomainXML.from_dom(dom, 0).interfaces()
 
     @staticmethod
     def random_mac():
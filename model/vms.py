@@ -34,7 +34,6 @@ import time
 import uuid
 from lxml import etree, objectify
 from lxml.builder import E
-from xml.etree import ElementTree
 
 from wok import websocket
 from wok.asynctask import AsyncTask
@@ -54,6 +53,7 @@ from wok.plugins.kimchi.config import READONLY_POOL_TYPE, get_kimchi_version
 from wok.plugins.kimchi.kvmusertests import UserTests
 from wok.plugins.kimchi.model.config import CapabilitiesModel
 from wok.plugins.kimchi.model.cpuinfo import CPUInfoModel
+from wok.plugins.kimchi.model.domainindex import DomainIndex
 from wok.plugins.kimchi.model.featuretests import FeatureTests
 from wok.plugins.kimchi.model.templates import PPC_MEM_ALIGN
 from wok.plugins.kimchi.model.templates import TemplateModel, validate_memory
@@ -61,6 +61,10 @@ from wok.plugins.kimchi.model.utils import get_ascii_nonascii_name, get_vm_name
 from wok.plugins.kimchi.model.utils import get_metadata_node
 from wok.plugins.kimchi.model.utils import remove_metadata_node
 from wok.plugins.kimchi.model.utils import set_metadata_node
+from wok.plugins.kimchi.model.vmstats import GuestStatsCollector
+from wok.plugins.kimchi.model.volumeclone import CLONE_MODES
+from wok.plugins.kimchi.model.volumeclone import get_linked_clones
+from wok.plugins.kimchi.model.volumeclone import remove_linked_clone
 from wok.plugins.kimchi.osinfo import defaults, MEM_DEV_SLOTS
 from wok.plugins.kimchi.screenshot import VMScreenshot
 from wok.plugins.kimchi.utils import get_next_clone_name, is_s390x
@@ -69,9 +73,13 @@ from wok.plugins.kimchi.xmlutils.bootorder import get_bootorder_node
 from wok.plugins.kimchi.xmlutils.bootorder import get_bootmenu_node
 from wok.plugins.kimchi.xmlutils.cpu import get_topology_xml
 from wok.plugins.kimchi.xmlutils.disk import get_vm_disk_info, get_vm_disks
+from wok.plugins.kimchi.xmlutils.domain import DomainXML
 from utils import has_cpu_numa, set_numa_memory
 
 
+# Time to clone all the disks of a VM
+CLONE_DISKS_TIMEOUT = 3600  # 1 h
+
 DOM_STATE_MAP = {0: 'nostate',
                  1: 'running',
                  2: 'blocked',
@@ -101,11 +109,8 @@ XPATH_DOMAIN_UUID = '/domain/uuid'
 XPATH_DOMAIN_DEV_CPU_ID = '/domain/devices/spapr-cpu-socket/@id'
 XPATH_DOMAIN_CONSOLE_TARGET = "/domain/devices/console/target/@type"
 
-XPATH_BOOT = 'os/boot/@dev'
-XPATH_BOOTMENU = 'os/bootmenu/@enable'
 XPATH_CPU = './cpu'
 XPATH_DESCRIPTION = './description'
-XPATH_MEMORY = './memory'
 XPATH_NAME = './name'
 XPATH_NUMA_CELL = './cpu/numa/cell'
 XPATH_SNAP_VM_NAME = './domain/name'
@@ -220,10 +225,15 @@ class VMsModel(object):
         cb('OK', True)
 
     def get_list(self):
-        return VMsModel.get_vms(self.conn)
+        with self.conn.checkout(readonly=True):
+            return VMsModel.get_vms(self.conn)
 
     @staticmethod
     def get_vms(conn):
+        index = DomainIndex.get_index(conn)
+        if index is not None:
+            return index.names()
+
         conn_ = conn.get()
         names = []
         for dom in conn_.listAllDomains(0):
@@ -258,7 +268,9 @@ class VMModel(object):
         self.vmsnapshot = cls(**kargs)
         cls = import_class('plugins.kimchi.model.vmsnapshots.VMSnapshotsModel')
         self.vmsnapshots = cls(**kargs)
-        self.stats = {}
+        self.stats_collector = GuestStatsCollector(self.conn)
+        self.stats = self.stats_collector.stats
+        self.stats_sampler = kargs.get('statssampler')
         self._serial_procs = []
 
     def has_topology(self, dom):
@@ -317,7 +329,7 @@ class VMModel(object):
                 vm_name, dom = self._static_vm_update(name, dom, params)
             return vm_name
 
-    def clone(self, name):
+    def clone(self, name, mode=None):
         """Clone a virtual machine based on an existing one.
 
         The new virtual machine will have the exact same configuration as the
@@ -336,12 +348,27 @@ class VMModel(object):
         original storage pool) and if one of the virtual machine's disks belong
         to a storage pool not supported by Kimchi.
 
+        The disks are cloned in parallel, according to 'mode': 'full' copies
+        all their data, 'linked' creates qcow2 volumes using the original
+        disks as their backing stores and 'reflink' shares the extents of the
+        original files, falling back to a full copy when the file system does
+        not support it. The fast modes take seconds whatever the size of the
+        disks. The original virtual machine can not be started nor deleted
+        while its linked clones exist, as any write to their backing stores
+        would corrupt them.
+
         Parameters:
         name -- The name of the existing virtual machine to be cloned.
+        mode -- 'full' (default), 'linked' or 'reflink'.
 
         Return:
         A Task running the clone operation.
         """
+        if mode is None:
+            mode = u'full'
+        if mode not in CLONE_MODES:
+            raise InvalidParameter('KCHVM0093E')
+
         # VM must be shutoff in order to clone it
         info = self.lookup(name)
         if info['state'] != u'shutoff':
@@ -367,7 +394,8 @@ class VMModel(object):
         # create a task with the actual clone function
         taskid = AsyncTask(u'/plugins/kimchi/vms/%s/clone' % new_name,
                            self._clone_task, {'name': name,
-                                              'new_name': new_name}).id
+                                              'new_name': new_name,
+                                              'mode': mode}).id
 
         return self.task.lookup(taskid)
 
@@ -379,7 +407,13 @@ class VMModel(object):
         params -- A dict with the following values:
             "name": the name of the original VM.
             "new_name": the name of the new VM.
+            "mode": how the disks are cloned.
         """
+        # Copying the disks takes long: use a connection of the pool
+        with self.conn.checkout():
+            self._clone(cb, params)
+
+    def _clone(self, cb, params):
         name = params['name']
         new_name = params['new_name']
 
@@ -406,7 +440,8 @@ class VMModel(object):
         with RollbackContext() as rollback:
             # copy disks
             cb('copying VM disks')
-            xml = self._clone_update_disks(xml, rollback)
+            xml = self._clone_update_disks(xml, rollback,
+                                           params.get('mode', 'full'))
 
             # update objstore entry
             cb('updating object store')
@@ -463,15 +498,16 @@ class VMModel(object):
 
         return xml
 
-    def _clone_update_disks(self, xml, rollback):
-        """Clone disks from a virtual machine. The disks are copied as new
-        volumes and the new VM's XML is updated accordingly.
+    def _clone_update_disks(self, xml, rollback, mode='full'):
+        """Clone disks from a virtual machine. The disks are cloned in
+        parallel as new volumes and the new VM's XML is updated accordingly.
 
         Arguments:
         xml -- The XML descriptor of the original VM + new value for
             "/domain/uuid".
         rollback -- A rollback context so the new volumes can be removed if an
             error occurs during the cloning operation.
+        mode -- How the volumes are cloned: 'full', 'linked' or 'reflink'.
 
         Return:
         The XML descriptor <xml> with the new disk paths instead of the
@@ -483,6 +519,13 @@ class VMModel(object):
 
         vir_conn = self.conn.get()
         domain_name = xpath_get_text(xml, XPATH_DOMAIN_NAME)[0]
+        clones = []
+        # pool name: space taken by the volumes to be cloned in the pool, as
+        # all the volumes are cloned at the same time
+        reserved = {}
+
+        def _fits(pool_name, pool, capacity):
+            return capacity + reserved.get(pool_name, 0) <= pool['available']
 
         for i, path in enumerate(all_paths):
             try:
@@ -501,11 +544,17 @@ class VMModel(object):
             new_pool_name = orig_pool_name
             new_pool = orig_pool
 
-            if orig_pool['type'] in ['dir', 'netfs', 'logical']:
+            if mode == 'linked':
+                # the new volume is a qcow2 file only holding the blocks
+                # written by the new VM, so no space check is needed
+                if orig_pool['type'] not in ['dir', 'netfs']:
+                    new_pool_name = u'default'
+
+            elif orig_pool['type'] in ['dir', 'netfs', 'logical']:
                 # if a volume in a pool 'dir', 'netfs' or 'logical' cannot hold
                 # a new volume with the same size, the pool 'default' should
                 # be used
-                if orig_vol['capacity'] > orig_pool['available']:
+                if not _fits(orig_pool_name, orig_pool, orig_vol['capacity']):
                     wok_log.warning('storage pool \'%s\' doesn\'t have '
                                     'enough free space to store image '
                                     '\'%s\'; falling back to \'default\'',
@@ -515,8 +564,8 @@ class VMModel(object):
 
                     # ...and if even the pool 'default' cannot hold a new
                     # volume, raise an exception
-                    if orig_vol['capacity'] > new_pool['available']:
-                        domain_name = xpath_get_text(xml, XPATH_DOMAIN_NAME)[0]
+                    if not _fits(new_pool_name, new_pool,
+                                 orig_vol['capacity']):
                         raise InvalidOperation('KCHVM0034E',
                                                {'name': domain_name})
 
@@ -530,8 +579,7 @@ class VMModel(object):
 
                 # if the pool 'default' cannot hold a new volume, raise
                 # an exception
-                if orig_vol['capacity'] > new_pool['available']:
-                    domain_name = xpath_get_text(xml, XPATH_DOMAIN_NAME)[0]
+                if not _fits(new_pool_name, new_pool, orig_vol['capacity']):
                     raise InvalidOperation('KCHVM0034E', {'name': domain_name})
 
             else:
@@ -539,25 +587,44 @@ class VMModel(object):
                 raise InvalidOperation('KCHPOOL0014E',
                                        {'type': orig_pool['type']})
 
+            if mode != 'linked':
+                reserved[new_pool_name] = reserved.get(new_pool_name, 0) + \
+                    orig_vol['capacity']
+
             # new volume name: <UUID>-<loop-index>.<original extension>
             # e.g. 1234-5678-9012-3456-0.img
             ext = os.path.splitext(path)[1]
             new_vol_name = u'%s-%d%s' % (uuid, i, ext)
             task = self.storagevolume.clone(orig_pool_name, orig_vol_name,
-                                            new_name=new_vol_name)
-            self.task.wait(task['id'], 3600)  # 1 h
+                                            new_pool=new_pool_name,
+                                            new_name=new_vol_name, mode=mode)
+            clones.append((path, new_pool_name, new_vol_name, task['id']))
+
+            # remove the new volume should an error occur later
+            rollback.prependDefer(self._clone_remove_volume, task['id'],
+                                  new_pool_name, new_vol_name)
+
+        # all the volumes are being cloned at the same time
+        deadline = time.time() + CLONE_DISKS_TIMEOUT
+        for path, new_pool_name, new_vol_name, task_id in clones:
+            self.task.wait(task_id, max(int(deadline - time.time()), 1))
 
             # get the new volume path and update the XML descriptor
             new_vol = self.storagevolume.lookup(new_pool_name, new_vol_name)
             xml = xml_item_update(xml, XPATH_DOMAIN_DISK_BY_FILE % path,
                                   new_vol['path'], 'file')
 
-            # remove the new volume should an error occur later
-            rollback.prependDefer(self.storagevolume.delete, new_pool_name,
-                                  new_vol_name)
-
         return xml
 
+    def _clone_remove_volume(self, task_id, pool, name):
+        # a volume still being cloned is removed once its task ends
+        try:
+            self.task.wait(task_id, CLONE_DISKS_TIMEOUT)
+            self.storagevolume.delete(pool, name)
+        except Exception, e:
+            wok_log.warning('Unable to remove cloned volume %s from pool '
+                            '%s: %s', name, pool, str(e))
+
     def _clone_update_objstore(self, old_uuid, new_uuid, rollback):
         """Update Kimchi's object store with the cloning VM.
 
@@ -653,10 +720,20 @@ class VMModel(object):
         node = self._build_access_elem(dom, users, groups)
         set_metadata_node(dom, [node])
 
-    def _get_access_info(self, dom):
-        users = groups = list()
-        access_xml = (get_metadata_node(dom, "access") or
+    def _get_access_info(self, domxml, cache=None):
+        access_xml = (domxml.metadata_node("access") or
                       """<access></access>""")
+        # VMs usually share the same access configuration: when listing them,
+        # parse each configuration only once
+        if cache is not None:
+            if access_xml not in cache:
+                cache[access_xml] = self._parse_access_info(access_xml)
+            users, groups = cache[access_xml]
+            return list(users), list(groups)
+        return self._parse_access_info(access_xml)
+
+    def _parse_access_info(self, access_xml):
+        users = groups = list()
         access_info = dictize(access_xml)
         auth = config.get("authentication", "method")
         if ('auth' in access_info['access'] and
@@ -674,10 +751,9 @@ class VMModel(object):
 
     @staticmethod
     def vm_get_os_metadata(dom):
-        os_xml = (get_metadata_node(dom, "os") or
-                  """<os></os>""")
-        os_elem = ET.fromstring(os_xml)
-        return (os_elem.attrib.get("version"), os_elem.attrib.get("distro"))
+        if not isinstance(dom, DomainXML):
+            dom = DomainXML.from_dom(dom, 0)
+        return dom.os_metadata()
 
     def _update_graphics(self, dom, params):
         root = objectify.fromstring(dom.XMLDesc(0))
@@ -1156,157 +1232,161 @@ class VMModel(object):
         except Exception as e:
             raise OperationFailed("KCHVM0047E", {'error': e.message})
 
-    def _has_video(self, dom):
-        dom = ElementTree.fromstring(dom.XMLDesc(0))
-        return dom.find('devices/video') is not None
-
-    def _update_guest_stats(self, name):
-        try:
-            dom = VMModel.get_vm(name, self.conn)
-
-            vm_uuid = dom.UUIDString()
-            info = dom.info()
-            state = DOM_STATE_MAP[info[0]]
-
-            if state != 'running':
-                self.stats[vm_uuid] = {}
-                return
-
-            if self.stats.get(vm_uuid, None) is None:
-                self.stats[vm_uuid] = {}
-
-            timestamp = time.time()
-            prevStats = self.stats.get(vm_uuid, {})
-            seconds = timestamp - prevStats.get('timestamp', 0)
-            self.stats[vm_uuid].update({'timestamp': timestamp})
-
-            self._get_percentage_cpu_usage(vm_uuid, info, seconds)
-            self._get_percentage_mem_usage(vm_uuid, dom, seconds)
-            self._get_network_io_rate(vm_uuid, dom, seconds)
-            self._get_disk_io_rate(vm_uuid, dom, seconds)
-        except Exception as e:
-            # VM might be deleted just after we get the list.
-            # This is OK, just skip.
-            wok_log.debug('Error processing VM stats: %s', e.message)
-
-    def _get_percentage_cpu_usage(self, vm_uuid, info, seconds):
-        prevCpuTime = self.stats[vm_uuid].get('cputime', 0)
-
-        cpus = info[3]
-        cpuTime = info[4] - prevCpuTime
-
-        base = (((cpuTime) * 100.0) / (seconds * 1000.0 * 1000.0 * 1000.0))
-        percentage = max(0.0, min(100.0, base / cpus))
-
-        self.stats[vm_uuid].update({'cputime': info[4], 'cpu': percentage})
-
-    def _get_percentage_mem_usage(self, vm_uuid, dom, seconds):
-        # Get the guest's memory stats
-        memStats = dom.memoryStats()
-        if ('available' in memStats) and ('unused' in memStats):
-            memUsed = memStats.get('available') - memStats.get('unused')
-            percentage = ((memUsed * 100.0) / memStats.get('available'))
-        elif ('rss' in memStats) and ('actual' in memStats):
-            percentage = memStats.get('rss') * 100.0 / memStats.get('actual')
-        else:
-            wok_log.error('Failed to measure memory usage of the guest.')
-
-        percentage = max(0.0, min(100.0, percentage))
-
-        self.stats[vm_uuid].update({'mem_usage': percentage})
-
-    def _get_network_io_rate(self, vm_uuid, dom, seconds):
-        prevNetRxKB = self.stats[vm_uuid].get('netRxKB', 0)
-        prevNetTxKB = self.stats[vm_uuid].get('netTxKB', 0)
-        currentMaxNetRate = self.stats[vm_uuid].get('max_net_io', 100)
-
-        rx_bytes = 0
-        tx_bytes = 0
-
-        tree = ElementTree.fromstring(dom.XMLDesc(0))
-        for target in tree.findall('devices/interface/target'):
-            dev = target.get('dev')
-            io = dom.interfaceStats(dev)
-            rx_bytes += io[0]
-            tx_bytes += io[4]
-
-        netRxKB = float(rx_bytes) / 1000
-        netTxKB = float(tx_bytes) / 1000
-
-        rx_stats = (netRxKB - prevNetRxKB) / seconds
-        tx_stats = (netTxKB - prevNetTxKB) / seconds
-
-        rate = rx_stats + tx_stats
-        max_net_io = round(max(currentMaxNetRate, int(rate)), 1)
-
-        self.stats[vm_uuid].update({'net_io': rate, 'max_net_io': max_net_io,
-                                    'netRxKB': netRxKB, 'netTxKB': netTxKB})
-
-    def _get_disk_io_rate(self, vm_uuid, dom, seconds):
-        prevDiskRdKB = self.stats[vm_uuid].get('diskRdKB', 0)
-        prevDiskWrKB = self.stats[vm_uuid].get('diskWrKB', 0)
-        currentMaxDiskRate = self.stats[vm_uuid].get('max_disk_io', 100)
-
-        rd_bytes = 0
-        wr_bytes = 0
-
-        tree = ElementTree.fromstring(dom.XMLDesc(0))
-        for target in tree.findall("devices/disk/target"):
-            dev = target.get("dev")
-            io = dom.blockStats(dev)
-            rd_bytes += io[1]
-            wr_bytes += io[3]
-
-        diskRdKB = float(rd_bytes) / 1024
-        diskWrKB = float(wr_bytes) / 1024
-
-        rd_stats = (diskRdKB - prevDiskRdKB) / seconds
-        wr_stats = (diskWrKB - prevDiskWrKB) / seconds
-
-        rate = rd_stats + wr_stats
-        max_disk_io = round(max(currentMaxDiskRate, int(rate)), 1)
-
-        self.stats[vm_uuid].update({'disk_io': rate,
-                                    'max_disk_io': max_disk_io,
-                                    'diskRdKB': diskRdKB,
-                                    'diskWrKB': diskWrKB})
-
     def lookup(self, name):
+        # The secure XML, which carries the graphics password, requires a
+        # read-write connection
+        with self.conn.checkout():
+            return self._lookup(name)
+
+    def _lookup(self, name):
         dom = self.get_vm(name, self.conn)
         try:
             # Avoid race condition, where guests may be deleted before below
             # command.
             info = dom.info()
+            # Fetch and parse the domain XML only once per lookup
+            domxml = DomainXML.from_dom(dom, libvirt.VIR_DOMAIN_XML_SECURE)
         except libvirt.libvirtError as e:
             wok_log.error('Operation error while retrieving virtual machine '
                           '"%s" information: %s', name, e.message)
             raise OperationFailed('KCHVM0009E', {'name': name,
                                                  'err': e.message})
         state = DOM_STATE_MAP[info[0]]
+        vm_uuid = domxml.uuid
         screenshot = None
-        # (type, listen, port, passwd, passwdValidTo)
-        graphics = self.get_graphics(name, self.conn)
-        graphics_port = graphics[2]
-        graphics_port = graphics_port if state == 'running' else None
         try:
-            if state == 'running' and self._has_video(dom):
+            if state == 'running' and domxml.has_video():
                 screenshot = self.vmscreenshot.lookup(name)
             elif state == 'shutoff':
                 # reset vm stats when it is powered off to avoid sending
                 # incorrect (old) data
-                self.stats[dom.UUIDString()] = {}
+                self.stats[vm_uuid] = {}
         except NotFoundError:
             pass
 
         with self.objstore as session:
             try:
-                extra_info = session.get('vm', dom.UUIDString(), True)
+                extra_info = session.get('vm', vm_uuid, True)
             except NotFoundError:
                 extra_info = {}
-        icon = extra_info.get('icon')
 
-        self._update_guest_stats(name)
-        vm_stats = self.stats.get(dom.UUIDString(), {})
+        if self.stats_sampler is None:
+            vm_stats = self.stats_collector.update_domain(dom, info, domxml)
+        elif state == 'running':
+            vm_stats = self.stats_sampler.latest(vm_uuid)
+        else:
+            vm_stats = {}
+
+        return self._build_info(name, dom, info, domxml, extra_info,
+                                screenshot, vm_stats)
+
+    def lookup_all(self):
+        """
+        Return the information of all the VMs, as returned by lookup(), in a
+        single pass: the domains are listed once, the statistics are
+        retrieved in bulk, and the icons and screenshots information are read
+        from the object store in a single session.
+        """
+        with self.conn.checkout():
+            return self._lookup_all()
+
+    def _lookup_all(self):
+        entries = []
+        for dom in self.conn.get().listAllDomains(0):
+            try:
+                info = dom.info()
+                domxml = DomainXML.from_dom(dom,
+                                            libvirt.VIR_DOMAIN_XML_SECURE)
+            except libvirt.libvirtError:
+                # VM might be deleted just after we get the list.
+                # This is OK, just skip.
+                continue
+            entries.append((dom, info, domxml))
+
+        if self.stats_sampler is None:
+            all_stats = self.stats_collector.update_all()
+        else:
+            all_stats = self.stats_sampler.collector.stats
+
+        extra_infos = {}
+        screenshot_params = {}
+        with self.objstore as session:
+            for dom, info, domxml in entries:
+                vm_uuid = domxml.uuid
+                try:
+                    extra_infos[vm_uuid] = session.get('vm', vm_uuid, True)
+                except NotFoundError:
+                    extra_infos[vm_uuid] = {}
+
+                if DOM_STATE_MAP[info[0]] != 'running' or \
+                        not domxml.has_video():
+                    continue
+                try:
+                    screenshot_params[vm_uuid] = session.get('screenshot',
+                                                             vm_uuid)
+                except NotFoundError:
+                    screenshot_params[vm_uuid] = {'uuid': vm_uuid}
+
+        screenshots = {}
+        screenshot_infos = {}
+        for vm_uuid, params in screenshot_params.iteritems():
+            screenshot = LibvirtVMScreenshot(params, self.conn)
+            try:
+                screenshots[vm_uuid] = screenshot.lookup()
+            except NotFoundError:
+                pass
+            screenshot_infos[vm_uuid] = screenshot.info
+
+        # screenshot info changed after scratch generation
+        if screenshot_infos:
+            try:
+                with self.objstore as session:
+                    for vm_uuid, info in screenshot_infos.iteritems():
+                        session.store('screenshot', vm_uuid, info,
+                                      get_kimchi_version())
+            except Exception as e:
+                # It is possible to continue Kimchi executions without store
+                # screenshots
+                wok_log.error('Error trying to update database with guest '
+                              'screenshot information due error: %s',
+                              e.message)
+
+        vms = []
+        access_cache = {}
+        for dom, info, domxml in entries:
+            vm_uuid = domxml.uuid
+            name = dom.name().decode('utf-8')
+            nonascii_xml = domxml.metadata_node('name')
+            if nonascii_xml:
+                name = ET.fromstring(nonascii_xml).text
+
+            vm_stats = {}
+            if DOM_STATE_MAP[info[0]] == 'running':
+                vm_stats = all_stats.get(vm_uuid, {})
+
+            try:
+                vms.append(self._build_info(name, dom, info, domxml,
+                                            extra_infos[vm_uuid],
+                                            screenshots.get(vm_uuid),
+                                            vm_stats, access_cache))
+            except (NotFoundError, libvirt.libvirtError):
+                # VM deleted while building the list
+                continue
+
+        return sorted(vms, key=lambda vm: vm['name'].lower())
+
+    def _build_info(self, name, dom, info, domxml, extra_info, screenshot,
+                    vm_stats, access_cache=None):
+        """
+        Build the VM information returned by lookup() from the data already
+        retrieved for the domain
+        """
+        state = DOM_STATE_MAP[info[0]]
+        # (type, listen, port, passwd, passwdValidTo)
+        graphics = self.get_graphics(name, self.conn, domxml)
+        graphics_port = graphics[2]
+        graphics_port = graphics_port if state == 'running' else None
+
         res = {}
         res['cpu_utilization'] = vm_stats.get('cpu', 0)
         res['mem_utilization'] = vm_stats.get('mem_usage', 0)
@@ -1314,43 +1394,30 @@ class VMModel(object):
         res['net_throughput_peak'] = vm_stats.get('max_net_io', 100)
         res['io_throughput'] = vm_stats.get('disk_io', 0)
         res['io_throughput_peak'] = vm_stats.get('max_disk_io', 100)
-        users, groups = self._get_access_info(dom)
-
-        xml = dom.XMLDesc(0)
-        maxvcpus = int(xpath_get_text(xml, XPATH_VCPU)[0])
+        users, groups = self._get_access_info(domxml, access_cache)
 
         cpu_info = {
             'vcpus': info[3],
-            'maxvcpus': maxvcpus,
-            'topology': {},
+            'maxvcpus': domxml.maxvcpus,
+            'topology': domxml.topology(),
         }
 
-        if self.has_topology(dom):
-            sockets = int(xpath_get_text(xml, XPATH_TOPOLOGY + '/@sockets')[0])
-            cores = int(xpath_get_text(xml, XPATH_TOPOLOGY + '/@cores')[0])
-            threads = int(xpath_get_text(xml, XPATH_TOPOLOGY + '/@threads')[0])
-
-            cpu_info['topology'] = {
-                'sockets': sockets,
-                'cores': cores,
-                'threads': threads,
-            }
-
         # Kimchi does not make use of 'currentMemory' tag, it only updates
         # NUMA memory config or 'memory' tag directly. In memory hotplug,
         # Libvirt always updates 'memory', so we can use this tag retrieving
-        # from Libvirt API maxMemory() function, regardeless of the VM state
+        # from Libvirt API maxMemory() function (also returned by info()),
+        # regardeless of the VM state
         # Case VM changed currentMemory outside Kimchi, sum mem devs
-        memory = dom.maxMemory() >> 10
+        memory = info[1] >> 10
         curr_mem = (info[2] >> 10)
 
         # On CentOS, dom.info does not retrieve memory. So, if machine does
         # not have memory hotplug, parse memory from xml
         if curr_mem == 0:
-            curr_mem = int(xpath_get_text(xml, XPATH_MEMORY)[0]) >> 10
+            curr_mem = domxml.memory >> 10
 
         if memory != curr_mem:
-            memory = curr_mem + (self._get_mem_dev_total_size(xml) >> 10)
+            memory = curr_mem + (domxml.mem_devs_size() >> 10)
 
         # assure there is no zombie process left
         for proc in self._serial_procs[:]:
@@ -1359,28 +1426,22 @@ class VMModel(object):
                 self._serial_procs.remove(proc)
 
         # Get max memory, or return "memory" if not set
-        maxmemory = xpath_get_text(xml, XPATH_MAX_MEMORY)
-        if len(maxmemory) > 0:
-            maxmemory = convert_data_size(maxmemory[0], 'KiB', 'MiB')
+        maxmemory = domxml.max_memory
+        if maxmemory is not None:
+            maxmemory = convert_data_size(maxmemory, 'KiB', 'MiB')
         else:
             maxmemory = memory
 
-        # get boot order and bootmenu
-        boot = xpath_get_text(xml, XPATH_BOOT)
-        bootmenu = "yes" if "yes" in xpath_get_text(xml, XPATH_BOOTMENU) \
-            else "no"
-
         vm_info = {'name': name,
-                   'title': "".join(xpath_get_text(xml, XPATH_TITLE)),
-                   'description':
-                       "".join(xpath_get_text(xml, XPATH_DESCRIPTION)),
+                   'title': domxml.title,
+                   'description': domxml.description,
                    'state': state,
                    'stats': res,
-                   'uuid': dom.UUIDString(),
+                   'uuid': domxml.uuid,
                    'memory': {'current': memory, 'maxmemory': maxmemory},
                    'cpu_info': cpu_info,
                    'screenshot': screenshot,
-                   'icon': icon,
+                   'icon': extra_info.get('icon'),
                    # (type, listen, port, passwd, passwdValidTo)
                    'graphics': {"type": graphics[0],
                                 "listen": graphics[1],
@@ -1391,12 +1452,12 @@ class VMModel(object):
                    'groups': groups,
                    'access': 'full',
                    'persistent': True if dom.isPersistent() else False,
-                   'bootorder': boot,
-                   'bootmenu': bootmenu
+                   'bootorder': domxml.boot(),
+                   'bootmenu': domxml.bootmenu()
                    }
         if platform.machine() in ['s390', 's390x']:
-            vm_console = xpath_get_text(xml, XPATH_DOMAIN_CONSOLE_TARGET)
-            vm_info['console'] = vm_console[0] if vm_console else ''
+            vm_console = domxml.console_target()
+            vm_info['console'] = vm_console if vm_console else ''
 
         return vm_info
 
@@ -1405,6 +1466,16 @@ class VMModel(object):
         xpath = "/domain/devices/disk[@device='disk']/source/@file"
         return xpath_get_text(xml, xpath)
 
+    def _check_linked_clones(self, name, paths, code):
+        # the linked clones read the blocks they have not written from their
+        # backing disks, so those disks must be left unchanged
+        clones = []
+        for path in paths:
+            clones.extend(get_linked_clones(self.objstore, path))
+        if clones:
+            raise InvalidOperation(code, {'name': name,
+                                          'clones': ', '.join(clones)})
+
     @staticmethod
     def get_vm(name, conn):
         def raise_exception(error_code):
@@ -1413,6 +1484,12 @@ class VMModel(object):
             else:
                 raise OperationFailed("KCHVM0009E", {'name': name,
                                                      'err': e.message})
+        index = DomainIndex.get_index(conn)
+        if index is not None:
+            dom = index.lookup(name)
+            if dom is not None:
+                return dom
+
         conn = conn.get()
         FeatureTests.disable_libvirt_error_logging()
         try:
@@ -1436,8 +1513,9 @@ class VMModel(object):
         if not dom.isPersistent():
             raise InvalidOperation("KCHVM0036E", {'name': name})
 
-        self._vmscreenshot_delete(dom.UUIDString())
         paths = self._vm_get_disk_paths(dom)
+        self._check_linked_clones(name, paths, "KCHVM0094E")
+        self._vmscreenshot_delete(dom.UUIDString())
         info = self.lookup(name)
 
         if info['state'] != 'shutoff':
@@ -1471,6 +1549,7 @@ class VMModel(object):
                 pool_type = xpath_get_text(xml, "/pool/@type")[0]
                 if pool_type not in READONLY_POOL_TYPE:
                     vol.delete(0)
+                    remove_linked_clone(self.objstore, path)
             except libvirt.libvirtError as e:
                 wok_log.error('Unable to get storage volume by path: %s' %
                               e.message)
@@ -1511,6 +1590,9 @@ class VMModel(object):
         if DOM_STATE_MAP[dom.info()[0]] == "running":
             raise InvalidOperation("KCHVM0048E", {'name': name})
 
+        self._check_linked_clones(name, self._vm_get_disk_paths(dom),
+                                  "KCHVM0095E")
+
         try:
             dom.create()
         except libvirt.libvirtError as e:
@@ -1572,36 +1654,20 @@ class VMModel(object):
         return True
 
     @staticmethod
-    def get_graphics(name, conn):
-        dom = VMModel.get_vm(name, conn)
-        xml = dom.XMLDesc(libvirt.VIR_DOMAIN_XML_SECURE)
-
-        expr = "/domain/devices/graphics/@type"
-        res = xpath_get_text(xml, expr)
-        graphics_type = res[0] if res else None
-
-        expr = "/domain/devices/graphics/@listen"
-        res = xpath_get_text(xml, expr)
-        graphics_listen = res[0] if res else None
-
-        graphics_port = graphics_passwd = graphics_passwdValidTo = None
-        if graphics_type:
-            expr = "/domain/devices/graphics[@type='%s']/@port"
-            res = xpath_get_text(xml, expr % graphics_type)
-            graphics_port = int(res[0]) if res else None
-
-            expr = "/domain/devices/graphics[@type='%s']/@passwd"
-            res = xpath_get_text(xml, expr % graphics_type)
-            graphics_passwd = res[0] if res else None
-
-            expr = "/domain/devices/graphics[@type='%s']/@passwdValidTo"
-            res = xpath_get_text(xml, expr % graphics_type)
-            if res:
-                to = time.mktime(time.strptime(res[0], '%Y-%m-%dT%H:%M:%S'))
-                graphics_passwdValidTo = to - time.mktime(time.gmtime())
-
-        return (graphics_type, graphics_listen, graphics_port,
-                graphics_passwd, graphics_passwdValidTo)
+    def get_graphics(name, conn, domxml=None):
+        """
+        Return the graphics information of a VM. The password is only in the
+        secure XML: 'domxml', if given, must have been fetched with
+        VIR_DOMAIN_XML_SECURE.
+        """
+        if domxml is None:
+            # The secure XML needs a read-write connection, even when called
+            # with a read-only connection checked out
+            with conn.checkout():
+                dom = VMModel.get_vm(name, conn)
+                domxml = DomainXML.from_dom(dom,
+                                            libvirt.VIR_DOMAIN_XML_SECURE)
+        return domxml.graphics()
 
     def serial(self, name):
         if not self._vm_check_serial(name):
@@ -2009,14 +2075,16 @@ class VMModel(object):
         if enable_rdma is None:
             enable_rdma = False
 
-        self.migration_pre_check(remote_host, user, password)
-        dest_conn = self._get_remote_libvirt_conn(remote_host, user)
+        # The pre-checks may take long: do not hold up the shared connection
+        with self.conn.checkout():
+            self.migration_pre_check(remote_host, user, password)
+            dest_conn = self._get_remote_libvirt_conn(remote_host, user)
 
-        non_shared = self._check_if_nonshared_migration(
-            name,
-            remote_host,
-            user
-        )
+            non_shared = self._check_if_nonshared_migration(
+                name,
+                remote_host,
+                user
+            )
 
         params = {'name': name,
                   'dest_conn': dest_conn,
@@ -2030,6 +2098,10 @@ class VMModel(object):
         return self.task.lookup(task_id)
 
     def _migrate_task(self, cb, params):
+        with self.conn.checkout():
+            self._do_migrate(cb, params)
+
+    def _do_migrate(self, cb, params):
         name = params['name'].decode('utf-8')
         dest_conn = params['dest_conn']
         non_shared = params['non_shared']
@@ -2078,6 +2150,35 @@ class VMModel(object):
         cb('Migrate finished', True)
 
 
+class VMStatsHistoryModel(object):
+    def __init__(self, **kargs):
+        self.conn = kargs['conn']
+        self.stats_sampler = kargs.get('statssampler')
+
+    def lookup(self, name, window=None):
+        if window is not None:
+            try:
+                window = int(window)
+                if window <= 0:
+                    raise ValueError
+            except ValueError:
+                raise InvalidParameter('KCHVM0092E', {'window': window})
+
+        dom = VMModel.get_vm(name, self.conn)
+        if self.stats_sampler is None:
+            return {'interval': 0, 'samples': []}
+
+        samples = []
+        for sample in self.stats_sampler.history(dom.UUIDString(), window):
+            samples.append({'timestamp': sample['timestamp'],
+                            'cpu_utilization': sample['cpu'],
+                            'mem_utilization': sample['mem_usage'],
+                            'net_throughput': sample['net_io'],
+                            'io_throughput': sample['disk_io']})
+
+        return {'interval': self.stats_sampler.interval, 'samples': samples}
+
+
 class VMScreenshotModel(object):
     def __init__(self, **kargs):
         self.objstore = kargs['objstore']
@@ -2136,12 +2237,13 @@ class LibvirtVMScreenshot(VMScreenshot):
 
         fd = os.open(thumbnail, os.O_WRONLY | os.O_TRUNC | os.O_CREAT, 0644)
         try:
-            conn = self.conn.get()
-            dom = conn.lookupByUUIDString(self.vm_uuid)
-            vm_name = dom.name()
-            stream = conn.newStream(0)
-            dom.screenshot(stream, 0, 0)
-            stream.recvAll(handler, fd)
+            # Screenshots need a read-write connection
+            with self.conn.checkout() as conn:
+                dom = conn.lookupByUUIDString(self.vm_uuid)
+                vm_name = dom.name()
+                stream = conn.newStream(0)
+                dom.screenshot(stream, 0, 0)
+                stream.recvAll(handler, fd)
         except libvirt.libvirtError:
             try:
                 stream.abort()
@@ -0,0 +1,369 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import cherrypy
+import libvirt
+import threading
+import time
+from array import array
+
+from wok.utils import wok_log
+
+from wok.plugins.kimchi.xmlutils.domain import DomainXML
+
+
+# Fields stored in the statistics history of each guest
+HISTORY_FIELDS = ['timestamp', 'cpu', 'mem_usage', 'net_io', 'disk_io']
+
+# Statistics groups requested to virConnectGetAllDomainStats()
+BULK_STATS_GROUPS = ['VIR_DOMAIN_STATS_STATE', 'VIR_DOMAIN_STATS_CPU_TOTAL',
+                     'VIR_DOMAIN_STATS_BALLOON', 'VIR_DOMAIN_STATS_VCPU',
+                     'VIR_DOMAIN_STATS_INTERFACE', 'VIR_DOMAIN_STATS_BLOCK']
+
+
+def _bulk_stats_mask():
+    mask = 0
+    for group in BULK_STATS_GROUPS:
+        mask |= getattr(libvirt, group, 0)
+    return mask
+
+
+def _mem_percentage(mem_stats):
+    """
+    Compute the guest memory usage from the balloon statistics, which use
+    the same keys in virDomainMemoryStats() and in the 'balloon.' group of
+    virConnectGetAllDomainStats()
+    """
+    if ('available' in mem_stats) and ('unused' in mem_stats):
+        mem_used = mem_stats['available'] - mem_stats['unused']
+        percentage = (mem_used * 100.0) / mem_stats['available']
+    elif ('rss' in mem_stats) and ('actual' in mem_stats):
+        percentage = mem_stats['rss'] * 100.0 / mem_stats['actual']
+    else:
+        # Logged at debug level as the guests are sampled every few seconds
+        wok_log.debug('Failed to measure memory usage of the guest.')
+        return None
+
+    return max(0.0, min(100.0, percentage))
+
+
+def parse_bulk_record(record):
+    """
+    Translate a virConnectGetAllDomainStats() record into the counters used
+    to compute the guest statistics.
+    """
+    counters = {'state': record.get('state.state'),
+                'cputime': record.get('cpu.time', 0),
+                'vcpus': record.get('vcpu.current', 1)}
+
+    mem_stats = {}
+    for key in ['available', 'unused', 'rss']:
+        if 'balloon.%s' % key in record:
+            mem_stats[key] = record['balloon.%s' % key]
+    if 'balloon.current' in record:
+        mem_stats['actual'] = record['balloon.current']
+    counters['mem_usage'] = _mem_percentage(mem_stats) if mem_stats else None
+
+    rx_bytes = tx_bytes = 0
+    for i in range(record.get('net.count', 0)):
+        rx_bytes += record.get('net.%d.rx.bytes' % i, 0)
+        tx_bytes += record.get('net.%d.tx.bytes' % i, 0)
+
+    rd_bytes = wr_bytes = 0
+    for i in range(record.get('block.count', 0)):
+        rd_bytes += record.get('block.%d.rd.bytes' % i, 0)
+        wr_bytes += record.get('block.%d.wr.bytes' % i, 0)
+
+    counters.update({'rx_bytes': rx_bytes, 'tx_bytes': tx_bytes,
+                     'rd_bytes': rd_bytes, 'wr_bytes': wr_bytes})
+    return counters
+
+
+class GuestStatsCollector(object):
+    """
+    Collect CPU, memory, network and disk statistics for the guests.
+
+    The counters are retrieved with virConnectGetAllDomainStats() (or
+    virDomainListGetStats() for a subset of guests), which returns all of
+    them in a single call. When the running libvirt does not support the bulk
+    API, the counters are read domain by domain with info(), memoryStats(),
+    interfaceStats() and blockStats().
+
+    The rates are computed against the previous sample of each guest, stored
+    in self.stats and keyed by the domain UUID.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._bulk_supported = True
+
+    def _bulk_call(self, func, *args):
+        if not self._bulk_supported or func is None:
+            return None
+
+        try:
+            return func(*args)
+        except libvirt.libvirtError as e:
+            if e.get_error_code() == libvirt.VIR_ERR_NO_SUPPORT:
+                wok_log.info('Bulk domain statistics not supported by '
+                             'libvirt. Falling back to per-domain calls.')
+                self._bulk_supported = False
+                return None
+            raise
+
+    def _get_domain_counters(self, dom, info, domxml):
+        """
+        Read the counters of a single running domain with the per-domain
+        libvirt API
+        """
+        counters = {'state': info[0], 'cputime': info[4], 'vcpus': info[3]}
+        counters['mem_usage'] = _mem_percentage(dom.memoryStats())
+
+        rx_bytes = tx_bytes = 0
+        for dev in domxml.interface_targets():
+            io = dom.interfaceStats(dev)
+            rx_bytes += io[0]
+            tx_bytes += io[4]
+
+        rd_bytes = wr_bytes = 0
+        for dev in domxml.disk_targets():
+            io = dom.blockStats(dev)
+            rd_bytes += io[1]
+            wr_bytes += io[3]
+
+        counters.update({'rx_bytes': rx_bytes, 'tx_bytes': tx_bytes,
+                         'rd_bytes': rd_bytes, 'wr_bytes': wr_bytes})
+        return counters
+
+    def _update(self, vm_uuid, counters, timestamp):
+        """
+        Compute the guest rates from the counters and the previous sample
+        """
+        if counters['state'] != libvirt.VIR_DOMAIN_RUNNING:
+            self.stats[vm_uuid] = {}
+            return
+
+        stats = self.stats.setdefault(vm_uuid, {})
+        seconds = timestamp - stats.get('timestamp', 0)
+        stats['timestamp'] = timestamp
+
+        # CPU
+        cpu_time = counters['cputime'] - stats.get('cputime', 0)
+        base = (cpu_time * 100.0) / (seconds * 1000.0 * 1000.0 * 1000.0)
+        stats.update({'cputime': counters['cputime'],
+                      'cpu': max(0.0, min(100.0, base / counters['vcpus']))})
+
+        # Memory
+        if counters['mem_usage'] is not None:
+            stats['mem_usage'] = counters['mem_usage']
+
+        # Network
+        netRxKB = float(counters['rx_bytes']) / 1000
+        netTxKB = float(counters['tx_bytes']) / 1000
+        rate = ((netRxKB - stats.get('netRxKB', 0)) / seconds +
+                (netTxKB - stats.get('netTxKB', 0)) / seconds)
+        max_net_io = round(max(stats.get('max_net_io', 100), int(rate)), 1)
+        stats.update({'net_io': rate, 'max_net_io': max_net_io,
+                      'netRxKB': netRxKB, 'netTxKB': netTxKB})
+
+        # Disk
+        diskRdKB = float(counters['rd_bytes']) / 1024
+        diskWrKB = float(counters['wr_bytes']) / 1024
+        rate = ((diskRdKB - stats.get('diskRdKB', 0)) / seconds +
+                (diskWrKB - stats.get('diskWrKB', 0)) / seconds)
+        max_disk_io = round(max(stats.get('max_disk_io', 100), int(rate)), 1)
+        stats.update({'disk_io': rate, 'max_disk_io': max_disk_io,
+                      'diskRdKB': diskRdKB, 'diskWrKB': diskWrKB})
+
+    def update_domain(self, dom, info=None, domxml=None):
+        """
+        Update and return the statistics of a single guest
+        """
+        vm_uuid = None
+        try:
+            if domxml is None:
+                domxml = DomainXML.from_dom(dom, 0)
+            vm_uuid = domxml.uuid
+
+            records = self._bulk_call(getattr(self.conn.get(),
+                                              'domainListGetStats', None),
+                                      [dom], _bulk_stats_mask())
+            if records:
+                counters = parse_bulk_record(records[0][1])
+            else:
+                if info is None:
+                    info = dom.info()
+                if info[0] != libvirt.VIR_DOMAIN_RUNNING:
+                    counters = {'state': info[0]}
+                else:
+                    counters = self._get_domain_counters(dom, info, domxml)
+
+            with self._lock:
+                self._update(vm_uuid, counters, time.time())
+        except Exception as e:
+            # VM might be deleted just after we get the list.
+            # This is OK, just skip.
+            wok_log.debug('Error processing VM stats: %s', e.message)
+
+        return self.stats.get(vm_uuid, {})
+
+    def update_all(self):
+        """
+        Update the statistics of all the guests with a single libvirt call,
+        or domain by domain when the bulk API is not available.
+
+        Return a dict mapping each domain UUID to its statistics.
+        """
+        conn = self.conn.get()
+        records = self._bulk_call(getattr(conn, 'getAllDomainStats', None),
+                                  _bulk_stats_mask())
+        if records is None:
+            for dom in conn.listAllDomains(0):
+                self.update_domain(dom)
+            return dict(self.stats)
+
+        timestamp = time.time()
+        seen = set()
+        with self._lock:
+            for dom, record in records:
+                try:
+                    vm_uuid = dom.UUIDString()
+                    seen.add(vm_uuid)
+                    self._update(vm_uuid, parse_bulk_record(record),
+                                 timestamp)
+                except Exception as e:
+                    wok_log.debug('Error processing VM stats: %s', e.message)
+
+            # forget the guests which do not exist anymore
+            for vm_uuid in set(self.stats.keys()) - seen:
+                del self.stats[vm_uuid]
+
+        return dict(self.stats)
+
+
+class StatsHistory(object):
+    """
+    Fixed-size ring buffer with the latest samples of a guest.
+
+    Each field is stored in a preallocated array of doubles, so the memory
+    used by a guest history never grows after its creation.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._arrays = dict((field, array('d', [0.0]) * size)
+                            for field in HISTORY_FIELDS)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, stats):
+        for field in HISTORY_FIELDS:
+            self._arrays[field][self._next] = stats.get(field, 0.0)
+        self._next = (self._next + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+
+    def get(self, window=None):
+        """
+        Return the samples of the last 'window' seconds (or all of them),
+        from the oldest to the newest one
+        """
+        timestamps = self._arrays['timestamp']
+        newest = (self._next - 1) % self.size
+        since = timestamps[newest] - window if window is not None else None
+
+        samples = []
+        for i in range(self._count):
+            pos = (newest - i) % self.size
+            if since is not None and timestamps[pos] < since:
+                break
+            samples.append(dict((field, self._arrays[field][pos])
+                                for field in HISTORY_FIELDS))
+        samples.reverse()
+        return samples
+
+
+class GuestStatsSampler(object):
+    """
+    Sample the statistics of all the guests at a fixed interval.
+
+    The rates are computed by a GuestStatsCollector in a background task,
+    so the values do not depend on how often the guests are looked up. The
+    latest samples of each running guest are kept in a StatsHistory, which is
+    dropped as soon as the guest stops running.
+    """
+    def __init__(self, conn, interval, history_size):
+        self.interval = interval
+        self.history_size = history_size
+        self.collector = GuestStatsCollector(conn)
+        self._history = {}
+        self._lock = threading.Lock()
+
+        # Using cherrypy BackgroundTask class due to issues when using
+        # threading module with cherrypy.
+        self.sampler_thread = cherrypy.process.plugins.BackgroundTask(
+            interval,
+            self._sample
+        )
+        self.sampler_thread.setName('KimchiGuestStatsSampler')
+        self.sampler_thread.setDaemon(True)
+
+    def start(self):
+        self.sampler_thread.start()
+
+    def stop(self):
+        self.sampler_thread.cancel()
+
+    def _sample(self):
+        try:
+            with self.collector.conn.checkout(readonly=True):
+                stats = self.collector.update_all()
+        except Exception as e:
+            wok_log.debug('Error sampling guests statistics: %s', e.message)
+            return
+
+        with self._lock:
+            for vm_uuid in self._history.keys():
+                if not stats.get(vm_uuid):
+                    del self._history[vm_uuid]
+
+            for vm_uuid, vm_stats in stats.iteritems():
+                if not vm_stats:
+                    continue
+                history = self._history.get(vm_uuid)
+                if history is None:
+                    history = StatsHistory(self.history_size)
+                    self._history[vm_uuid] = history
+                history.append(vm_stats)
+
+    def latest(self, vm_uuid):
+        """
+        Return the latest statistics of a guest, or an empty dict when the
+        guest is not running
+        """
+        return self.collector.stats.get(vm_uuid, {})
+
+    def history(self, vm_uuid, window=None):
+        with self._lock:
+            history = self._history.get(vm_uuid)
+            if history is None:
+                return []
+            return history.get(window)
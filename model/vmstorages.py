@@ -34,6 +34,7 @@ from wok.plugins.kimchi.osinfo import lookup
 from wok.plugins.kimchi.utils import create_disk_image, is_s390x
 from wok.plugins.kimchi.xmlutils.disk import get_device_node, get_disk_xml
 from wok.plugins.kimchi.xmlutils.disk import get_vm_disk_info, get_vm_disks
+from wok.plugins.kimchi.xmlutils.domain import DomainXML
 
 
 HOTPLUG_TYPE = ['scsi', 'virtio']
@@ -59,11 +60,11 @@ class VMStoragesModel(object):
         # libvirt limitation of just 1 ide controller
         # each controller have at most 2 buses and each bus 2 units.
         dom = VMModel.get_vm(vm_name, self.conn)
-        disks = self.get_list(vm_name)
+        domxml = DomainXML.from_dom(dom, 0)
         valid_id = [('0', '0'), ('0', '1'), ('1', '0'), ('1', '1')]
         controller_id = '0'
-        for dev_name in disks:
-            disk = get_device_node(dom, dev_name)
+        for dev_name in get_vm_disks(domxml).keys():
+            disk = get_device_node(domxml, dev_name)
             if disk.target.attrib['bus'] == 'ide':
                 controller_id = disk.address.attrib['controller']
                 bus_id = disk.address.attrib['bus']
@@ -92,7 +93,8 @@ class VMStoragesModel(object):
                 raise InvalidParameter("KCHVMSTOR0019E")
 
         dom = VMModel.get_vm(vm_name, self.conn)
-        params['bus'] = _get_device_bus(params['type'], dom)
+        domxml = DomainXML.from_dom(dom, 0)
+        params['bus'] = _get_device_bus(params['type'], domxml)
 
         if is_s390x() and params['type'] == 'disk' and 'dir_path' in params:
             if 'format' not in params:
@@ -109,7 +111,7 @@ class VMStoragesModel(object):
         else:
             params['format'] = 'raw'
 
-        dev_list = [dev for dev, bus in get_vm_disks(dom).iteritems()
+        dev_list = [dev for dev, bus in get_vm_disks(domxml).iteritems()
                     if bus == params['bus']]
         dev_list.sort()
         if len(dev_list) == 0:
@@ -202,8 +204,9 @@ class VMStorageModel(object):
             raise InvalidOperation('KCHVMSTOR0011E')
 
         try:
-            disk = get_device_node(dom, dev_name)
-            path = get_vm_disk_info(dom, dev_name)['path']
+            domxml = DomainXML.from_dom(dom, 0)
+            disk = get_device_node(domxml, dev_name)
+            path = get_vm_disk_info(domxml, dev_name)['path']
             if path is None or len(path) < 1:
                 path = self.lookup(vm_name, dev_name)['path']
             # This has to be done before it's detached. If it wasn't
@@ -0,0 +1,101 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import errno
+import fcntl
+import os
+
+from wok.plugins.kimchi.config import get_kimchi_version
+
+
+# full: copy all the data of the original volume
+# linked: qcow2 overlay using the original volume as its backing store
+# reflink: share the extents of the original file, copy when not supported
+CLONE_MODES = ['full', 'linked', 'reflink']
+
+# _IOW(0x94, 9, int), from linux/fs.h
+FICLONE = 0x40049409
+
+# The file system can not share extents between these files
+_REFLINK_UNSUPPORTED = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                        errno.EINVAL, errno.ENOSYS, errno.EPERM)
+
+
+def reflink(src, dst):
+    """
+    Create the file 'dst' sharing the extents of the file 'src' (btrfs, XFS
+    with reflink=1, ...). No data is copied, so it takes the same time
+    whatever the size of the file. Return False, without leaving 'dst'
+    behind, when the file system does not support it.
+    """
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                         os.fstat(src_fd).st_mode & 0777)
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        except IOError as e:
+            os.close(dst_fd)
+            os.remove(dst)
+            if e.errno in _REFLINK_UNSUPPORTED:
+                return False
+            raise OSError(e.errno, e.strerror)
+
+        os.close(dst_fd)
+        return True
+    finally:
+        os.close(src_fd)
+
+
+def add_linked_clone(objstore, path, backing):
+    """
+    Record that the volume 'path' is a linked clone using the volume
+    'backing' as its backing store. Any write to the backing volume corrupts
+    the clone, so the backing volume must be left unchanged while the clone
+    exists.
+    """
+    with objstore as session:
+        session.store('linkedclone', path, {'backing': backing},
+                      get_kimchi_version())
+
+
+def remove_linked_clone(objstore, path):
+    with objstore as session:
+        session.delete('linkedclone', path, ignore_missing=True)
+
+
+def get_linked_clones(objstore, backing):
+    """
+    Return the paths of the linked clones using the volume 'backing' as their
+    backing store. The records of the clones removed outside Kimchi are
+    dropped.
+    """
+    clones = []
+    with objstore as session:
+        for path in session.get_list('linkedclone'):
+            info = session.get('linkedclone', path, ignore_missing=True)
+            if info is None or info['backing'] != backing:
+                continue
+
+            if os.path.exists(path):
+                clones.append(path)
+            else:
+                session.delete('linkedclone', path, ignore_missing=True)
+
+    return sorted(clones)
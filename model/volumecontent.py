@@ -0,0 +1,188 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import magic
+import os
+import stat
+import threading
+
+from wok.exception import IsoFormatError, NotFoundError
+from wok.utils import wok_log
+
+from wok.plugins.kimchi.config import get_kimchi_version
+from wok.plugins.kimchi.isoinfo import IsoImage
+
+
+_magic = None
+_magic_lock = threading.Lock()
+
+
+def get_file_type(path):
+    """
+    Describe the content of a file with libmagic. The magic database is
+    loaded only once and the handle is shared by all the threads.
+    """
+    global _magic
+    with _magic_lock:
+        if _magic is None:
+            ms = magic.open(magic.NONE)
+            ms.load()
+            _magic = ms
+        return _magic.file(path)
+
+
+def _probe_iso(path):
+    try:
+        iso_img = IsoImage(path)
+    except IsoFormatError:
+        return {'is_iso': False, 'os_distro': 'unknown',
+                'os_version': 'unknown', 'bootable': False}
+
+    try:
+        os_distro, os_version = iso_img.probe()
+        bootable = True
+    except IsoFormatError:
+        os_distro = os_version = 'unknown'
+        bootable = False
+    return {'is_iso': True, 'os_distro': os_distro, 'os_version': os_version,
+            'bootable': bootable}
+
+
+class VolumeContentCache(object):
+    """
+    Cache of the classification of the volumes content (libmagic file type
+    and ISO information), so listing unchanged volumes does not read them.
+
+    The entries are kept in memory and in the object store, keyed by the
+    volume path and checked against the (device, inode, size, mtime) of the
+    file. Block devices do not update their size and mtime when written, so
+    the volume capacity is used as size and Kimchi invalidates the entry of
+    the volumes it writes to.
+    """
+    def __init__(self):
+        self.objstore = None
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _file_key(path, capacity):
+        st = os.stat(path)
+        if stat.S_ISBLK(st.st_mode):
+            return [st.st_rdev, st.st_ino, capacity, 0]
+        return [st.st_dev, st.st_ino, st.st_size, st.st_mtime]
+
+    def _get_entry(self, path, key):
+        with self._lock:
+            entry = self._cache.get(path)
+        if entry is None and self.objstore is not None:
+            try:
+                with self.objstore as session:
+                    entry = session.get('volumecontent', path)
+            except NotFoundError:
+                pass
+            except Exception as e:
+                wok_log.debug('Unable to read the content classification '
+                              'of %s: %s', path, e.message)
+            else:
+                # Read the object store only once per path
+                with self._lock:
+                    entry = self._cache.setdefault(path, entry)
+
+        if entry is None or entry['key'] != key:
+            return {'key': key}
+        return entry
+
+    def _store_entry(self, path, entry):
+        with self._lock:
+            self._cache[path] = entry
+        if self.objstore is None:
+            return
+
+        try:
+            with self.objstore as session:
+                session.store('volumecontent', path, entry,
+                              get_kimchi_version())
+        except Exception as e:
+            # It is possible to continue without storing the classification
+            wok_log.debug('Unable to store the content classification of '
+                          '%s: %s', path, e.message)
+
+    def _classify(self, path, capacity, field, func):
+        try:
+            key = self._file_key(path, capacity)
+        except OSError:
+            return func(path)
+
+        entry = self._get_entry(path, key)
+        if field not in entry:
+            entry = dict(entry)
+            entry[field] = func(path)
+            self._store_entry(path, entry)
+        return entry[field]
+
+    def get_file_type(self, path, capacity=None):
+        """
+        Return the libmagic description of a volume content
+        """
+        return self._classify(path, capacity, 'file_type', get_file_type)
+
+    def get_iso_info(self, path, capacity=None):
+        """
+        Return whether a volume is an ISO image, and its OS distro and
+        version and whether it is bootable
+        """
+        return dict(self._classify(path, capacity, 'iso', _probe_iso))
+
+    def invalidate(self, path):
+        with self._lock:
+            self._cache.pop(path, None)
+        if self.objstore is None:
+            return
+
+        try:
+            with self.objstore as session:
+                session.delete('volumecontent', path)
+        except NotFoundError:
+            pass
+        except Exception as e:
+            wok_log.debug('Unable to delete the content classification of '
+                          '%s: %s', path, e.message)
+
+    def purge(self):
+        """
+        Drop the entries of the volumes which do not exist anymore
+        """
+        with self._lock:
+            for path in self._cache.keys():
+                if not os.path.exists(path):
+                    del self._cache[path]
+        if self.objstore is None:
+            return
+
+        try:
+            with self.objstore as session:
+                for path in session.get_list('volumecontent'):
+                    if not os.path.exists(path):
+                        session.delete('volumecontent', path)
+        except Exception as e:
+            wok_log.debug('Unable to purge the content classification of '
+                          'the deleted volumes: %s', e.message)
+
+
+volume_content_cache = VolumeContentCache()
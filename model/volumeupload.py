@@ -0,0 +1,315 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import ctypes
+import ctypes.util
+import errno
+import libvirt
+import mmap
+import os
+import threading
+import time
+
+from wok.exception import OperationFailed
+
+from wok.plugins.kimchi.model.sparse import data_runs, get_upload_flags
+from wok.plugins.kimchi.model.sparse import send_sparse
+
+
+DIRECT_IO_ALIGNMENT = 4096
+# Bytes received ahead of the stream position, waiting for the missing chunks
+MAX_PENDING_SIZE = 67108864  # 64 MiB
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+_libc.pwrite64.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t,
+                           ctypes.c_int64]
+_libc.pwrite64.restype = ctypes.c_ssize_t
+
+
+def pwrite(fd, data, offset):
+    """
+    Write all of 'data', a string or a mmap, at 'offset' of 'fd'. The file
+    position is not used, so several threads can write through the same
+    file descriptor at once.
+    """
+    if isinstance(data, mmap.mmap):
+        buf = (ctypes.c_char * len(data)).from_buffer(data)
+    else:
+        buf = ctypes.c_char_p(data)
+    addr = ctypes.cast(buf, ctypes.c_void_p).value
+
+    written = 0
+    while written < len(data):
+        ret = _libc.pwrite64(fd, addr + written, len(data) - written,
+                             offset + written)
+        if ret < 0:
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            raise OSError(err, os.strerror(err))
+        written += ret
+
+
+class _FileWriter(object):
+    """
+    Write the chunks of a new file volume at their offsets. The zero blocks
+    are not written, so they remain holes in the file. Pieces aligned to
+    DIRECT_IO_ALIGNMENT bypass the page cache when the file system supports
+    O_DIRECT. Several chunks can be written at once.
+    """
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_WRONLY)
+        self.direct_fd = None
+        if hasattr(os, 'O_DIRECT'):
+            try:
+                self.direct_fd = os.open(path, os.O_WRONLY | os.O_DIRECT)
+            except OSError as e:
+                if e.errno != errno.EINVAL:
+                    raise
+
+    def write(self, offset, data):
+        for start, end, zero in data_runs(data):
+            if not zero:
+                self._write(offset + start, data[start:end])
+
+    def _write(self, offset, data):
+        fd = self.fd
+        buf = None
+        if self.direct_fd is not None and data and \
+                offset % DIRECT_IO_ALIGNMENT == 0 and \
+                len(data) % DIRECT_IO_ALIGNMENT == 0:
+            # O_DIRECT needs an aligned buffer: anonymous maps are page
+            # aligned
+            buf = mmap.mmap(-1, len(data))
+            buf.write(data)
+            data = buf
+            fd = self.direct_fd
+
+        try:
+            pwrite(fd, data, offset)
+        finally:
+            if buf is not None:
+                buf.close()
+
+    def finish(self):
+        try:
+            os.fsync(self.fd)
+        finally:
+            self.abort()
+
+    def abort(self):
+        for fd in (self.fd, self.direct_fd):
+            if fd is not None:
+                os.close(fd)
+        self.fd = self.direct_fd = None
+
+
+class StreamWriter(object):
+    """
+    Send the content of a volume through a single libvirt upload stream.
+    The chunks must be written in order. When libvirt supports sparse
+    streams, the zero blocks are sent as holes.
+    """
+    def __init__(self, conn, vol, size):
+        flags = get_upload_flags()
+        self.stream = conn.get().newStream(0)
+        try:
+            vol.upload(self.stream, 0, size, flags)
+        except libvirt.libvirtError:
+            if not flags:
+                raise
+            # libvirtd does not support sparse streams
+            flags = 0
+            self.stream = conn.get().newStream(0)
+            vol.upload(self.stream, 0, size, 0)
+        self.sparse = flags != 0
+
+    def write(self, offset, data):
+        if self.sparse:
+            send_sparse(self.stream, data)
+            return
+
+        while data:
+            data = data[self.stream.send(data):]
+
+    def finish(self):
+        self.stream.finish()
+
+    def abort(self):
+        self.stream.abort()
+
+
+class UploadSession(object):
+    """
+    Upload of the content of a volume through several requests.
+
+    A single writer is kept open for the whole upload: a file descriptor for
+    the file volumes, or a libvirt stream otherwise. The chunks may be sent
+    in parallel, in any order and more than once. The chunks of a file
+    volume are written concurrently. For the libvirt stream, which is
+    sequential, the chunks received ahead of the stream position are held
+    until the missing ones arrive, up to MAX_PENDING_SIZE bytes, and a
+    single request at a time sends the chunks in order.
+    """
+    def __init__(self, conn, vol, size, cb):
+        self.conn = conn
+        self.vol = vol
+        self.path = vol.path()
+        self.size = size
+        self.cb = cb
+        self.started = time.time()
+        self.received = 0
+        # Sorted and disjoint [start, end) intervals received
+        self._ranges = []
+        self._writer = None
+        self._sequential = False
+        self._position = 0
+        self._pending = {}
+        self._pending_size = 0
+        # A request is sending the pending chunks to the stream
+        self._draining = False
+        # Writes in progress out of the lock
+        self._writes = 0
+        self._lock = threading.Condition()
+
+    def _open_writer(self):
+        # File volumes (in 'dir' and 'netfs' pools) are written directly
+        if self.vol.info()[0] == 0 and os.path.isfile(self.path):
+            self._writer = _FileWriter(self.path)
+        else:
+            self._writer = StreamWriter(self.conn, self.vol, self.size)
+            self._sequential = True
+
+    def _add_range(self, start, end):
+        ranges = []
+        for r_start, r_end in self._ranges:
+            if r_end < start or r_start > end:
+                ranges.append((r_start, r_end))
+            else:
+                start = min(start, r_start)
+                end = max(end, r_end)
+        ranges.append((start, end))
+        ranges.sort()
+        self._ranges = ranges
+        self.received = sum(r_end - r_start for r_start, r_end in ranges)
+
+    def _add_pending(self, offset, data):
+        if offset + len(data) <= self._position:
+            # Already sent to the stream
+            return
+
+        if offset < self._position:
+            data = data[self._position - offset:]
+            offset = self._position
+
+        if offset not in self._pending:
+            if offset > self._position and \
+                    self._pending_size + len(data) > MAX_PENDING_SIZE:
+                raise OperationFailed("KCHVOL0030E", {'offset': offset})
+            self._pending[offset] = data
+            self._pending_size += len(data)
+
+    def _drain(self):
+        """
+        Send the pending chunks following the stream position, with the lock
+        held on entry and on return but not while sending
+        """
+        try:
+            while self._position in self._pending:
+                position = self._position
+                data = self._pending.pop(position)
+                self._pending_size -= len(data)
+                self._position += len(data)
+                self._lock.release()
+                try:
+                    self._writer.write(position, data)
+                finally:
+                    self._lock.acquire()
+        finally:
+            self._draining = False
+
+    def _write(self, offset, data):
+        # Only the bookkeeping is done with the lock held
+        with self._lock:
+            if self._writer is None:
+                self._open_writer()
+
+            if self._sequential:
+                self._add_pending(offset, data)
+                if not self._draining:
+                    self._draining = True
+                    self._writes += 1
+                    try:
+                        self._drain()
+                    finally:
+                        self._writes -= 1
+                        self._lock.notify_all()
+                return
+
+            self._writes += 1
+
+        try:
+            self._writer.write(offset, data)
+        finally:
+            with self._lock:
+                self._writes -= 1
+                self._lock.notify_all()
+
+    def write(self, offset, data):
+        """
+        Write a chunk of content at 'offset' and return True when all the
+        content was received
+        """
+        self._write(offset, data)
+        with self._lock:
+            self._add_range(offset, offset + len(data))
+            return self._ranges == [(0, self.size)]
+
+    def next_offset(self):
+        """
+        Offset following the content received so far, for the clients which
+        send the chunks in sequence
+        """
+        with self._lock:
+            if not self._ranges or self._ranges[0][0] != 0:
+                return 0
+            return self._ranges[0][1]
+
+    def finish(self):
+        with self._lock:
+            # Chunks sent more than once may still be written
+            while self._writes:
+                self._lock.wait()
+            if self._writer is not None:
+                self._writer.finish()
+
+    def abort(self):
+        with self._lock:
+            while self._writes:
+                self._lock.wait()
+            if self._writer is not None:
+                self._writer.abort()
+
+    def get_stats(self):
+        with self._lock:
+            elapsed = time.time() - self.started
+            return {'size': self.size,
+                    'received': self.received,
+                    'throughput': int(self.received / elapsed)
+                    if elapsed > 0 else 0}
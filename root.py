@@ -26,6 +26,7 @@ from wok.plugins.kimchi import config, mockmodel
 from wok.plugins.kimchi.i18n import messages
 from wok.plugins.kimchi.control import sub_nodes
 from wok.plugins.kimchi.model import model as kimchiModel
+from wok.plugins.kimchi.model.templateindex import template_index
 from wok.plugins.kimchi.utils import upgrade_objectstore_data
 from wok.plugins.kimchi.utils import upgrade_objectstore_memory
 from wok.plugins.kimchi.utils import upgrade_objectstore_template_disks
@@ -80,6 +81,7 @@ class Kimchi(WokRoot):
             upgrade_objectstore_data('storagepool', '/storagepools',
                                      '/plugins/kimchi')
             upgrade_objectstore_template_disks(self.model.conn)
+            template_index.invalidate()
 
         # Upgrade memory data, if necessary
         upgrade_objectstore_memory()
@@ -18,26 +18,54 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 #
 
+import fnmatch
 import glob
 import hashlib
 import os.path
+import re
 import shutil
 import tempfile
+import threading
 import time
+from multiprocessing.pool import ThreadPool
 
 from wok.utils import wok_log
 
-from wok.plugins.kimchi.isoinfo import IsoImage, probe_iso
+from wok.plugins.kimchi.isoinfo import IsoImage
 
 
 SCAN_IGNORE = ['/tmp/kimchi-scan-*']
+SCAN_WORKERS = 4
+PROGRESS_INTERVAL = 1
+
+
+def compile_ignore_list(patterns):
+    """
+    Compile glob patterns of directories into regular expressions, once for
+    the whole scan
+    """
+    return [re.compile(fnmatch.translate(os.path.normpath(p)))
+            for p in patterns]
 
 
 class Scanner(object):
+    """
+    Look for bootable ISO images in a directory tree and link them in a
+    directory, to be exposed as a transient storage pool.
+
+    The tree is walked by a single thread while the ISO files are probed by
+    a pool of worker threads. The probe results are kept between the scans,
+    keyed by the path of the file and checked against its size and mtime, so
+    scanning a tree again only probes the files added or changed since.
+    """
     SCAN_TTL = 300
 
-    def __init__(self, record_clean_cb):
+    def __init__(self, record_clean_cb, workers=SCAN_WORKERS):
         self.clean_cb = record_clean_cb
+        self.workers = workers
+        # path: (size, mtime, (distro, version) or None)
+        self._probed = {}
+        self._lock = threading.Lock()
 
     def delete(self):
         self.clean_stale(-1)
@@ -65,25 +93,102 @@ class Scanner(object):
         self.clean_stale()
         return tempfile.mkdtemp(prefix='kimchi-scan-' + name, dir='/tmp')
 
+    def _walk(self, path, ignore, stats):
+        """
+        Yield the (path, size, mtime) of the ISO files under 'path', skipping
+        the directories matching one of the 'ignore' expressions
+        """
+        if not os.path.isdir(path):
+            try:
+                st = os.stat(path)
+            except OSError:
+                return
+            yield path, st.st_size, st.st_mtime
+            return
+
+        for root, dirs, files in os.walk(path):
+            if any(regex.match(root) for regex in ignore):
+                # Do not descend in the ignored directories
+                del dirs[:]
+                continue
+
+            stats['dirs'] += 1
+            for name in files:
+                if not name.lower().endswith('.iso'):
+                    continue
+                iso = os.path.join(root, name)
+                try:
+                    st = os.stat(iso)
+                except OSError:
+                    continue
+                yield iso, st.st_size, st.st_mtime
+
+    def _probe(self, item):
+        path, size, mtime = item
+        with self._lock:
+            cached = self._probed.get(path)
+        if cached is not None and cached[:2] == (size, mtime):
+            return path, cached[2]
+
+        try:
+            result = IsoImage(path).probe()
+        except Exception:
+            result = None
+
+        with self._lock:
+            self._probed[path] = (size, mtime, result)
+        return path, result
+
+    def _forget(self, root, seen):
+        # Drop the results of the files removed from the scanned tree
+        prefix = os.path.join(root, '')
+        with self._lock:
+            for path in self._probed.keys():
+                if path.startswith(prefix) and path not in seen:
+                    del self._probed[path]
+
     def start_scan(self, cb, params):
-        def updater(iso_info):
-            iso_name = os.path.basename(iso_info['path'])[:-3]
-
-            duplicates = "%s/%s*" % (params['pool_path'], iso_name)
-            for f in glob.glob(duplicates):
-                iso_img = IsoImage(f)
-                if (iso_info['distro'], iso_info['version']) == \
-                   iso_img.probe():
-                    return
-
-            iso_path = iso_name + hashlib.md5(iso_info['path']).hexdigest() + \
-                '.iso'
-            link_name = os.path.join(params['pool_path'],
-                                     os.path.basename(iso_path))
-            os.symlink(iso_info['path'], link_name)
-
-        ignore_paths = params.get('ignore_list', [])
-        scan_params = dict(path=params['scan_path'], updater=updater,
-                           ignore_list=ignore_paths + SCAN_IGNORE)
-        probe_iso(None, scan_params)
+        loc = os.path.abspath(params['scan_path'].encode('utf-8'))
+        ignore = compile_ignore_list(params.get('ignore_list', []) +
+                                     SCAN_IGNORE)
+        stats = {'dirs': 0, 'probed': 0, 'found': 0}
+        # (file name, distro, version) of the ISO images linked
+        linked = set()
+        seen = set()
+        last_progress = 0
+
+        workers = ThreadPool(self.workers)
+        try:
+            for path, result in workers.imap_unordered(
+                    self._probe, self._walk(loc, ignore, stats)):
+                seen.add(path)
+                stats['probed'] += 1
+                if result is not None:
+                    self._link(params['pool_path'], path, result, linked)
+                    stats['found'] = len(linked)
+
+                now = time.time()
+                if now - last_progress >= PROGRESS_INTERVAL:
+                    last_progress = now
+                    cb('scanned %(dirs)d directories, probed %(probed)d ISO '
+                       'files, found %(found)d bootable images' % stats)
+        finally:
+            workers.terminate()
+            workers.join()
+
+        self._forget(loc, seen)
         cb('', True)
+
+    @staticmethod
+    def _link(pool_path, path, result, linked):
+        iso_name = os.path.basename(path)[:-3]
+
+        # Link a single image of a given name, distro and version
+        key = (iso_name, ) + tuple(result)
+        if key in linked:
+            return
+        linked.add(key)
+
+        iso_path = iso_name + hashlib.md5(path).hexdigest() + '.iso'
+        link_name = os.path.join(pool_path, os.path.basename(iso_path))
+        os.symlink(path, link_name)
@@ -0,0 +1,58 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+"""
+Micro-benchmark of the Volume ID matching of IsoImage.probe(), over Volume
+IDs matching every entry of the distro table:
+
+    PYTHONPATH=<wok src> python tests/benchmark_isoinfo.py [repeat]
+"""
+
+import sys
+import timeit
+
+from wok.plugins.kimchi.isoinfo import DistroMatcher, distro_matcher, iso_dir
+
+from test_isoinfo import reference_match, sample_volume_ids
+
+
+def _run(match, volume_ids):
+    for volume_id in volume_ids:
+        match(volume_id)
+
+
+def main(repeat=20):
+    volume_ids = sample_volume_ids()
+    print '%d Volume IDs, %d table entries, best of %d runs' % \
+        (len(volume_ids), len(iso_dir), repeat)
+
+    for name, match in [('re.search loop', reference_match),
+                        ('compiled matcher', distro_matcher.match)]:
+        best = min(timeit.repeat(lambda: _run(match, volume_ids),
+                                 number=1, repeat=repeat))
+        print '%-18s %8.2f us per Volume ID' % \
+            (name, best * 1000000 / len(volume_ids))
+
+    best = min(timeit.repeat(lambda: DistroMatcher(iso_dir), number=1,
+                             repeat=repeat))
+    print '%-18s %8.2f ms' % ('table compilation', best * 1000)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
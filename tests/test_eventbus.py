@@ -0,0 +1,64 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import mock
+import time
+import unittest
+
+from wok.plugins.kimchi.model.eventbus import EventBus
+
+
+class EventBusTests(unittest.TestCase):
+    def test_coalesce_events(self):
+        bus = EventBus(0.2)
+        cb = mock.Mock()
+        bus.subscribe(cb)
+
+        for i in range(200):
+            bus.publish('vms', u'vm-%03d' % i)
+        bus.publish('vms', u'vm-000')
+        bus.publish('storages', u'default')
+        self.assertEquals(0, cb.call_count)
+
+        time.sleep(0.5)
+        self.assertEquals(2, cb.call_count)
+        cb.assert_any_call('vms', [u'vm-%03d' % i for i in range(200)])
+        cb.assert_any_call('storages', [u'default'])
+
+        # a new window is opened by the next change
+        bus.publish('vms', u'vm-001')
+        time.sleep(0.5)
+        self.assertEquals(3, cb.call_count)
+        cb.assert_called_with('vms', [u'vm-001'])
+
+    def test_no_window(self):
+        bus = EventBus(0)
+        cb = mock.Mock(side_effect=[Exception('failed'), None])
+        other = mock.Mock()
+        bus.subscribe(cb)
+        bus.subscribe(other)
+
+        # a failing subscriber does not prevent the delivery to the others
+        bus.publish('networks', u'default')
+        other.assert_called_once_with('networks', [u'default'])
+
+        bus.unsubscribe(other)
+        bus.publish('networks', u'default')
+        self.assertEquals(2, cb.call_count)
+        self.assertEquals(1, other.call_count)
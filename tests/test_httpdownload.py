@@ -0,0 +1,199 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import BaseHTTPServer
+import mock
+import os
+import re
+import SocketServer
+import tempfile
+import threading
+import unittest
+import urllib2
+
+from wok.plugins.kimchi.model import httpdownload
+from wok.plugins.kimchi.model.httpdownload import HttpDownload
+
+
+CONTENT = ''.join(chr(i % 251) for i in xrange(1000000))
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.headers.getheader('Range'))
+            # Do not drop the probe of the first byte
+            drop = server.drop and (not server.ranges or
+                                    self.headers.getheader('Range') !=
+                                    'bytes=0-0')
+            if drop:
+                server.drop = False
+
+            # Errors returned to the segment requests
+            error = None
+            if server.errors and self.headers.getheader('Range') not in \
+                    [None, 'bytes=0-0']:
+                error = server.errors.pop(0)
+
+        if error is not None:
+            self.send_error(error)
+            return
+
+        content = server.content
+        match = re.match(r'bytes=(\d+)-(\d+)',
+                         self.headers.getheader('Range') or '')
+        if match is None or not server.ranges:
+            start, end = 0, len(content) - 1
+            self.send_response(200)
+        elif int(match.group(1)) >= len(content):
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%d' % len(content))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        else:
+            start, end = int(match.group(1)), int(match.group(2))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                             (start, end, len(content)))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+
+        if drop:
+            # Close the connection in the middle of the content
+            self.wfile.write(content[start:start + (end - start + 1) / 2])
+            return
+        self.wfile.write(content[start:end + 1])
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class HttpDownloadTests(unittest.TestCase):
+    def setUp(self):
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.ranges = True
+        self.server.drop = False
+        self.server.errors = []
+        self.server.content = CONTENT
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/image.img' % self.server.server_port
+        self.path = tempfile.mktemp()
+
+        patches = [mock.patch.object(httpdownload, 'SEGMENT_SIZE', 100000),
+                   mock.patch.object(httpdownload, 'RETRY_DELAY', 0)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _read(self):
+        with open(self.path) as fd:
+            return fd.read()
+
+    def test_ranged_download(self):
+        progress = []
+        download = HttpDownload(self.url, self.path, connections=3,
+                                progress_cb=lambda *a: progress.append(a))
+        self.assertEquals(len(CONTENT), download.run())
+        self.assertEquals(CONTENT, self._read())
+
+        # probe plus 10 segments
+        self.assertEquals(11, len(self.server.requests))
+        self.assertIn('bytes=900000-999999', self.server.requests)
+        # throttled progress, the last call reports the download completed
+        self.assertTrue(len(progress) < 10)
+        self.assertEquals((len(CONTENT), len(CONTENT)), progress[-1])
+
+    def test_resume_segment(self):
+        self.server.drop = True
+        download = HttpDownload(self.url, self.path, connections=1)
+        self.assertEquals(len(CONTENT), download.run())
+        self.assertEquals(CONTENT, self._read())
+
+        # the interrupted segment is resumed after the bytes received
+        self.assertIn('bytes=0-0', self.server.requests)
+        self.assertIn('bytes=50000-99999', self.server.requests)
+        self.assertEquals(12, len(self.server.requests))
+
+    def test_transient_error(self):
+        self.server.errors = [503, 429]
+        download = HttpDownload(self.url, self.path, connections=1)
+        self.assertEquals(len(CONTENT), download.run())
+        self.assertEquals(CONTENT, self._read())
+        # the first segment is requested 3 times
+        self.assertEquals(13, len(self.server.requests))
+
+    def test_permanent_error(self):
+        self.server.errors = [404]
+        download = HttpDownload(self.url, self.path, connections=1)
+        self.assertRaises(urllib2.HTTPError, download.run)
+        # not retried
+        self.assertEquals(['bytes=0-0', 'bytes=0-99999'],
+                          self.server.requests)
+
+    def test_empty_content(self):
+        self.server.content = ''
+        download = HttpDownload(self.url, self.path)
+        self.assertEquals(0, download.run())
+        self.assertEquals('', self._read())
+        self.assertEquals(0, download.size)
+        # the probe of the first byte is answered with 416
+        self.assertEquals(['bytes=0-0', None], self.server.requests)
+
+    def test_no_ranges(self):
+        self.server.ranges = False
+        download = HttpDownload(self.url, self.path)
+        self.assertEquals(len(CONTENT), download.run())
+        self.assertEquals(CONTENT, self._read())
+        self.assertEquals(1, len(self.server.requests))
+
+    def test_no_ranges_interrupted(self):
+        self.server.ranges = False
+        self.server.drop = True
+        download = HttpDownload(self.url, self.path)
+        self.assertRaises(IOError, download.run)
+
+    def test_stream(self):
+        for ranges in [True, False]:
+            self.server.ranges = ranges
+            self.server.drop = ranges
+            chunks = []
+            download = HttpDownload(self.url, None)
+            response, supported = download.probe()
+            self.assertEquals(ranges, supported)
+            self.assertEquals(len(CONTENT), download.size)
+            download.stream(response, supported, chunks.append)
+            self.assertEquals(CONTENT, ''.join(chunks))
+            self.assertTrue(max(len(c) for c in chunks) <=
+                            httpdownload.READ_CHUNK_SIZE)
@@ -0,0 +1,193 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import mock
+import os
+import stat
+import tempfile
+import time
+import unittest
+
+from wok.objectstore import ObjectStore
+
+from wok.plugins.kimchi.model import isocatalog
+from wok.plugins.kimchi.model.isocatalog import IsoCatalog
+
+
+def _volume(name, capacity):
+    vol = mock.Mock()
+    vol.name.return_value = name
+    vol.path.return_value = '/var/lib/kimchi/isos/' + name
+    vol.info.return_value = [0, capacity, capacity]
+    return vol
+
+
+def _volume_info(vol, pool_type):
+    path = vol.path()
+    has_permission = True
+    if os.path.exists(path):
+        has_permission = bool(os.stat(path).st_mode & stat.S_IWUSR)
+    res = {'path': path, 'capacity': vol.info()[1], 'used_by': [],
+           'format': 'raw', 'bootable': False,
+           'has_permission': has_permission}
+    if vol.name().endswith('.iso'):
+        res.update({'format': 'iso', 'bootable': True,
+                    'os_distro': 'fedora', 'os_version': '25'})
+    return res
+
+
+class IsoCatalogTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_store = tempfile.mktemp()
+        self.pool = mock.Mock()
+        self.pool.isActive.return_value = True
+        self.pool.listAllVolumes.return_value = [_volume('fedora.iso', 1024),
+                                                 _volume('disk.img', 2048)]
+        self.conn = mock.MagicMock()
+        self.conn.get.return_value.listStoragePools.return_value = ['isos']
+
+        patches = [
+            mock.patch.object(isocatalog, 'StorageVolumeModel'),
+            mock.patch.object(isocatalog.StoragePoolModel, 'get_storagepool',
+                              return_value=self.pool),
+            mock.patch.object(isocatalog, 'get_disk_used_by',
+                              return_value=['vm-1']),
+            mock.patch.object(isocatalog, 'pool_refresher')]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        isocatalog.pool_refresher.ttl = 60
+        isocatalog.StorageVolumeModel._get_pool_type.return_value = 'dir'
+        self.get_info = isocatalog.StorageVolumeModel.return_value.\
+            _get_volume_info
+        self.get_info.side_effect = _volume_info
+
+    def tearDown(self):
+        if os.path.exists(self.tmp_store):
+            os.unlink(self.tmp_store)
+
+    def _catalog(self):
+        return IsoCatalog(self.conn, ObjectStore(self.tmp_store), workers=2)
+
+    def _wait_scans(self, catalog):
+        for i in range(50):
+            if not catalog._scanning:
+                break
+            time.sleep(0.1)
+        self.assertFalse(catalog._scanning)
+
+    def _get_list(self, catalog):
+        # the pools to scan are scanned in background
+        catalog.get_list()
+        self._wait_scans(catalog)
+        return catalog.get_list()
+
+    def test_incremental_scan(self):
+        catalog = self._catalog()
+        # answered at once, before the pool is scanned
+        self.assertEquals([], catalog.get_list())
+        self._wait_scans(catalog)
+        isos = catalog.get_list()
+        self.assertEquals(1, len(isos))
+        self.assertEquals('fedora.iso', isos[0]['name'])
+        self.assertEquals('fedora', isos[0]['os_distro'])
+        self.assertEquals(['vm-1'], isos[0]['used_by'])
+        self.assertEquals(2, self.get_info.call_count)
+        self.conn.checkout.assert_called_with(readonly=True)
+
+        # answered from the catalog
+        self.assertEquals(isos, catalog.get_list())
+        self.assertFalse(catalog._scanning)
+        self.assertEquals(2, self.get_info.call_count)
+
+        # Kimchi created a volume: only the new one is probed
+        self.pool.listAllVolumes.return_value.append(_volume('rhel.iso', 1))
+        catalog.invalidate('isos')
+        isos = self._get_list(catalog)
+        self.assertEquals(['fedora.iso', 'rhel.iso'],
+                          [iso['name'] for iso in isos])
+        self.assertEquals(3, self.get_info.call_count)
+
+        # Kimchi wrote to a volume
+        catalog.invalidate('isos', 'disk.img')
+        self._get_list(catalog)
+        self.assertEquals(4, self.get_info.call_count)
+
+        # loaded from the object store
+        catalog = self._catalog()
+        self.assertEquals(isos, catalog.get_list())
+        self.assertFalse(catalog._scanning)
+        self.assertEquals(4, self.get_info.call_count)
+
+    def test_initial_scan(self):
+        catalog = self._catalog()
+        catalog._scan_all()
+        self._wait_scans(catalog)
+        # the first request is answered from the catalog
+        isos = catalog.get_list()
+        self.assertEquals(['fedora.iso'], [iso['name'] for iso in isos])
+        self.assertFalse(catalog._scanning)
+        self.assertEquals(2, self.get_info.call_count)
+
+    def test_pool_events(self):
+        catalog = self._catalog()
+        self._get_list(catalog)
+        self.assertEquals(2, self.get_info.call_count)
+
+        # libvirt reports a change on the pool: it is scanned in background
+        self.pool.listAllVolumes.return_value.append(_volume('rhel.iso', 1))
+        catalog.events_cb('storages', ['isos'])
+        self._wait_scans(catalog)
+        self.assertEquals(3, self.get_info.call_count)
+        self.assertEquals(2, len(catalog.get_list()))
+
+        # the pool was stopped
+        self.conn.get.return_value.listStoragePools.return_value = []
+        self.assertEquals([], catalog.get_list())
+
+    def test_replaced_image(self):
+        fd, path = tempfile.mkstemp()
+        os.write(fd, 'fedora')
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        vol = self.pool.listAllVolumes.return_value[0]
+        vol.path.return_value = path
+
+        catalog = self._catalog()
+        self.assertTrue(self._get_list(catalog)[0]['has_permission'])
+        self.assertEquals(2, self.get_info.call_count)
+
+        # the permission is kept in the catalog
+        self.assertTrue(catalog.get_list()[0]['has_permission'])
+        self.assertEquals(2, self.get_info.call_count)
+
+        # and probed again when the mode of the file changes
+        os.chmod(path, 0400)
+        catalog.invalidate('isos')
+        self.assertFalse(self._get_list(catalog)[0]['has_permission'])
+        self.assertEquals(3, self.get_info.call_count)
+
+        # another image of the same size
+        os.rename(path, path + '.old')
+        with open(path, 'w') as f:
+            f.write('ubuntu')
+        os.unlink(path + '.old')
+        catalog.invalidate('isos')
+        self._get_list(catalog)
+        self.assertEquals(4, self.get_info.call_count)
@@ -0,0 +1,260 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import BaseHTTPServer
+import os
+import re
+import SocketServer
+import tempfile
+import threading
+import unittest
+
+import iso_gen
+from wok.exception import IsoFormatError
+from wok.plugins.kimchi import isoinfo
+from wok.plugins.kimchi.isoinfo import DistroMatcher, IsoImage, LiteralMatcher
+from wok.plugins.kimchi.isoinfo import RemoteIsoReader
+from wok.plugins.kimchi.isoinfo import distro_matcher, iso_dir
+
+
+# Volume IDs for the entries of iso_dir which are not literals
+VOLUME_IDS = ['OpenBSD/amd64    6.0 Install CD', 'CentOS 7 x86_64',
+              'CentOS_6.5_Final', 'SLES-11-SP4-DVD-x86_6401',
+              'SUSE-Linux-Enterprise-Server.001', 'SLE-12-Server-DVD',
+              'openSUSE 13.2', 'openSUSE-Leap-42.1-DVD-x86_64',
+              'openSUSE-DVD-i586-Build0702.X001', 'RHEL-7.2 Server.x86_64',
+              'RHEL/4-U8', 'RHEL-LE-7.1 Server', 'Debian 8.6.0 amd64 1',
+              'Ubuntu 16.04 LTS amd64', 'Ubuntu-Server 14.04.5 LTS amd64',
+              'Fedora-WS-Live-x86_64-25-1-3', 'Fedora-S-dvd-x86_64-25',
+              'Fedora 20 x86_64', 'Fedora-Live-Desktop-x86_64-20-1',
+              'Gentoo Linux amd64 20160414', 'POWERKVM_LIVECD',
+              'ARCH_201610', 'KIMCHI', '', 'XRMHOEMFedora 21']
+
+
+def reference_match(volume_id):
+    # First match of the iso_dir entries, searched one after the other
+    for distro, version, regex in iso_dir:
+        match = re.search(regex, volume_id)
+        if match is not None:
+            if callable(version):
+                version = version(match)
+            return (distro, version)
+    return None
+
+
+def sample_volume_ids():
+    """
+    Volume IDs matching each entry of iso_dir, and a few unknown ones
+    """
+    volume_ids = list(VOLUME_IDS)
+    for distro, version, regex in iso_dir:
+        for alternative in regex.split('|'):
+            if re.escape(alternative) == alternative.replace('_', '\\_'):
+                volume_ids.append(alternative)
+                volume_ids.append('X%s_EN_DVD' % alternative)
+    return volume_ids
+
+
+class DistroMatcherTests(unittest.TestCase):
+    def test_literal_matcher(self):
+        matcher = LiteralMatcher([('he', 1), ('she', 2), ('his', 3),
+                                  ('hers', 4)])
+        self.assertEquals(set([1, 2, 4]), matcher.search('ushers'))
+        self.assertEquals(set([3]), matcher.search('this'))
+        self.assertEquals(set(), matcher.search('kimchi'))
+
+    def test_same_results(self):
+        for volume_id in sample_volume_ids():
+            self.assertEquals(reference_match(volume_id),
+                              distro_matcher.match(volume_id), volume_id)
+
+    def test_table_order(self):
+        # the first entry wins, even when a later literal entry matches
+        matcher = DistroMatcher([('fedora', lambda m: m.group(1),
+                                  'Fedora (\d+)'),
+                                 ('windows', '7', 'GRMC|FEDORA'),
+                                 ('windows', '8', 'HRM|GRMCX')])
+        self.assertEquals(('fedora', '21'), matcher.match('GRMC Fedora 21'))
+        self.assertEquals(('windows', '7'), matcher.match('GRMCXFRE'))
+        self.assertEquals(('windows', '8'), matcher.match('HRM_X64'))
+        self.assertEquals(None, matcher.match('Fedora'))
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+
+    def _send_head(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, self.path,
+                                    self.headers.getheader('Range')))
+
+        if self.path == '/redirect.iso':
+            self.send_response(302)
+            self.send_header('Location', '/image.iso')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+
+        if self.path != '/image.iso':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+
+        ranges = re.findall(r'(\d+)-(\d+)',
+                            self.headers.getheader('Range') or '')
+        ranges = [(int(start), min(int(end), len(server.content) - 1))
+                  for start, end in ranges]
+        if not ranges or not server.ranges:
+            body = server.content
+            self.send_response(200)
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            body = server.content[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                             (start, end, len(server.content)))
+        else:
+            body = ''
+            for start, end in ranges:
+                body += '--KIMCHI\r\nContent-Type: application/octet-' \
+                        'stream\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' \
+                        % (start, end, len(server.content))
+                body += server.content[start:end + 1] + '\r\n'
+            body += '--KIMCHI--\r\n'
+            self.send_response(206)
+            self.send_header('Content-Type',
+                             'multipart/byteranges; boundary=KIMCHI')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        return body
+
+    def do_HEAD(self):
+        self._send_head()
+
+    def do_GET(self):
+        body = self._send_head()
+        if body is not None:
+            self.wfile.write(body)
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class RemoteIsoTests(unittest.TestCase):
+    def setUp(self):
+        path = tempfile.mktemp()
+        iso_gen.construct_fake_iso(path, True, '12.04', 'ubuntu')
+        with open(path) as fd:
+            content = fd.read()
+        os.unlink(path)
+
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.lock = threading.Lock()
+        self.server.content = content
+        self.server.connections = 0
+        self.server.requests = []
+        self.server.ranges = True
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_probe(self):
+        iso = IsoImage(self.url + 'redirect.iso')
+        self.assertTrue(iso.remote)
+        self.assertEquals(('ubuntu', '12.04'), iso.probe())
+
+        # the redirection is followed once, and the scan fetches the volume
+        # descriptors and the boot catalog on the same connection
+        self.assertEquals(1, self.server.connections)
+        self.assertEquals(['HEAD', 'HEAD', 'GET', 'GET'],
+                          [r[0] for r in self.server.requests])
+        self.assertEquals('/image.iso', self.server.requests[-1][1])
+
+    def test_unreachable(self):
+        self.assertRaises(IsoFormatError, IsoImage, self.url + 'none.iso')
+
+    def test_sector_cache(self):
+        content = ''.join(chr(i % 251) for i in xrange(100 * 2048 + 100))
+        self.server.content = content
+        reader = RemoteIsoReader(self.url + 'image.iso')
+        self.assertTrue(reader.open())
+        self.assertEquals(len(content), reader.size)
+
+        self.assertEquals(content[100:200], reader.read(100, 100))
+        # the next sectors were read ahead
+        self.assertEquals(content[5000:9000], reader.read(5000, 4000))
+        self.assertEquals(2, len(self.server.requests))
+        self.assertEquals('bytes=0-34815', self.server.requests[-1][2])
+
+        # the missing sectors around the cached ones are fetched at once
+        reader.read(60 * 2048, 2048)
+        self.assertEquals(content[0:90 * 2048], reader.read(0, 90 * 2048))
+        self.assertEquals('bytes=34816-122879,157696-206847',
+                          self.server.requests[-1][2])
+
+        # reads at the end of the image
+        self.assertEquals(content[-50:], reader.read(len(content) - 50, 100))
+        self.assertEquals('', reader.read(len(content) + 4096, 10))
+        reader.close()
+        self.assertEquals(1, self.server.connections)
+
+    def test_sector_cache_eviction(self):
+        content = ''.join(chr(i % 251) for i in xrange(100 * 2048))
+        self.server.content = content
+        cache_sectors = isoinfo.REMOTE_CACHE_SECTORS
+        isoinfo.REMOTE_CACHE_SECTORS = 20
+        self.addCleanup(setattr, isoinfo, 'REMOTE_CACHE_SECTORS',
+                        cache_sectors)
+        reader = RemoteIsoReader(self.url + 'image.iso')
+        self.assertTrue(reader.open())
+
+        self.assertEquals(content[0:2048], reader.read(0, 2048))
+        self.assertEquals(content[10 * 2048:30 * 2048],
+                          reader.read(10 * 2048, 20 * 2048))
+        # the cache is full: the cached sectors of a read spanning missing
+        # ones are kept
+        self.assertEquals(content[25 * 2048:45 * 2048],
+                          reader.read(25 * 2048, 20 * 2048))
+        self.assertEquals('bytes=61440-124927', self.server.requests[-1][2])
+        self.assertEquals(range(25, 45), sorted(reader._sectors))
+        reader.close()
+
+    def test_no_ranges(self):
+        self.server.ranges = False
+        reader = RemoteIsoReader(self.url + 'image.iso')
+        self.assertTrue(reader.open())
+        self.assertEquals(self.server.content[32768:32868],
+                          reader.read(32768, 100))
+        reader.close()
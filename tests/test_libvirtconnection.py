@@ -0,0 +1,175 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import libvirt
+import mock
+import threading
+import unittest
+
+from wok.plugins.kimchi.model import libvirtconnection
+from wok.plugins.kimchi.model.libvirtconnection import LibvirtConnection
+
+
+URI = 'test:///kimchi-connection-health'
+
+
+def _fake_conn():
+    conn = mock.create_autospec(libvirt.virConnect, instance=True)
+    conn.isAlive.return_value = 1
+    return conn
+
+
+class LibvirtConnectionTests(unittest.TestCase):
+
+    def tearDown(self):
+        LibvirtConnection._connections[URI] = {}
+        LibvirtConnection._reconnectings[URI] = {}
+        LibvirtConnection._reconnect_callbacks[URI] = []
+        LibvirtConnection._pools.pop(URI, None)
+
+    @mock.patch('wok.plugins.kimchi.model.libvirtconnection.is_libvirtd_up')
+    @mock.patch('wok.plugins.kimchi.model.libvirtconnection.libvirt.open')
+    def test_healthy_connection_is_not_probed(self, mock_open, mock_up):
+        conn = _fake_conn()
+        mock_open.return_value = conn
+        mock_up.return_value = True
+        # the connection methods are wrapped once it is opened
+        set_keepalive = conn.setKeepAlive
+        register_close_cb = conn.registerCloseCallback
+
+        lc = LibvirtConnection(URI)
+        for i in range(10):
+            self.assertIs(conn, lc.get())
+
+        # libvirtd state is only checked before opening the connection
+        self.assertEquals(1, mock_up.call_count)
+        self.assertEquals(1, mock_open.call_count)
+        set_keepalive.assert_called_once_with(5, 3)
+        self.assertEquals(1, register_close_cb.call_count)
+
+    @mock.patch('wok.plugins.kimchi.model.libvirtconnection.time.sleep')
+    @mock.patch('wok.plugins.kimchi.model.libvirtconnection.is_libvirtd_up')
+    @mock.patch('wok.plugins.kimchi.model.libvirtconnection.libvirt.open')
+    def test_reconnect_with_backoff(self, mock_open, mock_up, mock_sleep):
+        conn1, conn2 = _fake_conn(), _fake_conn()
+        mock_open.side_effect = [conn1, conn2]
+        # up for the first connection, then down twice before coming back
+        mock_up.side_effect = [True, False, False, True]
+
+        lc = LibvirtConnection(URI)
+        self.assertIs(conn1, lc.get())
+        reconnect_cb = mock.Mock()
+        lc.add_reconnect_callback(reconnect_cb)
+
+        # connection closed: requests do not wait for libvirt
+        with mock.patch.object(lc, '_start_reconnect') as start_reconnect:
+            lc._close_cb(conn1, 0, 0)
+            start_reconnect.assert_called_once_with(0)
+        lc._reconnecting[0] = True
+        self.assertIsNone(lc.get())
+
+        lc._reconnect(0)
+        self.assertEquals([mock.call(1), mock.call(2), mock.call(4)],
+                          mock_sleep.call_args_list)
+        reconnect_cb.assert_called_once_with()
+        self.assertIs(conn2, lc.get())
+        self.assertEquals(4, mock_up.call_count)
+
+    @mock.patch('wok.plugins.kimchi.model.libvirtconnection.is_libvirtd_up')
+    @mock.patch('wok.plugins.kimchi.model.libvirtconnection.libvirt.'
+                'openReadOnly')
+    @mock.patch('wok.plugins.kimchi.model.libvirtconnection.libvirt.open')
+    def test_connection_pool(self, mock_open, mock_open_ro, mock_up):
+        shared, pooled, readonly = _fake_conn(), _fake_conn(), _fake_conn()
+        mock_open.side_effect = [shared, pooled]
+        mock_open_ro.return_value = readonly
+        mock_up.return_value = True
+
+        lc = LibvirtConnection(URI)
+        lc.configure_pool(1, 1)
+        self.assertIs(shared, lc.get())
+
+        with lc.checkout(readonly=True) as conn:
+            self.assertIs(readonly, conn)
+            self.assertIs(readonly, lc.get())
+            # a read-only connection does not allow changes
+            with lc.checkout() as rw_conn:
+                self.assertIs(pooled, rw_conn)
+                self.assertIs(pooled, lc.get())
+                # nested read-only checkout reuses the bound connection
+                with lc.checkout(readonly=True) as nested:
+                    self.assertIs(pooled, nested)
+                stats = lc.get_pool_stats()
+                self.assertEquals(1, stats['readwrite']['in_use'])
+                self.assertEquals(1, stats['readonly']['in_use'])
+            self.assertIs(readonly, lc.get())
+
+        self.assertIs(shared, lc.get())
+        stats = lc.get_pool_stats()
+        self.assertEquals(0, stats['readwrite']['in_use'])
+        self.assertEquals(0, stats['readonly']['in_use'])
+        self.assertEquals(1, stats['readwrite']['checkouts'])
+        self.assertEquals(1, stats['readonly']['checkouts'])
+
+    @mock.patch('wok.plugins.kimchi.model.libvirtconnection.'
+                'CHECKOUT_TIMEOUT', 0.1)
+    @mock.patch('wok.plugins.kimchi.model.libvirtconnection.is_libvirtd_up')
+    @mock.patch('wok.plugins.kimchi.model.libvirtconnection.libvirt.open')
+    def test_connection_pool_exhausted(self, mock_open, mock_up):
+        shared, pooled = _fake_conn(), _fake_conn()
+        mock_open.side_effect = [pooled, shared]
+        mock_up.return_value = True
+
+        lc = LibvirtConnection(URI)
+        lc.configure_pool(1)
+        with lc.checkout() as conn:
+            self.assertIs(pooled, conn)
+
+            # the pool is bounded: other threads wait, then fall back to the
+            # shared connection
+            result = []
+
+            def checkout():
+                with lc.checkout() as conn:
+                    result.append(conn)
+
+            thread = threading.Thread(target=checkout)
+            thread.start()
+            thread.join()
+            self.assertEquals([shared], result)
+
+        stats = lc.get_pool_stats()['readwrite']
+        self.assertEquals(1, stats['waits'])
+        self.assertEquals(1, stats['timeouts'])
+        self.assertTrue(stats['max_wait_time'] >= 0.1)
+
+    def test_index_error_does_not_fail_call(self):
+        dom = mock.create_autospec(libvirt.virDomain, instance=True)
+        define = mock.Mock(return_value=dom)
+        wrapped = LibvirtConnection(URI)._wrap_method(define, 'defineXML', 0)
+
+        with mock.patch.object(libvirtconnection.DomainIndex,
+                               'domain_changed') as domain_changed, \
+                mock.patch.object(libvirtconnection.domain_xml_cache,
+                                  'invalidate_dom') as invalidate_dom:
+            domain_changed.side_effect = libvirt.libvirtError('index error')
+            # the domain was defined: the index error is only logged
+            self.assertIs(dom, wrapped('<domain/>'))
+            domain_changed.assert_called_once_with(URI, dom)
+            invalidate_dom.assert_called_once_with(dom)
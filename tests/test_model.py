@@ -52,10 +52,14 @@ from wok.plugins.kimchi import network as netinfo
 from wok.plugins.kimchi import osinfo
 from wok.plugins.kimchi.config import kimchiPaths as paths
 from wok.plugins.kimchi.model import model
+from wok.plugins.kimchi.model.diskutils import get_disk_used_by
+from wok.plugins.kimchi.model.domainindex import DomainIndex
+from wok.plugins.kimchi.model.domxmlcache import domain_xml_cache
 from wok.plugins.kimchi.model.libvirtconnection import LibvirtConnection
 from wok.plugins.kimchi.model.virtviewerfile import FirewallManager
 from wok.plugins.kimchi.model.virtviewerfile import VMVirtViewerFileModel
 from wok.plugins.kimchi.model.vms import VMModel
+from wok.plugins.kimchi.xmlutils.domain import DomainXML
 
 import iso_gen
 
@@ -170,6 +174,258 @@ class ModelTests(unittest.TestCase):
         self.assertEquals([], info['groups'])
         self.assertTrue(info['persistent'])
 
+    def test_vm_lookup_all(self):
+        inst = model.Model('test:///default', self.tmp_store)
+        inst.statssampler.stop()
+
+        vms = inst.vm_lookup_all()
+        self.assertEquals(inst.vms_get_list(), [vm['name'] for vm in vms])
+
+        info = inst.vm_lookup('test')
+        self.assertEquals(info, vms[0])
+
+    def test_vm_lookup_xmldesc_calls(self):
+        inst = model.Model('test:///default', self.tmp_store)
+        inst.statssampler.stop()
+        domain_xml_cache.clear()
+
+        xml = """<domain type='test'>
+                   <name>kimchi-xmldesc-test</name>
+                   <memory unit='KiB'>1048576</memory>
+                   <os><type>hvm</type></os>
+                   <devices>
+                     <graphics type='vnc' port='5900' passwd='s3cret'/>
+                   </devices>
+                 </domain>"""
+        dom = inst.conn.get().defineXML(xml)
+        try:
+            xmldesc = libvirt.virDomain.XMLDesc
+            flags_list = []
+
+            def _count_xmldesc(dom, flags=0):
+                flags_list.append(flags)
+                return xmldesc(dom, flags)
+
+            with mock.patch.object(libvirt.virDomain, 'XMLDesc',
+                                   _count_xmldesc):
+                # the secure domain XML must be fetched only once per lookup,
+                # including for a guest with a graphics device
+                info = inst.vm_lookup('kimchi-xmldesc-test')
+                self.assertEquals([libvirt.VIR_DOMAIN_XML_SECURE],
+                                  flags_list)
+                self.assertEquals('vnc', info['graphics']['type'])
+                self.assertEquals('s3cret', info['graphics']['passwd'])
+
+                info = inst.vm_lookup('test')
+                self.assertEquals(2, len(flags_list))
+                self.assertEquals('test', info['name'])
+
+                # and once per domain when looking up all the VMs
+                del flags_list[:]
+                vms = inst.vm_lookup_all()
+                self.assertEquals(len(vms), len(flags_list))
+                self.assertEquals(set([libvirt.VIR_DOMAIN_XML_SECURE]),
+                                  set(flags_list))
+        finally:
+            dom.undefine()
+
+    def test_vm_lookup_pooled_connection(self):
+        inst = model.Model('test:///default', self.tmp_store)
+        inst.statssampler.stop()
+        inst.conn.configure_pool(1, 1)
+        domain_xml_cache.clear()
+
+        xml = """<domain type='test'>
+                   <name>kimchi-pooled-test</name>
+                   <memory unit='KiB'>1048576</memory>
+                   <os><type>hvm</type></os>
+                   <devices>
+                     <graphics type='vnc' port='5900' passwd='s3cret'/>
+                   </devices>
+                 </domain>"""
+        dom = inst.conn.get().defineXML(xml)
+        try:
+            # the secure XML is only allowed on read-write connections
+            checkouts = inst.conn.get_pool_stats()['readwrite']['checkouts']
+            info = inst.vm_lookup('kimchi-pooled-test')
+            self.assertEquals(checkouts + 1, inst.conn.get_pool_stats()[
+                'readwrite']['checkouts'])
+            self.assertEquals('vnc', info['graphics']['type'])
+            self.assertEquals('s3cret', info['graphics']['passwd'])
+
+            vms = dict((vm['name'], vm) for vm in inst.vm_lookup_all())
+            self.assertEquals(info, vms['kimchi-pooled-test'])
+
+            # the graphics password is never cached
+            self.assertNotIn('s3cret', domain_xml_cache.get(dom))
+        finally:
+            dom.undefine()
+
+    def test_domain_index(self):
+        inst = model.Model('test:///default', self.tmp_store)
+        conn = inst.conn.get()
+        self.assertIsNotNone(DomainIndex.get_index(inst.conn))
+
+        # names are resolved without any libvirt call
+        with mock.patch.object(conn, 'listAllDomains') as list_doms, \
+                mock.patch.object(conn, 'lookupByName') as lookup:
+            self.assertIn('test', inst.vms_get_list())
+            self.assertEquals('test', VMModel.get_vm('test', inst.conn).name())
+            self.assertEquals(0, list_doms.call_count)
+            self.assertEquals(0, lookup.call_count)
+
+        xml = """<domain type='test'>
+                   <name>kimchi-index-test</name>
+                   <memory unit='KiB'>1048576</memory>
+                   <os><type>hvm</type></os>
+                 </domain>"""
+        dom = conn.defineXML(xml)
+        try:
+            self.assertIn('kimchi-index-test', inst.vms_get_list())
+        finally:
+            dom.undefine()
+        self.assertNotIn('kimchi-index-test', inst.vms_get_list())
+        self.assertRaises(NotFoundError, VMModel.get_vm, 'kimchi-index-test',
+                          inst.conn)
+
+    def test_domain_index_pooled_connections(self):
+        inst = model.Model('test:///default', self.tmp_store)
+        inst.conn.configure_pool(2, 1)
+        index = DomainIndex.get_index(inst.conn)
+        # built on the shared connection, which receives the events
+        self.assertIs(inst.conn.get(0), index.conn)
+
+        # the pooled connections use the same index
+        with inst.conn.checkout() as conn:
+            with mock.patch.object(conn, 'listAllDomains') as list_doms:
+                self.assertIs(index, DomainIndex.get_index(inst.conn))
+                self.assertIn('test', inst.vms_get_list())
+                self.assertEquals(0, list_doms.call_count)
+
+            xml = """<domain type='test'>
+                       <name>kimchi-pooled-index-test</name>
+                       <memory unit='KiB'>1048576</memory>
+                       <os><type>hvm</type></os>
+                     </domain>"""
+            dom = conn.defineXML(xml)
+        try:
+            self.assertIn('kimchi-pooled-index-test', inst.vms_get_list())
+            indexed = VMModel.get_vm('kimchi-pooled-index-test', inst.conn)
+            self.assertIs(index.conn, indexed.connect())
+        finally:
+            dom.undefine()
+        self.assertNotIn('kimchi-pooled-index-test', inst.vms_get_list())
+
+    def test_domain_index_transient_domain(self):
+        inst = model.Model('test:///default', self.tmp_store)
+        conn = inst.conn.get()
+        index = DomainIndex.get_index(inst.conn)
+
+        xml = """<domain type='test'>
+                   <name>kimchi-transient-test</name>
+                   <memory unit='KiB'>1048576</memory>
+                   <os><type>hvm</type></os>
+                 </domain>"""
+        # started outside Kimchi: the wrapped connection does not see it
+        dom = libvirt.virConnect.createXML(conn, xml, 0)
+        try:
+            index._event_cb(conn, dom, libvirt.VIR_DOMAIN_EVENT_STARTED, 0,
+                            None)
+            self.assertIn('kimchi-transient-test', inst.vms_get_list())
+            self.assertEquals(dom.UUIDString(),
+                              VMModel.get_vm('kimchi-transient-test',
+                                             inst.conn).UUIDString())
+        finally:
+            dom.destroy()
+        self.assertNotIn('kimchi-transient-test', inst.vms_get_list())
+
+    def test_disk_used_by_index(self):
+        inst = model.Model('test:///default', self.tmp_store)
+        conn = inst.conn.get()
+        index = DomainIndex.get_index(inst.conn)
+        self.assertTrue(index.disks_ready)
+
+        path = '/var/lib/libvirt/images/kimchi-used-by.img'
+        xml = """<domain type='test'>
+                   <name>kimchi-used-by-test</name>
+                   <memory unit='KiB'>1048576</memory>
+                   <os><type>hvm</type></os>
+                   <devices>
+                     <disk type='file' device='disk'>
+                       <driver name='qemu' type='raw'/>
+                       <source file='%s'/>
+                       <target dev='vda' bus='virtio'/>
+                     </disk>
+                   </devices>
+                 </domain>""" % path
+        dom = conn.defineXML(xml)
+        try:
+            # the disks paths are resolved without any libvirt call
+            with mock.patch.object(DomainXML, 'from_dom') as from_dom:
+                self.assertEquals(['kimchi-used-by-test'],
+                                  get_disk_used_by(inst.conn, path))
+                self.assertEquals([], get_disk_used_by(inst.conn, '/tmp/x'))
+                self.assertEquals(0, from_dom.call_count)
+        finally:
+            dom.undefine()
+        self.assertEquals([], get_disk_used_by(inst.conn, path))
+
+    def test_domain_xml_cache(self):
+        inst = model.Model('test:///default', self.tmp_store)
+        inst.statssampler.stop()
+        domain_xml_cache.clear()
+
+        dom = inst.conn.get().lookupByName('test')
+        stats = domain_xml_cache.get_stats()
+        self.assertEquals(dom.XMLDesc(0), domain_xml_cache.get(dom))
+        self.assertEquals(dom.XMLDesc(0), domain_xml_cache.get(dom))
+        new_stats = domain_xml_cache.get_stats()
+        self.assertEquals(stats['misses'] + 1, new_stats['misses'])
+        self.assertEquals(stats['hits'] + 1, new_stats['hits'])
+
+        # changes done through the libvirt connection drop the cached XML
+        dom.setMetadata(libvirt.VIR_DOMAIN_METADATA_TITLE, 'cache-test',
+                        None, None, libvirt.VIR_DOMAIN_AFFECT_CURRENT)
+        try:
+            self.assertEquals('cache-test',
+                              DomainXML.from_dom(dom, 0).title)
+        finally:
+            dom.setMetadata(libvirt.VIR_DOMAIN_METADATA_TITLE, None,
+                            None, None, libvirt.VIR_DOMAIN_AFFECT_CURRENT)
+        self.assertEquals('', DomainXML.from_dom(dom, 0).title)
+
+        # the cache can be disabled
+        domain_xml_cache.enabled = False
+        try:
+            hits = domain_xml_cache.hits
+            misses = domain_xml_cache.misses
+            domain_xml_cache.get(dom)
+            self.assertEquals(hits, domain_xml_cache.hits)
+            self.assertEquals(misses, domain_xml_cache.misses)
+        finally:
+            domain_xml_cache.enabled = True
+
+    def test_vm_stats_history(self):
+        inst = model.Model('test:///default', self.tmp_store)
+        inst.statssampler.stop()
+
+        history = inst.vmstatshistory_lookup('test')
+        self.assertEquals([], history['samples'])
+
+        inst.statssampler._sample()
+        inst.statssampler._sample()
+        history = inst.vmstatshistory_lookup('test')
+        self.assertEquals(2, len(history['samples']))
+        self.assertEquals(sorted(['timestamp', 'cpu_utilization',
+                                  'mem_utilization', 'net_throughput',
+                                  'io_throughput']),
+                          sorted(history['samples'][0].keys()))
+
+        self.assertRaises(InvalidParameter, inst.vmstatshistory_lookup,
+                          'test', 'abc')
+        self.assertRaises(InvalidParameter, inst.vmstatshistory_lookup,
+                          'test', '-1')
+
     @unittest.skipUnless(utils.running_as_root() and
                          os.uname()[4] != "s390x", 'Must be run as root')
     def test_vm_lifecycle(self):
@@ -1697,6 +1953,104 @@ class ModelTests(unittest.TestCase):
             # (and removed) above (i.e. 'name' and 'uuid')
             self.assertEquals(original_vm, clone_vm)
 
+    def test_vm_clone_disks_space(self):
+        xml = """<domain>
+                   <name>kimchi-vm</name>
+                   <uuid>1234</uuid>
+                   <devices>
+                     <disk type='file' device='disk'>
+                       <source file='/pool-1/disk-0.img'/>
+                     </disk>
+                     <disk type='file' device='disk'>
+                       <source file='/pool-1/disk-1.img'/>
+                     </disk>
+                     <disk type='file' device='disk'>
+                       <source file='/pool-1/disk-2.img'/>
+                     </disk>
+                   </devices>
+                 </domain>"""
+
+        def _volume(path):
+            vol = mock.Mock()
+            vol.name.return_value = os.path.basename(path)
+            vol.storagePoolLookupByVolume.return_value.name.return_value = \
+                'pool-1'
+            return vol
+
+        pools = {'pool-1': {'type': 'dir', 'available': 2500},
+                 'default': {'type': 'dir', 'available': 1500}}
+        vm = VMModel.__new__(VMModel)
+        vm.conn = mock.Mock()
+        vm.conn.get.return_value.storageVolLookupByPath.side_effect = _volume
+        vm.storagepool = mock.Mock()
+        vm.storagepool.lookup.side_effect = lambda name: pools[name]
+        vm.storagevolume = mock.Mock()
+        vm.storagevolume.lookup.return_value = {'capacity': 1000,
+                                                'path': '/new/disk.img'}
+        vm.storagevolume.clone.return_value = {'id': 1}
+        vm.task = mock.Mock()
+
+        # the disks are cloned at the same time: the third one does not fit
+        # in the pool with the two first ones
+        vm._clone_update_disks(xml, mock.Mock())
+        self.assertEquals(['pool-1', 'pool-1', 'default'],
+                          [c[1]['new_pool'] for c in
+                           vm.storagevolume.clone.call_args_list])
+
+        pools['default']['available'] = 500
+        self.assertRaises(InvalidOperation, vm._clone_update_disks, xml,
+                          mock.Mock())
+
+    @unittest.skipUnless(utils.running_as_root() and
+                         os.uname()[4] != "s390x", 'Must be run as root')
+    def test_vm_linked_clone(self):
+        inst = model.Model(objstore_loc=self.tmp_store)
+
+        with RollbackContext() as rollback:
+            params = {'name': 'test',
+                      'source_media': {'type': 'disk', 'path': UBUNTU_ISO}}
+            inst.templates_create(params)
+            rollback.prependDefer(inst.template_delete, 'test')
+
+            params = {'name': u'kimchi-vm',
+                      'template': '/plugins/kimchi/templates/test'}
+            task = inst.vms_create(params)
+            rollback.prependDefer(inst.vm_delete, u'kimchi-vm')
+            inst.task_wait(task['id'], 10)
+
+            task = inst.vm_clone(u'kimchi-vm', mode='linked')
+            clone_name = task['target_uri'].split('/')[-2]
+            inst.task_wait(task['id'])
+            self.assertEquals('finished',
+                              inst.task_lookup(task['id'])['status'])
+
+            dev = inst.vmstorages_get_list(u'kimchi-vm')[0]
+            path = inst.vmstorage_lookup(u'kimchi-vm', dev)['path']
+            vol_name = os.path.basename(path)
+            clone_dev = inst.vmstorages_get_list(clone_name)[0]
+            clone_path = inst.vmstorage_lookup(clone_name, clone_dev)['path']
+            self.assertNotEquals(path, clone_path)
+
+            # the original disk is the backing store of the clone disk, so
+            # it can not be changed nor deleted
+            self.assertRaises(InvalidOperation, inst.vm_start, u'kimchi-vm')
+            self.assertRaises(InvalidOperation, inst.vm_delete, u'kimchi-vm')
+            self.assertRaises(InvalidOperation, inst.storagevolume_delete,
+                              u'default', vol_name)
+            self.assertRaises(InvalidOperation, inst.storagevolume_wipe,
+                              u'default', vol_name)
+            self.assertIn(u'kimchi-vm', inst.vms_get_list())
+            self.assertTrue(os.path.exists(path))
+
+            inst.vm_start(clone_name)
+            inst.vm_poweroff(clone_name)
+            inst.vm_delete(clone_name)
+            self.assertFalse(os.path.exists(clone_path))
+
+            # without linked clones, the original VM is usable again
+            inst.vm_start(u'kimchi-vm')
+            inst.vm_poweroff(u'kimchi-vm')
+
     def test_use_test_host(self):
         inst = model.Model('test:///default',
                            objstore_loc=self.tmp_store)
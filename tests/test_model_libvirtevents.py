@@ -20,6 +20,7 @@
 
 import json
 import libvirt
+import mock
 import os
 import shutil
 import tempfile
@@ -32,6 +33,7 @@ import tests.utils as utils
 from wok.rollbackcontext import RollbackContext
 
 from wok.plugins.kimchi.model import model
+from wok.plugins.kimchi.model.libvirtevents import LibvirtEvents
 
 
 TMP_DIR = '/var/lib/kimchi/tests/'
@@ -121,6 +123,35 @@ class LibvirtEventsTests(unittest.TestCase):
         data = {'domain': dom.name(), 'event': 'Rebooted'}
         _store_event('%s|%s' % (_get_next_event_id(), json.dumps(data)))
 
+    def test_event_loop_idle_wakeups(self):
+        events = LibvirtEvents()
+        self.assertTrue(events.is_event_loop_alive())
+        self.assertIs(events.event_loop_thread,
+                      LibvirtEvents().event_loop_thread)
+
+        run_default_impl = libvirt.virEventRunDefaultImpl
+        wakeups = []
+
+        def run():
+            wakeups.append(time.time())
+            return run_default_impl()
+
+        with mock.patch.object(libvirt, 'virEventRunDefaultImpl', run):
+            # Nothing to do: the event loop must stay blocked
+            time.sleep(1)
+            self.assertTrue(len(wakeups) < 5)
+
+            # and still be woken up by the libvirt timers
+            fired = []
+            start = time.time()
+            timer = libvirt.virEventAddTimeout(
+                100, lambda timer, opaque: fired.append(time.time()), None)
+            time.sleep(1)
+            libvirt.virEventRemoveTimeout(timer)
+
+        self.assertTrue(len(fired) >= 5)
+        self.assertTrue(fired[0] - start < 0.5)
+
     @unittest.skipUnless(utils.running_as_root() and
                          os.uname()[4] != "s390x", 'Must be run as root')
     def test_events_vm_lifecycle(self):
@@ -88,7 +88,8 @@ class StoragepoolTests(unittest.TestCase):
                 p = json.loads(resp.read())
                 keys = [u'name', u'state', u'capacity', u'allocated',
                         u'available', u'path', u'source', u'type',
-                        u'nr_volumes', u'autostart', u'persistent', 'in_use']
+                        u'nr_volumes', u'autostart', u'persistent', 'in_use',
+                        'last_refresh', 'refresh_duration']
                 self.assertEquals(sorted(keys), sorted(p.keys()))
                 self.assertEquals(name, p['name'])
                 self.assertEquals('inactive', p['state'])
@@ -171,6 +171,14 @@ def _do_volume_test(self, model, pool_name):
                                              task_id).read())
             self.assertEquals('ready for upload', status['message'])
 
+            # the upload progress is reported by the detailed list too
+            vol_info = json.loads(self.request(uri + '/' + filename).read())
+            vols = json.loads(self.request(uri + '?_detailed=true').read())
+            detailed = [v for v in vols if v['name'] == filename][0]
+            for key in ['size', 'received']:
+                self.assertEquals(vol_info['upload'][key],
+                                  detailed['upload'][key])
+
             # Upload volume content
             url = 'http://%s:%s' % (HOST, PORT) + uri + '/' + filename
 
@@ -259,7 +267,8 @@ class StorageVolumeTests(unittest.TestCase):
 
         keys = [u'name', u'type', u'capacity', u'allocation', u'path',
                 u'used_by', u'format', u'isvalid', u'has_permission']
-        for vol in json.loads(resp.read()):
+        vols = json.loads(resp.read())
+        for vol in vols:
             resp = self.request(uri + '/' + vol['name'])
             self.assertEquals(200, resp.status)
 
@@ -270,5 +279,10 @@ class StorageVolumeTests(unittest.TestCase):
 
             self.assertEquals(sorted(all_keys), sorted(vol_info.keys()))
 
+        # the detailed list returns the same information
+        resp = self.request(uri + '?_detailed=true')
+        self.assertEquals(200, resp.status)
+        self.assertEquals(vols, json.loads(resp.read()))
+
     def test_storagevolume_action(self):
         _do_volume_test(self, model, 'default')
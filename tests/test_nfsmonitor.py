@@ -0,0 +1,148 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import mock
+import unittest
+
+from wok.plugins.kimchi.model import nfsmonitor
+from wok.plugins.kimchi.model.nfsmonitor import NfsMonitor
+
+
+class NfsMonitorTests(unittest.TestCase):
+    def setUp(self):
+        self.eventbus = mock.Mock()
+        self.monitor = NfsMonitor(self.eventbus, 30)
+        self.monitor.start = mock.Mock()
+        self.reachable = True
+        self.probes = []
+        self.monitor._probe = self._probe
+
+        self.notifications = {}
+        patches = [mock.patch.object(nfsmonitor, 'add_notification'),
+                   mock.patch.object(nfsmonitor, 'del_notification'),
+                   mock.patch.object(nfsmonitor, 'notificationsStore',
+                                     self.notifications)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.add_notification = nfsmonitor.add_notification
+        self.add_notification.side_effect = self._add_notification
+        self.del_notification = nfsmonitor.del_notification
+        self.del_notification.side_effect = self.notifications.pop
+
+    def _add_notification(self, code, args, plugin):
+        self.notifications[code] = args
+
+    def _probe(self, server):
+        self.probes.append(server)
+        return self.reachable
+
+    def test_cached_state(self):
+        self.assertTrue(self.monitor.is_online('nfs1', 'pool1'))
+        self.assertTrue(self.monitor.is_online('nfs1', 'pool2'))
+        # a single check until the next one is due
+        self.assertEquals(['nfs1'], self.probes)
+
+        # a dead server does not slow down the lookups
+        self.reachable = False
+        self.assertTrue(self.monitor.is_online('nfs1', 'pool1'))
+        self.assertEquals(1, len(self.probes))
+
+        self.assertFalse(self.monitor.is_online('nfs1', 'pool1',
+                                                recheck=True))
+        self.assertFalse(self.monitor.is_online('nfs1', 'pool1'))
+
+    def test_backoff(self):
+        self.reachable = False
+        self.assertFalse(self.monitor.is_online('nfs1'))
+        delays = []
+        for i in range(6):
+            stats = self.monitor.get_stats('nfs1')
+            delays.append(stats['next_check'] - stats['last_check'])
+            self.monitor._check('nfs1')
+        self.assertEquals([30, 60, 120, 240, 300, 300],
+                          [int(round(d)) for d in delays])
+
+        self.reachable = True
+        self.monitor._check('nfs1')
+        stats = self.monitor.get_stats('nfs1')
+        self.assertEquals(0, stats['failures'])
+        self.assertEquals(30, int(round(stats['next_check'] -
+                                        stats['last_check'])))
+
+    def test_schedule(self):
+        self.monitor.is_online('nfs1', 'pool1')
+        self.monitor._schedule()
+        self.assertEquals(1, len(self.probes))
+
+        self.monitor._servers['nfs1']['next_check'] = 0
+        self.monitor._schedule()
+        self.monitor._servers['nfs1']['checking'].wait(1)
+        self.assertEquals(2, len(self.probes))
+
+    def test_notifications(self):
+        self.monitor.is_online('nfs1', 'pool2')
+        self.monitor.is_online('nfs1', 'pool1')
+        self.monitor._check('nfs1')
+        self.assertFalse(self.eventbus.publish.called)
+
+        self.reachable = False
+        self.monitor._check('nfs1')
+        self.assertEquals([mock.call('storages', 'pool1'),
+                           mock.call('storages', 'pool2')],
+                          self.eventbus.publish.call_args_list)
+        self.add_notification.assert_called_once_with(
+            'KCHEVENT0005W', {'server': 'nfs1', 'pools': 'pool1, pool2'},
+            '/plugins/kimchi')
+
+        # a single notification lists all the offline servers
+        self.reachable = True
+        self.monitor.is_online('nfs2', 'pool3')
+        self.reachable = False
+        self.monitor._check('nfs2')
+        self.assertEquals({'server': 'nfs1, nfs2',
+                           'pools': 'pool1, pool2, pool3'},
+                          self.notifications['KCHEVENT0005W'])
+
+        self.reachable = True
+        self.monitor._check('nfs1')
+        self.assertEquals(5, self.eventbus.publish.call_count)
+        self.assertEquals({'server': 'nfs2', 'pools': 'pool3'},
+                          self.notifications['KCHEVENT0005W'])
+
+        # cleared when all the servers are back online
+        self.monitor._check('nfs2')
+        self.assertNotIn('KCHEVENT0005W', self.notifications)
+        self.del_notification.assert_called_once_with('KCHEVENT0005W')
+
+    def test_remove_pool(self):
+        self.monitor.is_online('nfs1', 'pool1')
+        self.monitor.is_online('nfs1', 'pool2')
+        self.monitor.remove_pool('pool1')
+        self.assertTrue(self.monitor.get_stats('nfs1')['online'])
+        self.monitor.remove_pool('pool2')
+        self.assertEquals({}, self.monitor.get_stats('nfs1'))
+
+    def test_remove_pool_keeps_other_servers(self):
+        self.monitor.is_online('nfs1')
+        self.monitor.is_online('nfs2', 'pool2')
+        self.monitor.remove_pool('pool2')
+        # the server registered without any pool is still monitored
+        self.assertTrue(self.monitor.get_stats('nfs1')['online'])
+        self.assertEquals({}, self.monitor.get_stats('nfs2'))
@@ -0,0 +1,84 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import mock
+import threading
+import time
+import unittest
+
+from wok.plugins.kimchi.model.poolrefresh import PoolRefreshScheduler
+
+
+def _fake_pool(delay=0):
+    pool = mock.Mock()
+    pool.UUIDString.return_value = 'f2d9d6d4-5c43-4d53-9b55-41c1ff36b8a2'
+    pool.refresh.side_effect = lambda flags: time.sleep(delay)
+    return pool
+
+
+class PoolRefreshSchedulerTests(unittest.TestCase):
+    def test_concurrent_refreshes_are_merged(self):
+        scheduler = PoolRefreshScheduler(0)
+        pool = _fake_pool(0.3)
+
+        threads = [threading.Thread(target=scheduler.refresh, args=(pool,))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(1, pool.refresh.call_count)
+        stats = scheduler.get_stats(pool)
+        self.assertEquals(1, stats['refreshes'])
+        self.assertEquals(4, stats['merged'])
+        self.assertTrue(stats['duration'] >= 0.3)
+
+    def test_refresh_ttl(self):
+        scheduler = PoolRefreshScheduler(60)
+        pool = _fake_pool()
+
+        scheduler.refresh(pool)
+        last_refresh = scheduler.get_stats(pool)['last_refresh']
+        scheduler.refresh(pool)
+        self.assertEquals(1, pool.refresh.call_count)
+        self.assertEquals(1, scheduler.get_stats(pool)['skipped'])
+
+        # changed by Kimchi: refreshed on the next request
+        scheduler.invalidate(pool)
+        scheduler.refresh(pool)
+        self.assertEquals(2, pool.refresh.call_count)
+
+        scheduler.refresh(pool, force=True)
+        self.assertEquals(3, pool.refresh.call_count)
+        self.assertTrue(scheduler.get_stats(pool)['last_refresh'] >=
+                        last_refresh)
+
+    def test_refresh_failure(self):
+        scheduler = PoolRefreshScheduler(60)
+        pool = _fake_pool()
+        pool.refresh.side_effect = Exception('NFS server is down')
+
+        self.assertRaises(Exception, scheduler.refresh, pool)
+        self.assertIsNone(scheduler.get_stats(pool)['last_refresh'])
+
+        # a failed refresh is retried right away
+        pool.refresh.side_effect = None
+        scheduler.refresh(pool)
+        self.assertEquals(2, pool.refresh.call_count)
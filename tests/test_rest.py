@@ -122,6 +122,16 @@ class RestTests(unittest.TestCase):
         self.assertEquals([], vm['users'])
         self.assertEquals([], vm['groups'])
 
+        # The detailed list returns the same information
+        detailed = json.loads(
+            self.request('/plugins/kimchi/vms?_detailed=true').read())
+        self.assertEquals(sorted(v['name'] for v in vms),
+                          sorted(v['name'] for v in detailed))
+        vm_1 = [v for v in detailed if v['name'] == 'vm-1'][0]
+        self.assertEquals(sorted(vm.keys()), sorted(vm_1.keys()))
+        self.assertEquals(vm['uuid'], vm_1['uuid'])
+        self.assertEquals(vm['memory'], vm_1['memory'])
+
     def test_edit_vm_cpuhotplug(self):
         req = json.dumps({'name': 'template_cpuhotplug',
                           'source_media': {'type': 'disk', 'path': fake_iso}})
@@ -1529,7 +1539,7 @@ class RestTests(unittest.TestCase):
     def test_config(self):
         resp = self.request('/plugins/kimchi/config').read()
         conf = json.loads(resp)
-        keys = ["version"]
+        keys = ["upload_concurrency", "version"]
         self.assertEquals(keys, sorted(conf.keys()))
 
     def test_capabilities(self):
@@ -0,0 +1,109 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from wok.plugins.kimchi import scan
+from wok.plugins.kimchi.scan import Scanner
+
+
+class ScannerTests(unittest.TestCase):
+    def setUp(self):
+        self.tree = tempfile.mkdtemp()
+        self.pool_path = tempfile.mkdtemp()
+        for path in ['fedora/fedora.iso', 'mirror/fedora.iso',
+                     'ubuntu/ubuntu.ISO', 'ignored/debian.iso',
+                     'ignored/sub/debian.iso', 'data/notes.txt']:
+            self._touch(path)
+
+        patcher = mock.patch.object(scan, 'IsoImage')
+        self.iso_image = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.iso_image.side_effect = self._iso_image
+        self.probed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tree)
+        shutil.rmtree(self.pool_path)
+
+    def _touch(self, path, content='iso'):
+        path = os.path.join(self.tree, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fd:
+            fd.write(content)
+
+    def _iso_image(self, path):
+        self.probed.append(os.path.relpath(path, self.tree))
+        iso = mock.Mock()
+        distro = os.path.basename(path).lower()[:-4]
+        iso.probe.return_value = (distro, '1.0')
+        return iso
+
+    def _scan(self, scanner):
+        cb = mock.Mock()
+        params = {'scan_path': unicode(self.tree),
+                  'pool_path': self.pool_path,
+                  'ignore_list': [os.path.join(self.tree, 'ignored')]}
+        scanner.start_scan(cb, params)
+        cb.assert_called_with('', True)
+        return sorted(os.readlink(os.path.join(self.pool_path, link))
+                      for link in os.listdir(self.pool_path))
+
+    def test_scan(self):
+        links = self._scan(Scanner(None, workers=2))
+        # a single link for the images with the same name and version, and
+        # no image from the ignored directory and its subdirectories
+        self.assertEquals(2, len(links))
+        self.assertEquals(['fedora.iso', 'ubuntu.ISO'],
+                          [os.path.basename(link) for link in links])
+        self.assertEquals(['fedora/fedora.iso', 'mirror/fedora.iso',
+                           'ubuntu/ubuntu.ISO'], sorted(self.probed))
+
+    def test_incremental_scan(self):
+        scanner = Scanner(None, workers=2)
+        self._scan(scanner)
+        for link in os.listdir(self.pool_path):
+            os.unlink(os.path.join(self.pool_path, link))
+
+        # only the changed and new files are probed again
+        self.probed = []
+        self._touch('mirror/fedora.iso', 'changed iso')
+        self._touch('centos/centos.iso')
+        os.unlink(os.path.join(self.tree, 'ubuntu/ubuntu.ISO'))
+        links = self._scan(scanner)
+        self.assertEquals(['centos/centos.iso', 'mirror/fedora.iso'],
+                          sorted(self.probed))
+        self.assertEquals(2, len(links))
+        self.assertFalse(os.path.join(self.tree, 'ubuntu/ubuntu.ISO') in
+                         scanner._probed)
+
+    def test_ignore_list(self):
+        ignore = scan.compile_ignore_list(['/var/lib/libvirt/images/',
+                                           '/tmp/kimchi-scan-*'])
+        for path, ignored in [('/var/lib/libvirt/images', True),
+                              ('/var/lib/libvirt', False),
+                              ('/tmp/kimchi-scan-iso1abc', True),
+                              ('/tmp', False)]:
+            self.assertEquals(ignored,
+                              any(regex.match(path) for regex in ignore))
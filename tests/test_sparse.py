@@ -0,0 +1,162 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import mock
+import os
+import tempfile
+import unittest
+
+from wok.plugins.kimchi.model import sparse
+from wok.plugins.kimchi.model.volumeupload import UploadSession
+
+
+BLOCK = sparse.ZERO_BLOCK_SIZE
+# data, 4 zero blocks, data, 2 zero blocks
+CONTENT = 'k' * BLOCK + '\0' * 4 * BLOCK + 'kimchi' + '\0' * (2 * BLOCK - 6)
+
+
+class SparseTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_data_runs(self):
+        self.assertEquals([(0, BLOCK, False), (BLOCK, 5 * BLOCK, True),
+                           (5 * BLOCK, 6 * BLOCK, False),
+                           (6 * BLOCK, 7 * BLOCK, True)],
+                          sparse.data_runs(CONTENT))
+        self.assertEquals([(0, 10, True)], sparse.data_runs('\0' * 10))
+
+    def test_write_and_read_sparse_file(self):
+        with open(self.path, 'wb') as fd:
+            sparse.write_sparse(fd, 0, CONTENT)
+            fd.truncate(len(CONTENT))
+
+        with open(self.path) as fd:
+            self.assertEquals(CONTENT, fd.read())
+        # only the data blocks are allocated, where holes are supported
+        allocated = os.stat(self.path).st_blocks * 512
+        self.assertTrue(allocated <= len(CONTENT))
+
+        chunks = list(sparse.iter_file(self.path, chunk_size=BLOCK))
+        self.assertEquals(CONTENT, ''.join(chunks))
+        self.assertTrue(max(len(c) for c in chunks) <= BLOCK)
+
+    def test_iter_file_without_hole_support(self):
+        with open(self.path, 'wb') as fd:
+            fd.write(CONTENT)
+
+        with mock.patch.object(sparse.os, 'lseek',
+                               side_effect=self._lseek_no_holes):
+            self.assertEquals(CONTENT,
+                              ''.join(sparse.iter_file(self.path)))
+
+    def test_iter_file_opened_at_once(self):
+        with open(self.path, 'wb') as fd:
+            fd.write('k' * 3 * BLOCK)
+
+        fds = []
+
+        def _open(path, flags, os_open=os.open):
+            fds.append(os_open(path, flags))
+            return fds[-1]
+
+        with mock.patch.object(sparse.os, 'open', side_effect=_open), \
+                mock.patch.object(sparse.os, 'close',
+                                  wraps=os.close) as os_close:
+            content = sparse.iter_file(self.path, chunk_size=BLOCK)
+            self.assertEquals(1, len(fds))
+
+            # the file is closed when the content is not read to the end
+            self.assertEquals('k' * BLOCK, next(content))
+            content.close()
+            os_close.assert_called_once_with(fds[0])
+
+            # or not read at all
+            content = sparse.iter_file(self.path, chunk_size=BLOCK)
+            content.close()
+            os_close.assert_called_with(fds[1])
+
+            # and when it is read to the end
+            content = sparse.iter_file(self.path, chunk_size=BLOCK)
+            self.assertEquals('k' * 3 * BLOCK, ''.join(content))
+            os_close.assert_called_with(fds[2])
+            self.assertEquals(3, os_close.call_count)
+
+        # the errors are raised before reading the content
+        self.assertRaises(OSError, sparse.iter_file, self.path + '.missing')
+
+    def test_iter_volume_opened_at_once(self):
+        conn = mock.Mock()
+        stream = conn.get.return_value.newStream.return_value
+        stream.recvFlags.return_value = 'kimchi'
+        stream.recv.return_value = 'kimchi'
+        vol = mock.Mock()
+
+        content = sparse.iter_volume(conn, vol, 100)
+        self.assertTrue(vol.download.called)
+
+        self.assertEquals('kimchi', next(content))
+        content.close()
+        stream.abort.assert_called_once_with()
+        self.assertFalse(stream.finish.called)
+
+        # the stream is aborted even when the content is not read
+        stream.abort.reset_mock()
+        sparse.iter_volume(conn, vol, 100).close()
+        stream.abort.assert_called_once_with()
+
+        # and finished when it is read to the end
+        stream.recvFlags.side_effect = ['kimchi', '']
+        stream.recv.side_effect = ['kimchi', '']
+        self.assertEquals(['kimchi'], list(sparse.iter_volume(conn, vol,
+                                                              100)))
+        stream.finish.assert_called_once_with()
+
+    @staticmethod
+    def _lseek_no_holes(fd, offset, whence, lseek=os.lseek):
+        if whence in (sparse.SEEK_DATA, sparse.SEEK_HOLE):
+            raise OSError(22, 'Invalid argument')
+        return lseek(fd, offset, whence)
+
+    def test_send_sparse(self):
+        stream = mock.Mock()
+        stream.send.side_effect = len
+        sparse.send_sparse(stream, CONTENT)
+
+        self.assertEquals([mock.call(4 * BLOCK, 0), mock.call(BLOCK, 0)],
+                          stream.sendHole.call_args_list)
+        self.assertEquals(2 * BLOCK, sum(len(c[0][0]) for c in
+                                         stream.send.call_args_list))
+
+    def test_sparse_upload_session(self):
+        with open(self.path, 'wb') as fd:
+            fd.truncate(len(CONTENT))
+        vol = mock.Mock()
+        vol.path.return_value = self.path
+        vol.info.return_value = [0, len(CONTENT), 0]
+
+        session = UploadSession(mock.Mock(), vol, len(CONTENT), None)
+        self.assertTrue(session.write(0, CONTENT))
+        session.finish()
+        with open(self.path) as fd:
+            self.assertEquals(CONTENT, fd.read())
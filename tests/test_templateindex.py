@@ -0,0 +1,94 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import tempfile
+import unittest
+
+from wok.objectstore import ObjectStore
+
+from wok.plugins.kimchi.model.templateindex import TemplateIndex
+
+
+POOL_URI = '/plugins/kimchi/storagepools/%s'
+
+
+def _template(pool, networks, cdrom=None, base=None):
+    disk = {'index': 0, 'pool': {'name': POOL_URI % pool, 'type': 'dir'}}
+    if base is not None:
+        disk['base'] = base
+    info = {'disks': [disk], 'networks': networks}
+    if cdrom is not None:
+        info['cdrom'] = cdrom
+    return info
+
+
+class TemplateIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_store = tempfile.mktemp()
+        self.objstore = ObjectStore(self.tmp_store)
+        with self.objstore as session:
+            session.store('template', 'tmpl-1',
+                          _template('default', ['default'],
+                                    cdrom='/isos/fedora.iso'))
+            session.store('template', 'tmpl-2',
+                          _template('images', ['default', 'net-1'],
+                                    base='/images/base.img'))
+
+        self.index = TemplateIndex()
+        self.index.objstore = self.objstore
+
+    def tearDown(self):
+        if os.path.exists(self.tmp_store):
+            os.unlink(self.tmp_store)
+
+    def test_build(self):
+        self.assertEquals(['tmpl-1'],
+                          self.index.get_templates('pools', 'default'))
+        self.assertEquals(['tmpl-1', 'tmpl-2'],
+                          self.index.get_templates('networks', 'default'))
+        self.assertEquals([], self.index.get_templates('pools', 'unknown'))
+
+    def test_updates(self):
+        self.index.get_templates('pools', 'default')
+
+        self.index.add('tmpl-3', _template('default', ['net-1']))
+        self.assertEquals(['tmpl-1', 'tmpl-3'],
+                          self.index.get_templates('pools', 'default'))
+
+        # updating a template drops its former resources
+        self.index.add('tmpl-2', _template('default', ['default']))
+        self.assertEquals([], self.index.get_templates('pools', 'images'))
+        self.assertEquals(['tmpl-3'],
+                          self.index.get_templates('networks', 'net-1'))
+
+        self.index.remove('tmpl-1')
+        self.index.remove('tmpl-3')
+        self.assertEquals(['tmpl-2'],
+                          self.index.get_templates('pools', 'default'))
+
+    def test_invalidate(self):
+        self.index.get_templates('pools', 'default')
+        with self.objstore as session:
+            session.delete('template', 'tmpl-1')
+        self.assertEquals(['tmpl-1'],
+                          self.index.get_templates('pools', 'default'))
+
+        self.index.invalidate()
+        self.assertEquals([], self.index.get_templates('pools', 'default'))
@@ -0,0 +1,141 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import libvirt
+import mock
+import unittest
+
+from wok.plugins.kimchi.model.vmstats import GuestStatsCollector
+from wok.plugins.kimchi.model.vmstats import parse_bulk_record
+from wok.plugins.kimchi.model.vmstats import StatsHistory
+
+
+DOMAIN_XML = """
+<domain type='kvm'>
+  <name>vm1</name>
+  <uuid>%s</uuid>
+  <devices>
+    <disk type='file' device='disk'>
+      <target dev='vda' bus='virtio'/>
+    </disk>
+    <interface type='network'>
+      <target dev='vnet0'/>
+    </interface>
+  </devices>
+</domain>
+"""
+
+
+def _bulk_record(cputime, rx, tx, rd, wr):
+    return {'state.state': libvirt.VIR_DOMAIN_RUNNING,
+            'cpu.time': cputime,
+            'vcpu.current': 2,
+            'balloon.current': 1024, 'balloon.rss': 512,
+            'net.count': 1, 'net.0.name': 'vnet0',
+            'net.0.rx.bytes': rx, 'net.0.tx.bytes': tx,
+            'block.count': 1, 'block.0.name': 'vda',
+            'block.0.rd.bytes': rd, 'block.0.wr.bytes': wr}
+
+
+def _fake_dom(uuid):
+    dom = mock.Mock()
+    dom.UUIDString.return_value = uuid
+    dom.XMLDesc.return_value = DOMAIN_XML % uuid
+    return dom
+
+
+class GuestStatsCollectorTests(unittest.TestCase):
+
+    def test_parse_bulk_record(self):
+        counters = parse_bulk_record(_bulk_record(10, 1, 2, 3, 4))
+        self.assertEquals(libvirt.VIR_DOMAIN_RUNNING, counters['state'])
+        self.assertEquals(10, counters['cputime'])
+        self.assertEquals(2, counters['vcpus'])
+        self.assertEquals(50.0, counters['mem_usage'])
+        self.assertEquals((1, 2, 3, 4), (counters['rx_bytes'],
+                                         counters['tx_bytes'],
+                                         counters['rd_bytes'],
+                                         counters['wr_bytes']))
+
+    @mock.patch('wok.plugins.kimchi.model.vmstats.time.time')
+    def test_update_all_single_call(self, mock_time):
+        dom1, dom2 = _fake_dom('uuid-1'), _fake_dom('uuid-2')
+        conn = mock.Mock()
+        conn.get.return_value.getAllDomainStats.side_effect = [
+            [(dom1, _bulk_record(0, 0, 0, 0, 0)),
+             (dom2, _bulk_record(0, 0, 0, 0, 0))],
+            [(dom1, _bulk_record(2 * 10 ** 9, 4000, 6000, 2048, 2048)),
+             (dom2, {'state.state': libvirt.VIR_DOMAIN_SHUTOFF})]]
+
+        collector = GuestStatsCollector(conn)
+        mock_time.return_value = 100.0
+        collector.update_all()
+        mock_time.return_value = 102.0
+        stats = collector.update_all()
+
+        bulk_call = conn.get.return_value.getAllDomainStats
+        self.assertEquals(2, bulk_call.call_count)
+        # 2 seconds of CPU time in 2 seconds with 2 vcpus
+        self.assertEquals(50.0, stats['uuid-1']['cpu'])
+        self.assertEquals(5.0, stats['uuid-1']['net_io'])
+        self.assertEquals(2.0, stats['uuid-1']['disk_io'])
+        self.assertEquals({}, stats['uuid-2'])
+        dom1.interfaceStats.assert_not_called()
+        dom1.blockStats.assert_not_called()
+
+    @mock.patch('wok.plugins.kimchi.model.vmstats.time.time')
+    def test_update_domain_fallback(self, mock_time):
+        dom = _fake_dom('uuid-1')
+        dom.memoryStats.return_value = {'actual': 1024, 'rss': 256}
+        dom.interfaceStats.return_value = (4000, 0, 0, 0, 6000, 0, 0, 0)
+        dom.blockStats.return_value = (0, 2048, 0, 2048, 0)
+        conn = mock.Mock()
+        conn.get.return_value.domainListGetStats = None
+
+        collector = GuestStatsCollector(conn)
+        mock_time.return_value = 100.0
+        collector.stats['uuid-1'] = {'timestamp': 98.0}
+        info = (libvirt.VIR_DOMAIN_RUNNING, 0, 0, 1, 10 ** 9)
+        stats = collector.update_domain(dom, info)
+
+        self.assertEquals(50.0, stats['cpu'])
+        self.assertEquals(25.0, stats['mem_usage'])
+        self.assertEquals(5.0, stats['net_io'])
+        self.assertEquals(2.0, stats['disk_io'])
+        dom.interfaceStats.assert_called_once_with('vnet0')
+        dom.blockStats.assert_called_once_with('vda')
+
+
+class StatsHistoryTests(unittest.TestCase):
+
+    def test_ring_buffer(self):
+        history = StatsHistory(3)
+        self.assertEquals([], history.get())
+
+        for i in range(5):
+            history.append({'timestamp': 100.0 + i, 'cpu': i})
+
+        # only the latest 3 samples are kept
+        self.assertEquals(3, len(history))
+        samples = history.get()
+        self.assertEquals([2.0, 3.0, 4.0], [s['cpu'] for s in samples])
+        self.assertEquals(0.0, samples[0]['mem_usage'])
+
+        samples = history.get(window=1)
+        self.assertEquals([103.0, 104.0], [s['timestamp'] for s in samples])
@@ -0,0 +1,114 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import errno
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from wok.objectstore import ObjectStore
+
+from wok.plugins.kimchi.model import volumeclone
+
+
+class ReflinkTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmpdir, 'disk.img')
+        self.dst = os.path.join(self.tmpdir, 'clone.img')
+        with open(self.src, 'wb') as fd:
+            fd.write('kimchi')
+        os.chmod(self.src, 0640)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_reflink(self):
+        with mock.patch.object(volumeclone.fcntl, 'ioctl') as ioctl:
+            self.assertTrue(volumeclone.reflink(self.src, self.dst))
+
+        self.assertEquals(volumeclone.FICLONE, ioctl.call_args[0][1])
+        self.assertEquals(0640, os.stat(self.dst).st_mode & 0777)
+
+    def test_reflink_unsupported(self):
+        error = IOError(errno.EOPNOTSUPP, 'Operation not supported')
+        with mock.patch.object(volumeclone.fcntl, 'ioctl',
+                               side_effect=error):
+            self.assertFalse(volumeclone.reflink(self.src, self.dst))
+        self.assertFalse(os.path.exists(self.dst))
+
+    def test_reflink_error(self):
+        error = IOError(errno.ENOSPC, 'No space left on device')
+        with mock.patch.object(volumeclone.fcntl, 'ioctl',
+                               side_effect=error):
+            self.assertRaises(OSError, volumeclone.reflink, self.src,
+                              self.dst)
+        self.assertFalse(os.path.exists(self.dst))
+
+    def test_reflink_existing_file(self):
+        with open(self.dst, 'wb') as fd:
+            fd.write('data')
+        self.assertRaises(OSError, volumeclone.reflink, self.src, self.dst)
+        with open(self.dst) as fd:
+            self.assertEquals('data', fd.read())
+
+
+class LinkedCloneTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.objstore = ObjectStore(os.path.join(self.tmpdir, 'objstore'))
+        self.backing = os.path.join(self.tmpdir, 'disk.img')
+        self.clones = []
+        for name in ['clone-2.img', 'clone-1.img']:
+            path = os.path.join(self.tmpdir, name)
+            open(path, 'wb').close()
+            volumeclone.add_linked_clone(self.objstore, path, self.backing)
+            self.clones.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_linked_clones(self):
+        self.assertEquals(sorted(self.clones),
+                          volumeclone.get_linked_clones(self.objstore,
+                                                        self.backing))
+        self.assertEquals([], volumeclone.get_linked_clones(self.objstore,
+                                                            self.clones[0]))
+
+    def test_remove_linked_clone(self):
+        volumeclone.remove_linked_clone(self.objstore, self.clones[0])
+        self.assertEquals([self.clones[1]],
+                          volumeclone.get_linked_clones(self.objstore,
+                                                        self.backing))
+
+        # removing an unknown clone is not an error
+        volumeclone.remove_linked_clone(self.objstore, self.clones[0])
+
+    def test_removed_clone_file(self):
+        # the clones removed outside Kimchi do not protect their backing
+        # store anymore
+        os.remove(self.clones[0])
+        self.assertEquals([self.clones[1]],
+                          volumeclone.get_linked_clones(self.objstore,
+                                                        self.backing))
+        with self.objstore as session:
+            self.assertEquals([self.clones[1]],
+                              session.get_list('linkedclone'))
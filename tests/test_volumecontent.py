@@ -0,0 +1,119 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import mock
+import os
+import tempfile
+import unittest
+
+from wok.objectstore import ObjectStore
+
+from wok.plugins.kimchi.model import volumecontent
+from wok.plugins.kimchi.model.volumecontent import VolumeContentCache
+
+
+class VolumeContentCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_store = tempfile.mktemp()
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, 'kimchi')
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+        if os.path.exists(self.tmp_store):
+            os.unlink(self.tmp_store)
+
+    @mock.patch('wok.plugins.kimchi.model.volumecontent.get_file_type')
+    def test_file_type_cache(self, get_file_type):
+        get_file_type.return_value = 'ASCII text'
+        cache = VolumeContentCache()
+        cache.objstore = ObjectStore(self.tmp_store)
+
+        for i in range(3):
+            self.assertEquals('ASCII text', cache.get_file_type(self.path))
+        self.assertEquals(1, get_file_type.call_count)
+
+        # persisted in the object store
+        cache = VolumeContentCache()
+        cache.objstore = ObjectStore(self.tmp_store)
+        self.assertEquals('ASCII text', cache.get_file_type(self.path))
+        self.assertEquals(1, get_file_type.call_count)
+
+        # the file changed
+        with open(self.path, 'a') as f:
+            f.write(' project')
+        get_file_type.return_value = 'data'
+        self.assertEquals('data', cache.get_file_type(self.path))
+        self.assertEquals(2, get_file_type.call_count)
+
+        # Kimchi changed the volume
+        cache.invalidate(self.path)
+        self.assertEquals('data', cache.get_file_type(self.path))
+        self.assertEquals(3, get_file_type.call_count)
+
+    @mock.patch('wok.plugins.kimchi.model.volumecontent.get_file_type')
+    def test_objstore_entries(self, get_file_type):
+        get_file_type.return_value = 'ASCII text'
+        cache = VolumeContentCache()
+        cache.objstore = ObjectStore(self.tmp_store)
+        cache.get_file_type(self.path)
+
+        # after a restart, the object store is only read once
+        cache = VolumeContentCache()
+        cache.objstore = ObjectStore(self.tmp_store)
+        with mock.patch.object(ObjectStore, '__enter__', autospec=True,
+                               side_effect=ObjectStore.__enter__) as enter:
+            for i in range(3):
+                self.assertEquals('ASCII text',
+                                  cache.get_file_type(self.path))
+        self.assertEquals(1, enter.call_count)
+        self.assertEquals(1, get_file_type.call_count)
+
+        # the entries of the deleted volumes are dropped
+        cache.objstore = ObjectStore(self.tmp_store)
+        os.rename(self.path, self.path + '.tmp')
+        try:
+            cache.purge()
+            with cache.objstore as session:
+                self.assertEquals([], session.get_list('volumecontent'))
+            self.assertEquals({}, cache._cache)
+        finally:
+            os.rename(self.path + '.tmp', self.path)
+
+    def test_iso_info_cache(self):
+        cache = VolumeContentCache()
+        with mock.patch.object(volumecontent, 'IsoImage') as iso_image:
+            iso_image.return_value.probe.return_value = ('fedora', '25')
+            for i in range(2):
+                info = cache.get_iso_info(self.path)
+                self.assertEquals({'is_iso': True, 'os_distro': 'fedora',
+                                   'os_version': '25', 'bootable': True},
+                                  info)
+            self.assertEquals(1, iso_image.call_count)
+
+    def test_shared_magic_handle(self):
+        with mock.patch.object(volumecontent, '_magic', None), \
+                mock.patch.object(volumecontent.magic, 'open') as magic_open:
+            magic_open.return_value.file.return_value = 'data'
+            for i in range(3):
+                self.assertEquals('data',
+                                  volumecontent.get_file_type(self.path))
+            self.assertEquals(1, magic_open.call_count)
+            self.assertEquals(1, magic_open.return_value.load.call_count)
@@ -0,0 +1,143 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import mock
+import os
+import tempfile
+import threading
+import unittest
+
+from wok.exception import OperationFailed
+
+from wok.plugins.kimchi.model import volumeupload
+from wok.plugins.kimchi.model.volumeupload import UploadSession
+
+
+CHUNK_SIZE = 8192
+CONTENT = ''.join(chr(i % 251) for i in xrange(5 * CHUNK_SIZE + 100))
+
+
+def _chunks():
+    return [(offset, CONTENT[offset:offset + CHUNK_SIZE])
+            for offset in xrange(0, len(CONTENT), CHUNK_SIZE)]
+
+
+class UploadSessionTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.vol = mock.Mock()
+        self.vol.path.return_value = self.path
+        self.conn = mock.Mock()
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_file_upload_out_of_order(self):
+        self.vol.info.return_value = [0, len(CONTENT), 0]
+        session = UploadSession(self.conn, self.vol, len(CONTENT), None)
+
+        chunks = _chunks()
+        # in reverse order, the last chunk sent twice
+        for offset, data in reversed(chunks[1:]):
+            self.assertFalse(session.write(offset, data))
+        self.assertFalse(session.write(*chunks[-1]))
+        self.assertEquals(0, session.next_offset())
+        self.assertEquals(len(CONTENT) - CHUNK_SIZE,
+                          session.get_stats()['received'])
+
+        self.assertTrue(session.write(*chunks[0]))
+        self.assertEquals(len(CONTENT), session.next_offset())
+        session.finish()
+
+        with open(self.path) as fd:
+            self.assertEquals(CONTENT, fd.read())
+        # the volume is written directly, not through libvirt
+        self.assertFalse(self.conn.get.called)
+
+    def test_file_upload_concurrent_chunks(self):
+        self.vol.info.return_value = [0, len(CONTENT), 0]
+        session = UploadSession(self.conn, self.vol, len(CONTENT), None)
+        pwrite = volumeupload.pwrite
+        writing = []
+        both_writing = threading.Event()
+
+        def _pwrite(fd, data, offset):
+            writing.append(offset)
+            if len(writing) == 2:
+                both_writing.set()
+            # wait for the other chunk to be written at the same time
+            both_writing.wait(5)
+            pwrite(fd, data, offset)
+
+        chunks = _chunks()
+        with mock.patch.object(volumeupload, 'pwrite', _pwrite):
+            writers = [threading.Thread(target=session.write, args=chunk)
+                       for chunk in chunks[:2]]
+            for writer in writers:
+                writer.start()
+            for writer in writers:
+                writer.join()
+        self.assertTrue(both_writing.is_set())
+
+        for chunk in chunks[2:]:
+            session.write(*chunk)
+        session.finish()
+        with open(self.path) as fd:
+            self.assertEquals(CONTENT, fd.read())
+
+    def test_stream_upload_out_of_order(self):
+        self.vol.info.return_value = [1, len(CONTENT), 0]
+        stream = self.conn.get.return_value.newStream.return_value
+        sent = []
+
+        def _send(data):
+            # libvirt may send less than requested
+            sent.append(data[:1000])
+            return len(sent[-1])
+        stream.send.side_effect = _send
+
+        session = UploadSession(self.conn, self.vol, len(CONTENT), None)
+        chunks = _chunks()
+        for i in [1, 2, 0, 0, 4, 3]:
+            session.write(*chunks[i])
+        self.assertTrue(session.write(*chunks[5]))
+        session.finish()
+
+        self.vol.upload.assert_called_once_with(stream, 0, len(CONTENT), 0)
+        self.assertEquals(CONTENT, ''.join(sent))
+        stream.finish.assert_called_once_with()
+
+    def test_stream_upload_pending_limit(self):
+        self.vol.info.return_value = [1, len(CONTENT), 0]
+        stream = self.conn.get.return_value.newStream.return_value
+        stream.send.side_effect = len
+
+        session = UploadSession(self.conn, self.vol, len(CONTENT), None)
+        chunks = _chunks()
+        with mock.patch.object(volumeupload, 'MAX_PENDING_SIZE',
+                               2 * CHUNK_SIZE):
+            session.write(*chunks[1])
+            session.write(*chunks[2])
+            self.assertRaises(OperationFailed, session.write, *chunks[3])
+
+            # the missing chunk unblocks the upload
+            session.write(*chunks[0])
+            session.write(*chunks[3])
+        self.assertEquals(4 * CHUNK_SIZE, session.next_offset())
@@ -394,7 +394,7 @@ var kimchi = {
 
     listVMs : function(suc, err) {
         wok.requestJSON({
-            url : 'plugins/kimchi/vms',
+            url : 'plugins/kimchi/vms?_detailed=true',
             type : 'GET',
             contentType : 'application/json',
             headers: {'Wok-Robot': 'wok-robot'},
@@ -431,7 +431,7 @@ var kimchi = {
 
     listStorageVolumes : function(poolName, suc, err, sync) {
         $.ajax({
-            url : 'plugins/kimchi/storagepools/' + encodeURIComponent(poolName) + '/storagevolumes',
+            url : 'plugins/kimchi/storagepools/' + encodeURIComponent(poolName) + '/storagevolumes?_detailed=true',
             type : 'GET',
             contentType : 'application/json',
             dataType : 'json',
@@ -81,7 +81,11 @@ kimchi.sp_add_volume_main = function() {
 
     var uploadFile = function() {
         var chunkSize = 2 * 1024 * 1024; // 2MB
-        var uploaded = 0;
+        var maxRetries = 3;
+        var concurrency = (kimchi.config && kimchi.config.upload_concurrency) || 4;
+        var nextOffset = 0;
+        var inFlight = 0;
+        var failed = false;
 
         var blobFile = $(localFileBox)[0].files[0];
 
@@ -97,20 +101,28 @@ kimchi.sp_add_volume_main = function() {
             }, onError);
         };
 
-        var uploadRequest = function(blob) {
+        // Each chunk is sent with its offset, so several chunks are sent in
+        // parallel and a failed chunk is sent again on its own
+        var uploadRequest = function(blob, offset, retries) {
             var fd = new FormData();
             fd.append('chunk', blob);
             fd.append('chunk_size', blob.size);
+            fd.append('offset', offset);
 
             kimchi.uploadVolumeToSP(selectedStoragePool, blobFile.name, {
                 formData: fd
             }, function(result) {
-                if (uploaded < blobFile.size){
-                    setTimeout(doUpload, 500);
+                inFlight--;
+                doUpload();
+            }, function(err) {
+                if (retries < maxRetries && !failed) {
+                    uploadRequest(blob, offset, retries + 1);
+                    return;
                 }
-            }, onError);
-
-            uploaded += blob.size;
+                inFlight--;
+                failed = true;
+                onError(err);
+            });
         };
 
         // Check file exists and has read permission
@@ -132,23 +144,34 @@ kimchi.sp_add_volume_main = function() {
             return;
         }
 
-        var doUpload = function() {
+        var uploadChunk = function(offset) {
             try {
-                var blob = blobFile.slice(uploaded, uploaded + chunkSize);
+                var blob = blobFile.slice(offset, offset + chunkSize);
                 var reader = new FileReader();
                 reader.onloadend = function(e) {
                     if (e.loaded === 0) {
+                        inFlight--;
+                        failed = true;
                         wok.message.error.code('KCHAPI6009E');
                     }
                     else {
-                        uploadRequest(blob);
+                        uploadRequest(blob, offset, 0);
                     }
                 };
 
                 reader.readAsBinaryString(blob);
             } catch (err) {
+                inFlight--;
+                failed = true;
                 wok.message.error.code('KCHAPI6009E');
-                return;
+            }
+        };
+
+        var doUpload = function() {
+            while (!failed && inFlight < concurrency && nextOffset < blobFile.size) {
+                inFlight++;
+                uploadChunk(nextOffset);
+                nextOffset += chunkSize;
             }
         };
 
@@ -24,11 +24,11 @@ import socket
 import stat
 import string
 import urlparse
-from lxml import objectify
 from lxml.builder import E
 
 from wok.exception import InvalidParameter, NotFoundError
 from wok.plugins.kimchi.utils import check_url_path
+from wok.plugins.kimchi.xmlutils.domain import DomainXML
 from wok.utils import wok_log
 
 BUS_TO_DEV_MAP = {'ide': 'hd', 'virtio': 'vd', 'scsi': 'sd'}
@@ -126,25 +126,28 @@ def _get_disk_type(path):
     raise InvalidParameter("KCHVMSTOR0003E", {'value': path})
 
 
+def _get_domain_xml(dom):
+    # Accept either a libvirt domain or an already parsed DomainXML so
+    # callers which hold a snapshot do not fetch the XML again
+    if isinstance(dom, DomainXML):
+        return dom
+    return DomainXML.from_dom(dom, 0)
+
+
 def get_device_node(dom, dev_name):
-    xml = dom.XMLDesc(0)
-    devices = objectify.fromstring(xml).devices
-    disk = devices.xpath("./disk/target[@dev='%s']/.." % dev_name)
+    domxml = _get_domain_xml(dom)
+    disk = domxml.disk_node(dev_name)
 
-    if not disk:
+    if disk is None:
         raise NotFoundError("KCHVMSTOR0007E",
                             {'dev_name': dev_name,
-                             'vm_name': dom.name()})
+                             'vm_name': domxml.name})
 
-    return disk[0]
+    return disk
 
 
-def get_vm_disk_info(dom, dev_name):
-    # Retrieve disk xml and format return dict
-    disk = get_device_node(dom, dev_name)
-    if disk is None:
-        return None
-
+def _get_disk_path(disk):
+    path = ""
     try:
         source = disk.source
         if source is not None:
@@ -158,22 +161,30 @@ def get_vm_disk_info(dom, dev_name):
                 path = source.attrib[DEV_TYPE_SRC_ATTR_MAP[src_type]]
     except:
         path = ""
+    return path
+
+
+def get_vm_disk_info(dom, dev_name):
+    # Retrieve disk xml and format return dict
+    disk = get_device_node(dom, dev_name)
+    if disk is None:
+        return None
 
     return {'dev': dev_name,
-            'path': path,
+            'path': _get_disk_path(disk),
             'type': disk.attrib['device'],
             'format': disk.driver.attrib['type'],
             'bus': disk.target.attrib['bus']}
 
 
 def get_vm_disks(dom):
-    xml = dom.XMLDesc(0)
-    devices = objectify.fromstring(xml).devices
+    return _get_domain_xml(dom).disks()
 
-    storages = {}
-    all_disks = devices.xpath("./disk[@device='disk']")
-    all_disks.extend(devices.xpath("./disk[@device='cdrom']"))
-    for disk in all_disks:
-        storages[disk.target.attrib['dev']] = disk.target.attrib['bus']
 
-    return storages
+def get_vm_disk_paths(dom):
+    """
+    Return the paths of all the disks and cdroms of a domain, as reported
+    by get_vm_disk_info()
+    """
+    return [_get_disk_path(disk)
+            for disk in _get_domain_xml(dom).disk_nodes()]
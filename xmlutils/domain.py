@@ -0,0 +1,254 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import libvirt
+import lxml.etree as ET
+import time
+from lxml import objectify
+
+from wok.utils import convert_data_size
+
+from wok.plugins.kimchi.model.domxmlcache import domain_xml_cache
+from wok.plugins.kimchi.model.utils import KIMCHI_META_URL
+
+
+class DomainXML(object):
+    """
+    Parsed snapshot of a domain XML descriptor.
+
+    The XML is fetched at most once (see from_dom()) and parsed into a single
+    lxml tree, so all the information needed to build a VM resource can be
+    read without new libvirt calls or new parsing. The snapshot is meant to
+    live for a single request: it is not updated when the domain changes.
+    """
+    def __init__(self, xml):
+        self.xml = xml
+        self.root = objectify.fromstring(xml)
+
+    @classmethod
+    def from_dom(cls, dom, flags=0):
+        # The graphics password is only in the VIR_DOMAIN_XML_SECURE output,
+        # which is not allowed on read-only connections. It is fetched
+        # straight from libvirt so the password is never cached.
+        if flags & libvirt.VIR_DOMAIN_XML_SECURE:
+            return cls(dom.XMLDesc(flags))
+        return cls(domain_xml_cache.get(dom, flags))
+
+    def get_text(self, expr):
+        """
+        Same as wok.xmlutils.utils.xpath_get_text() but on the parsed tree
+        """
+        res = []
+        for node in self.root.xpath(expr):
+            if isinstance(node, basestring):
+                res.append(unicode(node))
+            else:
+                res.append(node.text)
+        return res
+
+    def _get_first(self, expr, default=None):
+        res = self.get_text(expr)
+        return res[0] if res else default
+
+    @property
+    def name(self):
+        return self._get_first('/domain/name')
+
+    @property
+    def uuid(self):
+        return self._get_first('/domain/uuid')
+
+    @property
+    def title(self):
+        return "".join(self.get_text('./title'))
+
+    @property
+    def description(self):
+        return "".join(self.get_text('./description'))
+
+    @property
+    def devices(self):
+        return self.root.find('devices')
+
+    def _find_devices(self, expr):
+        devices = self.devices
+        if devices is None:
+            return []
+        return devices.xpath(expr)
+
+    def graphics(self):
+        """
+        Return the tuple
+        (type, listen, port, passwd, passwdValidTo)
+        for the first graphics device of the domain.
+        """
+        graphics_type = self._get_first('/domain/devices/graphics/@type')
+        graphics_listen = self._get_first('/domain/devices/graphics/@listen')
+
+        graphics_port = graphics_passwd = graphics_passwdValidTo = None
+        if graphics_type:
+            expr = "/domain/devices/graphics[@type='%s']/@%s"
+            port = self._get_first(expr % (graphics_type, 'port'))
+            graphics_port = int(port) if port else None
+
+            graphics_passwd = self._get_first(expr % (graphics_type,
+                                                      'passwd'))
+
+            valid_to = self._get_first(expr % (graphics_type,
+                                               'passwdValidTo'))
+            if valid_to:
+                to = time.mktime(time.strptime(valid_to, '%Y-%m-%dT%H:%M:%S'))
+                graphics_passwdValidTo = to - time.mktime(time.gmtime())
+
+        return (graphics_type, graphics_listen, graphics_port,
+                graphics_passwd, graphics_passwdValidTo)
+
+    def has_video(self):
+        return self.root.find('devices/video') is not None
+
+    def disk_nodes(self):
+        """
+        Return the disk and cdrom device nodes, in that order
+        """
+        disks = self._find_devices("./disk[@device='disk']")
+        disks.extend(self._find_devices("./disk[@device='cdrom']"))
+        return disks
+
+    def disks(self):
+        """
+        Return a dict mapping each disk/cdrom target device to its bus
+        """
+        storages = {}
+        for disk in self.disk_nodes():
+            storages[disk.target.attrib['dev']] = disk.target.attrib['bus']
+        return storages
+
+    def disk_node(self, dev_name):
+        disk = self._find_devices("./disk/target[@dev='%s']/.." % dev_name)
+        return disk[0] if disk else None
+
+    def disk_targets(self):
+        """
+        Return the target device names of all disks, used to collect I/O
+        statistics
+        """
+        return [t.get('dev') for t in self._find_devices('./disk/target')]
+
+    def disk_paths(self, device='disk'):
+        return self.get_text("/domain/devices/disk[@device='%s']/source/@file"
+                             % device)
+
+    def interfaces(self):
+        return self._find_devices('./interface')
+
+    def interface_targets(self):
+        """
+        Return the target device names of all network interfaces, used to
+        collect I/O statistics
+        """
+        return [t.get('dev')
+                for t in self._find_devices('./interface/target')]
+
+    def has_topology(self):
+        topology = self.root.find('cpu/topology')
+        if topology is None:
+            return False
+        return all(topology.get(attr)
+                   for attr in ('sockets', 'cores', 'threads'))
+
+    def topology(self):
+        if not self.has_topology():
+            return {}
+
+        topology = self.root.find('cpu/topology')
+        return {'sockets': int(topology.get('sockets')),
+                'cores': int(topology.get('cores')),
+                'threads': int(topology.get('threads'))}
+
+    def has_cpu_numa(self):
+        return self.root.find('cpu/numa') is not None
+
+    @property
+    def maxvcpus(self):
+        return int(self._get_first('./vcpu'))
+
+    @property
+    def vcpus(self):
+        current = self._get_first('./vcpu/@current')
+        return int(current) if current else self.maxvcpus
+
+    @property
+    def memory(self):
+        """
+        Memory in KiB as set in the <memory> tag
+        """
+        memory = self._get_first('./memory')
+        return int(memory) if memory else None
+
+    @property
+    def max_memory(self):
+        """
+        Maximum memory in KiB as set in the <maxMemory> tag, or None
+        """
+        max_memory = self._get_first('./maxMemory')
+        return int(max_memory) if max_memory else None
+
+    def mem_devs_size(self):
+        """
+        Total size in KiB of all memory devices attached to the domain
+        """
+        total = 0
+        for size in self._find_devices('./memory/target/size'):
+            total += convert_data_size(size.text, size.get('unit'), 'KiB')
+        return int(total)
+
+    def boot(self):
+        return self.get_text('os/boot/@dev')
+
+    def bootmenu(self):
+        return "yes" if "yes" in self.get_text('os/bootmenu/@enable') \
+            else "no"
+
+    def console_target(self):
+        return self._get_first('/domain/devices/console/target/@type')
+
+    def metadata_node(self, tag):
+        """
+        Return the Kimchi metadata element 'tag' without namespaces, as
+        returned by wok.plugins.kimchi.model.utils.get_metadata_node(), or ""
+        when it does not exist.
+        """
+        node = self.root.find('metadata/{%s}metadata/{%s}%s' %
+                              (KIMCHI_META_URL, KIMCHI_META_URL, tag))
+        if node is None:
+            return ""
+
+        node = ET.fromstring(ET.tostring(node))
+        for elem in node.iter():
+            if isinstance(elem.tag, basestring):
+                elem.tag = ET.QName(elem).localname
+        ET.cleanup_namespaces(node)
+        return ET.tostring(node)
+
+    def os_metadata(self):
+        """
+        Return the tuple (version, distro) stored in Kimchi metadata
+        """
+        os_elem = ET.fromstring(self.metadata_node('os') or "<os></os>")
+        return (os_elem.attrib.get("version"), os_elem.attrib.get("distro"))